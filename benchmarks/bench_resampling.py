@@ -0,0 +1,134 @@
+"""
+Compare the NumPy and SimpleITK resampling backends.
+
+    uv run python benchmarks/bench_resampling.py                # synthetic study of suite.py
+    uv run python benchmarks/bench_resampling.py --size large
+    uv run python benchmarks/bench_resampling.py -d1 <source_dicom> -m <mask> -d2 <target_dicom>
+
+The series are read once, then _register_mask is timed per backend and subpixel factor.
+"first" includes building the resampling plan for the NumPy backend, "median" covers the
+repeats that reuse it.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import SimpleITK as sitk
+from suite import SIZES
+
+from MaskRegistration.backend import _register_mask
+from MaskRegistration.resampling import BACKENDS, Geometry, _plan_cache
+from MaskRegistration.synthetic import write_series
+from MaskRegistration.utils import mask_to_dicom, split_dcm
+
+
+def read_inputs(source: Path, mask: Path, target: Path) -> tuple:
+    reader = sitk.ImageSeriesReader()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        mask_to_dicom(source, mask, Path(temp_dir))
+        reader.SetFileNames(reader.GetGDCMSeriesFileNames(temp_dir))
+        mask_image = reader.Execute()
+    reader.SetFileNames(split_dcm(reader.GetGDCMSeriesFileNames(target.as_posix()))[0])
+    target_image = reader.Execute()
+    return (
+        sitk.GetArrayFromImage(mask_image),
+        Geometry.from_image(mask_image),
+        Geometry.from_image(target_image),
+    )
+
+
+def run(
+    source: Path,
+    mask: Path,
+    target: Path,
+    repeat: int,
+    subpixel_factors: list,
+    crop: bool = False,
+) -> None:
+    mask_arr, mask_geometry, target_geometry = read_inputs(source, mask, target)
+    print(f"mask {mask_geometry.size} -> target {target_geometry.size}")
+    print(
+        f"{'backend':<8} {'subpixel':>8} {'first [s]':>10} {'median [s]':>11} {'differing':>10}"
+    )
+    for subpixel_factor in subpixel_factors:
+        results = {}
+        for name in BACKENDS:
+            _plan_cache.clear()
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                results[name] = _register_mask(
+                    mask_arr,
+                    mask_geometry,
+                    target_geometry,
+                    subpixel_factor,
+                    name,
+                    crop,
+                )
+                times.append(time.perf_counter() - start)
+            differing = np.count_nonzero(results[name] != results[next(iter(results))])
+            print(
+                f"{name:<8} {subpixel_factor:>8} {times[0]:>10.3f} "
+                f"{np.median(times[1:] or times):>11.3f} {differing:>10}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resampling backend benchmark")
+    parser.add_argument(
+        "-d1", "--input_dcm1", type=Path, default=None, help="default: synthetic study"
+    )
+    parser.add_argument(
+        "-m",
+        "--input_mask",
+        type=Path,
+        default=None,
+        help="default: mask.nii.gz in -d1",
+    )
+    parser.add_argument(
+        "-d2", "--input_dcm2", type=Path, default=None, help="default: synthetic study"
+    )
+    parser.add_argument(
+        "--size", choices=list(SIZES), default="small", help="synthetic study size"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--subpixel", type=int, nargs="+", default=[1, 3, 9])
+    parser.add_argument(
+        "--crop", action="store_true", help="register around the mask labels only"
+    )
+    args = parser.parse_args()
+
+    if (args.input_dcm1 is None) != (args.input_dcm2 is None):
+        parser.error(
+            "-d1 and -d2 are given together (or neither, for the synthetic study)"
+        )
+    if args.input_dcm1 is None:
+        with tempfile.TemporaryDirectory() as folder:
+            source_kwargs, target_kwargs = SIZES[args.size]
+            write_series(Path(folder) / "source", **source_kwargs)
+            write_series(Path(folder) / "target", **target_kwargs)
+            source, target = Path(folder) / "source", Path(folder) / "target"
+            run(
+                source,
+                source / "mask.nii.gz",
+                target,
+                args.repeat,
+                args.subpixel,
+                args.crop,
+            )
+        return
+
+    mask = args.input_mask or args.input_dcm1 / "mask.nii.gz"
+    for folder in (args.input_dcm1, args.input_dcm2):
+        if not folder.is_dir():
+            parser.error(f"DICOM folder not found: {folder}")
+    if not mask.is_file():
+        parser.error(f"Mask not found: {mask}")
+    run(args.input_dcm1, mask, args.input_dcm2, args.repeat, args.subpixel, args.crop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+"""
+Load test for the web viewer with several concurrent reviewers.
+
+    uv run python benchmarks/loadtest.py                         # in-process uvicorn, 4 users, 30 s
+    uv run python benchmarks/loadtest.py --users 16 --duration 60 --size large
+    uv run python benchmarks/loadtest.py --url http://127.0.0.1:8000 --scenarios scroll drag
+
+Writes a synthetic study (see suite.py), loads it through the API and lets --users
+threads replay reviewer sessions until --duration is over. Each user runs one scenario,
+assigned round-robin from --scenarios:
+
+    scroll    page through source, target and aligned slices with the mask overlay
+    echo      switch echoes of both series and look at a few slices after each switch
+    drag      drag the manual transform sliders, one /api/transform preview per step and
+              a full resolution render when the gesture ends
+    stream    scroll like "scroll", but through the /api/stream WebSocket without waiting
+              for frames; latency is send to frame, views the server dropped count as
+              superseded
+    register  start a registration and poll its status until it is done
+
+Reports p50/p95/p99 latency and throughput per endpoint, plus the server RSS sampled
+from /api/metrics every --sample-interval seconds. --output stores everything as JSON.
+"""
+
+import argparse
+import http.client
+import json
+import random
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from suite import SIZES
+
+from MaskRegistration.synthetic import write_series
+
+# Pause between steps, like the viewer's 50 ms debounce while scrolling or dragging
+THINK_TIME = (0.02, 0.06)
+
+
+class Client:
+    """Keep-alive HTTP client of one virtual user, recording (endpoint, seconds, status)."""
+
+    def __init__(self, url: str, records: list):
+        parts = urlsplit(url)
+        self.url = url
+        self.connection = http.client.HTTPConnection(
+            parts.hostname, parts.port or 80, timeout=120
+        )
+        self.records = records
+
+    def request(
+        self, method: str, path: str, endpoint: str, body: dict = None
+    ) -> bytes:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        payload = json.dumps(body) if body is not None else None
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, payload, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            data, status = b"", 0
+        self.records.append((endpoint, time.perf_counter() - start, status))
+        return data
+
+    def get(self, path: str, endpoint: str) -> bytes:
+        return self.request("GET", path, endpoint)
+
+    def post(self, path: str, endpoint: str, body: dict = None) -> bytes:
+        return self.request("POST", path, endpoint, body if body is not None else {})
+
+
+def think(rng: random.Random) -> None:
+    time.sleep(rng.uniform(*THINK_TIME))
+
+
+def scroll(
+    client: Client, study: dict, rng: random.Random, stop: threading.Event
+) -> None:
+    index, step = rng.randrange(study["source_slices"]), 1
+    while not stop.is_set():
+        if not 0 <= index + step < study["source_slices"] or rng.random() < 0.05:
+            step = -step
+        index += step
+        target_index = index * study["target_slices"] // study["source_slices"]
+        client.get(
+            f"/api/slice/source/{index}?mask=true&t={time.time()}", "/api/slice/source"
+        )
+        client.get(
+            f"/api/slice/target/{target_index}?mask=true&t={time.time()}",
+            "/api/slice/target",
+        )
+        client.get(
+            f"/api/slice/aligned/{index}?mask=true&t={time.time()}",
+            "/api/slice/aligned",
+        )
+        think(rng)
+
+
+def echo(
+    client: Client, study: dict, rng: random.Random, stop: threading.Event
+) -> None:
+    while not stop.is_set():
+        for side in ("source", "target"):
+            client.post(
+                f"/api/echo/{side}/{rng.randrange(study[f'{side}_echoes'])}",
+                "/api/echo",
+            )
+        for _ in range(3):
+            index = rng.randrange(study["source_slices"])
+            client.get(f"/api/slice/source/{index}?mask=true", "/api/slice/source")
+            client.get(f"/api/slice/aligned/{index}?mask=true", "/api/slice/aligned")
+            think(rng)
+
+
+def drag(
+    client: Client, study: dict, rng: random.Random, stop: threading.Event
+) -> None:
+    index = study["source_slices"] // 2
+    while not stop.is_set():
+        # One slider gesture: 20 small steps in one direction
+        parameter = rng.choice(["offset_x", "offset_y", "rotation_z", "scale_x"])
+        value, step = (
+            (1.0, 0.01)
+            if parameter.startswith("scale")
+            else (0.0, rng.choice([-0.5, 0.5]))
+        )
+        query = f"/api/transform/{index}?mask=true&apply_offset=true&apply_rotation=true&apply_scale=true"
+        for _ in range(20):
+            if stop.is_set():
+                return
+            value += step
+            client.get(
+                f"{query}&{parameter}={value:.3f}&preview=true",
+                "/api/transform preview",
+            )
+            think(rng)
+        client.get(f"{query}&{parameter}={value:.3f}", "/api/transform")
+
+
+def register(
+    client: Client, study: dict, rng: random.Random, stop: threading.Event
+) -> None:
+    while not stop.is_set():
+        task = json.loads(
+            client.post("/api/register", "/api/register", {"reverse": "auto"}) or "{}"
+        )
+        if "task_id" not in task:
+            time.sleep(1)
+            continue
+        while not stop.is_set():
+            status = json.loads(
+                client.get(f"/api/status/{task['task_id']}", "/api/status") or "{}"
+            )
+            if status.get("status") != "running":
+                break
+            time.sleep(0.2)
+
+
+def stream(
+    client: Client, study: dict, rng: random.Random, stop: threading.Event
+) -> None:
+    from websockets.sync.client import connect
+
+    parts = urlsplit(client.url)
+    sent = {}
+    with connect(
+        f"ws://{parts.hostname}:{parts.port or 80}/api/stream", max_size=None
+    ) as websocket:
+
+        def read_frames():
+            for frame in websocket:
+                length = int.from_bytes(frame[:4], "big")
+                header = json.loads(frame[4 : 4 + length])
+                seq = header["seq"]
+                # Older views of the channel were dropped by the server
+                superseded = [
+                    key
+                    for key, (channel, _) in list(sent.items())
+                    if channel == header["channel"]
+                ]
+                for older in [key for key in superseded if key < seq]:
+                    client.records.append(("/api/stream superseded", 0.0, 200))
+                    del sent[older]
+                status = 422 if "error" in header else 200
+                client.records.append(
+                    ("/api/stream", time.perf_counter() - sent.pop(seq)[1], status)
+                )
+
+        reader = threading.Thread(target=read_frames, daemon=True)
+        reader.start()
+        index, step, seq = rng.randrange(study["source_slices"]), 1, 0
+        while not stop.is_set():
+            if not 0 <= index + step < study["source_slices"] or rng.random() < 0.05:
+                step = -step
+            index += step
+            for channel, endpoint, params in (
+                ("source", "slice", {"side": "source", "index": index, "mask": "true"}),
+                ("aligned", "aligned", {"index": index, "mask": "true"}),
+            ):
+                seq += 1
+                sent[seq] = (channel, time.perf_counter())
+                websocket.send(
+                    json.dumps(
+                        {
+                            "channel": channel,
+                            "seq": seq,
+                            "endpoint": endpoint,
+                            "params": params,
+                        }
+                    )
+                )
+            think(rng)
+        # Wait for the last frames before closing
+        deadline = time.perf_counter() + 10
+        while sent and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        websocket.close()
+        reader.join()
+
+
+SCENARIOS = {
+    "scroll": scroll,
+    "echo": echo,
+    "drag": drag,
+    "register": register,
+    "stream": stream,
+}
+
+
+def load_study(url: str, folder: Path, size: str) -> dict:
+    source_kwargs, target_kwargs = SIZES[size]
+    write_series(folder / "source", **source_kwargs)
+    write_series(folder / "target", **target_kwargs)
+
+    client = Client(url, [])
+    source = json.loads(
+        client.post("/api/dicom/source", "", {"path": (folder / "source").as_posix()})
+    )
+    target = json.loads(
+        client.post("/api/dicom/target", "", {"path": (folder / "target").as_posix()})
+    )
+    client.post(
+        "/api/mask/source", "", {"path": (folder / "source" / "mask.nii.gz").as_posix()}
+    )
+    task = json.loads(client.post("/api/register", "", {"reverse": "auto"}))
+    while (
+        json.loads(client.get(f"/api/status/{task['task_id']}", ""))["status"]
+        == "running"
+    ):
+        time.sleep(0.1)
+    return {
+        "source_slices": source["slices"],
+        "target_slices": target["slices"],
+        "source_echoes": source["echos"],
+        "target_echoes": target["echos"],
+    }
+
+
+def sample_rss(
+    url: str, interval: float, start: float, stop: threading.Event, samples: list
+) -> None:
+    client = Client(url, [])
+    while not stop.wait(interval):
+        for line in client.get("/api/metrics", "").decode().splitlines():
+            if line.startswith("maskregistration_rss_bytes "):
+                samples.append(
+                    (round(time.perf_counter() - start, 2), int(float(line.split()[1])))
+                )
+
+
+def start_server() -> tuple:
+    """Run the app on a free local port in a background thread."""
+    import socket
+
+    import uvicorn
+
+    from MaskRegistration.web.app import app
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server, thread
+
+
+def percentile(values: list, q: float) -> float:
+    return (
+        statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+        if len(values) > 1
+        else values[0]
+    )
+
+
+def summarize(records: list, elapsed: float) -> dict:
+    endpoints = {}
+    for endpoint, seconds, status in records:
+        endpoints.setdefault(endpoint, []).append((seconds, status))
+    summary = {}
+    for endpoint, entries in sorted(endpoints.items()):
+        latencies = [seconds for seconds, _ in entries]
+        summary[endpoint] = {
+            "requests": len(entries),
+            "errors": sum(1 for _, status in entries if not 200 <= status < 300),
+            "throughput_rps": len(entries) / elapsed,
+            "p50_s": percentile(latencies, 50),
+            "p95_s": percentile(latencies, 95),
+            "p99_s": percentile(latencies, 99),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test for the MaskRegistration web viewer"
+    )
+    parser.add_argument(
+        "--url",
+        type=str,
+        default=None,
+        help="running server (default: start one in-process)",
+    )
+    parser.add_argument("--users", type=int, default=4, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=["scroll", "drag", "echo"],
+    )
+    parser.add_argument(
+        "--size", choices=list(SIZES), default="small", help="synthetic study size"
+    )
+    parser.add_argument(
+        "--sample-interval", type=float, default=1.0, help="seconds between RSS samples"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=Path, default=None, help="write the report as JSON"
+    )
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        url, server, server_thread = start_server()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        study = load_study(url, Path(temp_dir), args.size)
+        print(f"Study loaded: {study}")
+
+        stop = threading.Event()
+        records, rss_samples, threads = [], [], []
+        start = time.perf_counter()
+        sampler = threading.Thread(
+            target=sample_rss,
+            args=(url, args.sample_interval, start, stop, rss_samples),
+            daemon=True,
+        )
+        sampler.start()
+        for user in range(args.users):
+            scenario = args.scenarios[user % len(args.scenarios)]
+            # Every user appends to its own list, merged after the run
+            user_records = []
+            records.append(user_records)
+            rng = random.Random(args.seed + user)
+            thread = threading.Thread(
+                target=SCENARIOS[scenario],
+                args=(Client(url, user_records), study, rng, stop),
+                name=f"{scenario}-{user}",
+            )
+            threads.append(thread)
+            thread.start()
+
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads + [sampler]:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    summary = summarize(
+        [record for user_records in records for record in user_records], elapsed
+    )
+    print(
+        f"\n{args.users} users ({', '.join(args.scenarios)}) for {elapsed:.1f} s against {url}"
+    )
+    print(
+        f"{'endpoint':<22} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 [ms]':>9} {'p95 [ms]':>9} {'p99 [ms]':>9}"
+    )
+    for endpoint, stats in summary.items():
+        print(
+            f"{endpoint:<22} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>8.1f} "
+            f"{stats['p50_s'] * 1000:>9.1f} {stats['p95_s'] * 1000:>9.1f} {stats['p99_s'] * 1000:>9.1f}"
+        )
+    if rss_samples:
+        rss_mb = [rss / 1024**2 for _, rss in rss_samples]
+        print(
+            f"\nServer RSS [MB]: start {rss_mb[0]:.0f}, max {max(rss_mb):.0f}, end {rss_mb[-1]:.0f}"
+        )
+    else:
+        print("\nServer RSS not available (no /proc on the server host)")
+
+    if args.output:
+        report = {
+            "users": args.users,
+            "scenarios": args.scenarios,
+            "duration_s": elapsed,
+            "size": args.size,
+            "endpoints": summary,
+            "rss_bytes": rss_samples,
+        }
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Report written to {args.output}")
+
+    if server is not None:
+        server.should_exit = True
+        server_thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Benchmark suite on synthetic studies, compared against a stored baseline.
+
+    uv run python benchmarks/suite.py                  # run and compare with baseline_small.json
+    uv run python benchmarks/suite.py --save-baseline  # store this run as the new baseline
+    uv run python benchmarks/suite.py --size large --check
+
+Covers interpreter startup (package import, CLI --help, web app import), the CLI
+pipeline per stage (from the timings transform returns), the subpixel path at several
+factors and with a densely labelled mask, split_dcm, downsample_with_or, the viewer
+renderers and the web slice endpoints. Every case reports the median of --repeat runs
+in seconds. Results are written as JSON; a case counts as regression when it is more
+than --tolerance slower than the baseline and by more than a millisecond. --check exits
+with 1 on regressions.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import SimpleITK as sitk
+
+from MaskRegistration import transform
+from MaskRegistration.synthetic import write_series
+from MaskRegistration.utils import downsample_with_or, split_dcm
+
+BENCHMARK_DIR = Path(__file__).parent
+
+# (source, target) keyword arguments for write_series
+SIZES = {
+    "small": (
+        dict(size=(128, 128), slices=24, echoes=2, labels=3),
+        dict(
+            size=(96, 96),
+            slices=32,
+            echoes=3,
+            orientation="axial",
+            spacing=(0.7, 0.7, 1.0),
+            tilt=8,
+        ),
+    ),
+    "large": (
+        dict(
+            size=(384, 384),
+            slices=80,
+            echoes=2,
+            labels=6,
+            spacing=(0.36, 0.36, 0.7),
+            radius=40,
+        ),
+        dict(
+            size=(256, 256),
+            slices=48,
+            echoes=4,
+            orientation="axial",
+            slice_order="descending",
+            spacing=(0.45, 0.45, 1.5),
+            tilt=8,
+            radius=40,
+        ),
+    ),
+}
+SUBPIXEL_FACTORS = (1, 3, 9)
+
+
+def summarize(times: list) -> dict:
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "runs": len(times),
+    }
+
+
+def measure(func, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def bench_pipeline(source: Path, target: Path, out_dir: Path, repeat: int) -> dict:
+    results = {}
+    for subpixel_factor in SUBPIXEL_FACTORS:
+        stages, totals = {}, []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = transform(
+                source,
+                source / "mask.nii.gz",
+                target,
+                out_dir / "out.nii.gz",
+                subpixel_factor=subpixel_factor,
+                trace_memory=False,
+            )
+            totals.append(time.perf_counter() - start)
+            for stage, timing in result["timings"].items():
+                stages.setdefault(stage, []).append(timing["wall_s"])
+
+        prefix = "pipeline" if subpixel_factor == 1 else f"subpixel/{subpixel_factor}"
+        cases = {"total": totals, **stages}
+        if subpixel_factor > 1:
+            # The other stages do not depend on the factor
+            cases = {name: cases[name] for name in ("total", "resample", "downsample")}
+        for name, times in cases.items():
+            results[f"{prefix}/{name}"] = summarize(times)
+
+    # Every voxel labelled, the worst case for the label reduction of the subpixel path
+    mask = sitk.ReadImage(str(source / "mask.nii.gz"))
+    labels = np.random.default_rng(0).integers(0, 4, mask.GetSize()[::-1], np.uint8)
+    dense = sitk.GetImageFromArray(labels)
+    dense.CopyInformation(mask)
+    sitk.WriteImage(dense, str(out_dir / "dense.nii.gz"))
+    cases = {"total": [], "resample": [], "downsample": []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = transform(
+            source,
+            out_dir / "dense.nii.gz",
+            target,
+            out_dir / "out.nii.gz",
+            subpixel_factor=SUBPIXEL_FACTORS[-1],
+            trace_memory=False,
+        )
+        cases["total"].append(time.perf_counter() - start)
+        for stage in ("resample", "downsample"):
+            cases[stage].append(result["timings"][stage]["wall_s"])
+    for name, times in cases.items():
+        results[f"dense/{SUBPIXEL_FACTORS[-1]}/{name}"] = summarize(times)
+    return results
+
+
+def bench_startup(repeat: int) -> dict:
+    commands = {
+        "startup/import_package": "import MaskRegistration",
+        "startup/cli_help": (
+            "import sys; sys.argv = ['maskregistration', '--help']\n"
+            "from MaskRegistration.MaskRegistration import main\n"
+            "try:\n    main()\nexcept SystemExit:\n    pass"
+        ),
+        "startup/web_app": "import MaskRegistration.web.app",
+    }
+    return {
+        name: measure(
+            lambda: subprocess.run(
+                [sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL
+            ),
+            repeat,
+        )
+        for name, code in commands.items()
+    }
+
+
+def bench_utils(source: Path, target: Path, repeat: int) -> dict:
+    reader = sitk.ImageSeriesReader()
+    target_files = reader.GetGDCMSeriesFileNames(target.as_posix())
+    results = {"split_dcm": measure(lambda: split_dcm(target_files), repeat)}
+
+    reader.SetFileNames(split_dcm(target_files)[0])
+    shape = sitk.GetArrayFromImage(reader.Execute()).shape
+    rng = np.random.default_rng(0)
+    for factor in SUBPIXEL_FACTORS[1:]:
+        upsampled = rng.integers(0, 4, (shape[0] * factor, *shape[1:])).astype(np.uint8)
+        results[f"downsample_with_or/{factor}"] = measure(
+            lambda: downsample_with_or(upsampled, factor), repeat
+        )
+    return results
+
+
+def bench_web(source: Path, target: Path, repeat: int) -> dict:
+    from fastapi.testclient import TestClient
+
+    from MaskRegistration.web.app import app, render_cache, store
+    from MaskRegistration.web.viewer import slice_to_png, slice_with_mask_to_png
+
+    client = TestClient(app)
+    client.post("/api/dicom/source", json={"path": source.as_posix()})
+    client.post("/api/dicom/target", json={"path": target.as_posix()})
+    client.post("/api/mask/source", json={"path": (source / "mask.nii.gz").as_posix()})
+    task_id = client.post("/api/register", json={"reverse": "auto"}).json()["task_id"]
+    while client.get(f"/api/status/{task_id}").json()["status"] == "running":
+        time.sleep(0.05)
+
+    volume, mask = store.get_dicom("source"), store.source_mask
+    middle = volume.shape[0] // 2
+    endpoints = {
+        "web/slice": f"/api/slice/source/{middle}?mask=true",
+        "web/aligned": f"/api/slice/aligned/{middle}?mask=true",
+        "web/transform": (
+            f"/api/transform/{middle}?mask=true&apply_rotation=true&rotation_z=5&apply_offset=true&offset_x=2"
+        ),
+        "web/transform_preview": (
+            f"/api/transform/{middle}?mask=true&apply_rotation=true&rotation_z=5&apply_offset=true&offset_x=2"
+            "&preview=true"
+        ),
+    }
+    results = {
+        "viewer/slice_to_png": measure(lambda: slice_to_png(volume, middle), repeat),
+        "viewer/slice_with_mask_to_png": measure(
+            lambda: slice_with_mask_to_png(volume, mask, middle), repeat
+        ),
+    }
+
+    def render(url):
+        # Time the rendering, not the render cache
+        render_cache.clear()
+        client.get(url).raise_for_status()
+
+    for name, url in endpoints.items():
+        results[name] = measure(lambda: render(url), repeat)
+    store.reset()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Print the comparison table and return the regressed case names."""
+    regressions = []
+    print(f"{'case':<36} {'median [s]':>11} {'baseline [s]':>13} {'ratio':>7}")
+    for name, result in results.items():
+        current = result["median_s"]
+        if name not in baseline:
+            print(f"{name:<36} {current:>11.4f} {'-':>13} {'-':>7}")
+            continue
+        reference = baseline[name]["median_s"]
+        ratio = current / reference if reference else float("inf")
+        regressed = ratio > 1 + tolerance and current - reference > 1e-3
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<36} {current:>11.4f} {reference:>13.4f} {ratio:>7.2f}{flag}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MaskRegistration benchmark suite")
+    parser.add_argument("--size", choices=list(SIZES), default="small")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--output", type=Path, default=BENCHMARK_DIR / "results" / "latest.json"
+    )
+    parser.add_argument(
+        "--baseline", type=Path, default=None, help="default: baseline_<size>.json"
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="write the results to --baseline"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)"
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="exit with 1 on regressions"
+    )
+    args = parser.parse_args()
+    baseline_file = args.baseline or BENCHMARK_DIR / f"baseline_{args.size}.json"
+
+    source_kwargs, target_kwargs = SIZES[args.size]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+        write_series(temp_dir / "source", **source_kwargs)
+        write_series(temp_dir / "target", **target_kwargs)
+
+        results = bench_startup(args.repeat)
+        results.update(
+            bench_pipeline(
+                temp_dir / "source", temp_dir / "target", temp_dir, args.repeat
+            )
+        )
+        results.update(
+            bench_utils(temp_dir / "source", temp_dir / "target", args.repeat)
+        )
+        results.update(bench_web(temp_dir / "source", temp_dir / "target", args.repeat))
+
+    report = {
+        "meta": {
+            "size": args.size,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "simpleitk": sitk.Version_VersionString(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        baseline_file.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Baseline written to {baseline_file}")
+        return
+
+    if not baseline_file.exists():
+        compare(results, {}, args.tolerance)
+        print(f"No baseline at {baseline_file}, run with --save-baseline to create one")
+        return
+    baseline = json.loads(baseline_file.read_text())
+    if baseline["meta"]["size"] != args.size:
+        print(f"Warning: baseline was recorded with --size {baseline['meta']['size']}")
+    regressions = compare(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
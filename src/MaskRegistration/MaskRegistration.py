@@ -1,22 +1,50 @@
 #!/usr/bin/python
 
 import argparse
+import json
+import os
+import sys
 from pathlib import Path
 
-from MaskRegistration.backend import transform
-
 
 def main():
-    parser = argparse.ArgumentParser(description="Mask Registration")
+    if sys.argv[1:2] == ["watch"]:
+        from MaskRegistration.watch import main as watch
+
+        return watch(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(
+        description="Mask Registration",
+        epilog="Run 'maskregistration watch --help' for the watch-folder daemon.",
+    )
     parser.add_argument(
-        "-d1", "--input_dcm1", type=str, help="path to the first DICOM folder"
+        "-d1",
+        "--input_dcm1",
+        type=str,
+        required=True,
+        help="path to the first DICOM folder",
     )
-    parser.add_argument("-m", "--input_mask", type=str, help="path to the mask file")
     parser.add_argument(
-        "-d2", "--input_dcm2", type=str, help="path to the second DICOM folder"
+        "-m",
+        "--input_mask",
+        type=str,
+        nargs="+",
+        required=True,
+        help="path to the mask file(s)",
     )
     parser.add_argument(
-        "-o", "--output_mask", type=str, help="path to the output NIFTI file"
+        "-d2",
+        "--input_dcm2",
+        type=str,
+        required=True,
+        help="path to the second DICOM folder",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_mask",
+        type=str,
+        nargs="+",
+        help="path to the output NIFTI file(s), one per mask file (not needed with --plan)",
     )
     parser.add_argument(
         "--subpixel",
@@ -31,17 +59,102 @@ def main():
         default="auto",
         help="read target DICOM in reverse Z order (auto = try both, pick better)",
     )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=["numpy", "sitk"],
+        default="sitk",
+        help="resampling backend: SimpleITK or vectorized NumPy plans (default: sitk)",
+    )
+    parser.add_argument(
+        "--crop",
+        action="store_true",
+        help="only resample the target region around the mask labels (faster for sparse masks)",
+    )
+
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help=(
+            "print wall time, CPU time, peak Python/numpy allocations (peak_bytes, not counting "
+            "SimpleITK) and resident memory after the stage (rss_bytes) per stage as JSON"
+        ),
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="only print the estimated peak memory and runtime per stage as JSON (reads headers only)",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=str,
+        default=os.environ.get("MASKREGISTRATION_MAX_MEMORY"),
+        help="memory ceiling, e.g. 8G: chunk the subpixel grid or run the auto-detect trials one after "
+        "the other if needed, refuse the job if nothing fits (default: MASKREGISTRATION_MAX_MEMORY)",
+    )
 
     args = parser.parse_args()
+    # A plan does not need the output files
+    if not args.plan and not args.output_mask:
+        parser.error("the following arguments are required: -o/--output_mask")
+    if not args.plan and len(args.input_mask) != len(args.output_mask):
+        parser.error("the number of output files must match the number of mask files")
     reverse_map = {"auto": None, "true": True, "false": False}
-    transform(
+    strategy = {}
+    if args.plan or args.max_memory:
+        from MaskRegistration.planner import parse_size, plan_registration
+
+        try:
+            memory_limit = parse_size(args.max_memory) if args.max_memory else None
+        except ValueError as e:
+            parser.error(str(e))
+        plan = plan_registration(
+            Path(args.input_dcm1),
+            [Path(m) for m in args.input_mask],
+            Path(args.input_dcm2),
+            subpixel_factor=args.subpixel,
+            reverse=reverse_map[args.reverse],
+            backend=args.backend,
+            crop=args.crop,
+            memory_limit=memory_limit,
+        )
+        if args.plan:
+            print(json.dumps(plan, indent=2))
+            return
+        if not plan["fits"]:
+            parser.exit(
+                1,
+                f"Refusing the job: estimated peak memory {plan['peak_bytes'] / 1024**3:.2f} GiB exceeds "
+                f"--max-memory {memory_limit / 1024**3:.2f} GiB even with chunking\n",
+            )
+        strategy = {
+            key: plan["options"][key] for key in ("chunk_slices", "sequential_trials")
+        }
+
+    # Imaging libraries are only loaded once the arguments are valid
+    from MaskRegistration.backend import transform
+
+    result = transform(
         input_dicom_folder_1=Path(args.input_dcm1),
-        input_mask_file=Path(args.input_mask),
+        input_mask_file=[Path(m) for m in args.input_mask],
         input_dicom_folder_2=Path(args.input_dcm2),
-        out_nii_file=Path(args.output_mask),
+        out_nii_file=[Path(o) for o in args.output_mask],
         subpixel_factor=args.subpixel,
         reverse=reverse_map[args.reverse],
+        backend=args.backend,
+        crop=args.crop,
+        trace_memory=args.timings,
+        **strategy,
     )
+    for mask_file, report in zip(args.input_mask, result["labels"]):
+        if report["missing"]:
+            missing = ", ".join(str(label) for label in report["missing"])
+            print(
+                f"Warning: label(s) {missing} of {mask_file} missing after registration",
+                file=sys.stderr,
+            )
+    if args.timings:
+        print(json.dumps(result["timings"], indent=2))
 
 
 if __name__ == "__main__":
@@ -1 +1,10 @@
-from MaskRegistration.backend import transform
+__all__ = ["transform"]
+
+
+def __getattr__(name: str):
+    # transform pulls in SimpleITK, nibabel and pydicom, so load it on first access only
+    if name == "transform":
+        from MaskRegistration.backend import transform
+
+        return transform
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,103 +1,293 @@
 import tempfile
+from pathlib import Path
 
+import nibabel as nib
 import numpy as np
 import SimpleITK as sitk
 
+from MaskRegistration.metrics import StageTimer
+from MaskRegistration.resampling import Geometry, get_backend
 from MaskRegistration.utils import *
 
 
-def downsample_with_or(arr: np.ndarray, factor: int) -> np.ndarray:
-    """Downsample Z-axis using OR logic: if any sub-pixel is positive, result is positive."""
-    arr = np.round(arr).astype(np.uint8)
-    z_size = arr.shape[0]
-    new_z = z_size // factor
-    labels = np.unique(arr[arr > 0])
-    result = np.zeros((new_z, arr.shape[1], arr.shape[2]), dtype=np.uint8)
+def _target_bounding_box(
+    mask: np.ndarray, mask_geometry: Geometry, target: Geometry, margin: int = 1
+) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Target index range (start, stop in ITK order) that can receive non-zero labels.
+
+    The index bounding box of the labels, widened by half a voxel, is mapped through its
+    physical corners into the target grid and padded by margin voxels. Returns None for
+    an empty mask or when the labels lie outside the target grid.
+    """
+    in_plane = mask.any(axis=0)
+    per_axis = [
+        np.flatnonzero(in_plane.any(axis=0)),
+        np.flatnonzero(in_plane.any(axis=1)),
+    ]
+    per_axis.append(np.flatnonzero(mask.any(axis=(1, 2))))
+    if len(per_axis[2]) == 0:
+        return None
+    low = np.array([idx[0] for idx in per_axis]) - 0.5
+    high = np.array([idx[-1] for idx in per_axis]) + 0.5
 
-    for label in labels:
-        binary = (arr == label)
-        for z in range(new_z):
-            z_start = z * factor
-            z_end = z_start + factor
-            result[z][binary[z_start:z_end].any(axis=0)] = label
+    corners = np.array(
+        [
+            [(low, high)[bit][k] for k, bit in enumerate(bits)]
+            for bits in np.ndindex(2, 2, 2)
+        ]
+    )
+    points = (
+        np.asarray(mask_geometry.origin) + corners @ mask_geometry.index_to_physical().T
+    )
+    target_index = (points - np.asarray(target.origin)) @ target.physical_to_index().T
 
-    return result
+    start = np.maximum(np.floor(target_index.min(axis=0)).astype(int) - margin, 0)
+    stop = np.minimum(
+        np.ceil(target_index.max(axis=0)).astype(int) + margin + 1, target.size
+    )
+    if (stop <= start).any():
+        return None
+    return start, stop
+
+
+def _register_mask_cropped(
+    mask: np.ndarray,
+    mask_geometry: Geometry,
+    target: Geometry,
+    subpixel_factor: int,
+    backend: str = "sitk",
+    timer: StageTimer | None = None,
+    chunk_slices: int | None = None,
+) -> tuple[np.ndarray, tuple]:
+    """
+    Register only the part of the target grid around the labels.
+
+    Returns the registered crop and its (z, y, x) offset in the target array. Resampling
+    and the subpixel OR reduction then scale with the label extent, not the target size.
+    """
+    timer = timer or StageTimer(trace_memory=False)
+    with timer.stage("crop"):
+        box = _target_bounding_box(mask, mask_geometry, target)
+    if box is None:
+        return np.zeros((0, 0, 0), dtype=np.uint8), (0, 0, 0)
+    start, stop = box
+    origin = np.asarray(target.origin) + target.index_to_physical() @ start
+    region = Geometry(origin, target.spacing, target.direction, stop - start)
+    registered = _register_mask(
+        mask,
+        mask_geometry,
+        region,
+        subpixel_factor,
+        backend,
+        timer=timer,
+        chunk_slices=chunk_slices,
+    )
+    return registered, tuple(int(v) for v in start[::-1])
 
 
 def _register_mask(
-    mask: sitk.Image,
-    target: sitk.Image,
+    mask: np.ndarray,
+    mask_geometry: Geometry,
+    target: Geometry,
     subpixel_factor: int,
-) -> sitk.Image:
-    """Internal function to perform the actual registration."""
-    resampleFilter = sitk.ResampleImageFilter()
-    resampleFilter.SetInterpolator(sitk.sitkNearestNeighbor)
-    resampleFilter.SetDefaultPixelValue(0.0)
+    backend: str = "sitk",
+    crop: bool = False,
+    timer: StageTimer | None = None,
+    chunk_slices: int | None = None,
+    cache_plans: bool = True,
+) -> np.ndarray:
+    """
+    Internal function to perform the actual registration.
 
-    target_size = list(target.GetSize())
-    target_spacing = list(target.GetSpacing())
+    With chunk_slices the target is registered in slabs of that many slices, so the
+    subpixel grid is never held for more than one slab. The plans of the slabs are not
+    cached, they would add up to the plan of the whole grid.
+    """
+    timer = timer or StageTimer(trace_memory=False)
+    if crop:
+        cropped, offset = _register_mask_cropped(
+            mask, mask_geometry, target, subpixel_factor, backend, timer, chunk_slices
+        )
+        registered = np.zeros(target.shape, dtype=np.uint8)
+        region = tuple(slice(o, o + n) for o, n in zip(offset, cropped.shape))
+        registered[region] = cropped
+        return registered
 
+    if chunk_slices and chunk_slices < target.size[2]:
+        registered = np.empty(target.shape, dtype=np.uint8)
+        slice_step = target.index_to_physical()[:, 2]
+        for z_start in range(0, target.size[2], chunk_slices):
+            z_stop = min(z_start + chunk_slices, target.size[2])
+            slab = Geometry(
+                np.asarray(target.origin) + slice_step * z_start,
+                target.spacing,
+                target.direction,
+                (target.size[0], target.size[1], z_stop - z_start),
+            )
+            registered[z_start:z_stop] = _register_mask(
+                mask,
+                mask_geometry,
+                slab,
+                subpixel_factor,
+                backend,
+                timer=timer,
+                cache_plans=False,
+            )
+        return registered
+
+    grid = target.with_subpixel(subpixel_factor)
+    with timer.stage("resample"):
+        registered = get_backend(backend, cache_plans).resample(
+            mask, mask_geometry, grid
+        )
     if subpixel_factor > 1:
-        target_size[2] = target_size[2] * subpixel_factor
-        target_spacing[2] = target_spacing[2] / subpixel_factor
+        with timer.stage("downsample"):
+            registered = downsample_with_or(registered, subpixel_factor)
+    return registered
 
-    resampleFilter.SetSize(target_size)
-    resampleFilter.SetOutputOrigin(target.GetOrigin())
-    resampleFilter.SetOutputSpacing(target_spacing)
-    resampleFilter.SetOutputDirection(target.GetDirection())
-    resampleFilter.SetOutputPixelType(sitk.sitkInt8)
 
-    registered = resampleFilter.Execute(mask)
+def _score_mask(stats: dict) -> tuple[int, int]:
+    """Score a mask by number of unique labels and total pixels, from its label_statistics."""
+    return len(stats), sum(s["voxels"] for s in stats.values())
 
-    if subpixel_factor > 1:
-        arr = sitk.GetArrayFromImage(registered)
-        arr = downsample_with_or(arr, subpixel_factor)
-        registered = sitk.GetImageFromArray(arr)
-        registered.SetOrigin(target.GetOrigin())
-        registered.SetSpacing(target.GetSpacing())
-        registered.SetDirection(target.GetDirection())
 
-    return sitk.Cast(registered, sitk.sitkUInt8)
+def coarse_register(
+    mask: np.ndarray,
+    mask_geometry: Geometry,
+    target: Geometry,
+    reverse: bool = None,
+    shrink: int = 2,
+) -> tuple[np.ndarray, Geometry, bool]:
+    """
+    Fast low-resolution registration of an in-memory mask, for previews.
+
+    The mask is resampled with the numpy backend onto every shrink-th target voxel
+    in-plane, without subpixel upsampling, and each coarse voxel is repeated to fill
+    the full target grid. With reverse None the direction is picked as in transform,
+    by the score of both coarse results. Returns the mask on the (possibly reversed)
+    target grid, that grid and the direction used. The mask slices must be in the order
+    of mask_geometry; a mask in file order is reordered with utils.mask_slice_order.
+    """
+    resampler = get_backend("numpy")
 
+    def register(try_target: Geometry) -> np.ndarray:
+        return resampler.resample(
+            mask, mask_geometry, try_target.in_plane_shrunk(shrink)
+        )
 
-def _score_mask(arr: np.ndarray) -> tuple[int, int]:
-    """Score a mask by number of unique labels and total pixels."""
-    arr = np.round(arr).astype(np.uint8)
-    n_labels = len(np.unique(arr[arr > 0]))
-    n_pixels = np.sum(arr > 0)
-    return n_labels, n_pixels
+    if reverse is None:
+        results = {False: register(target), True: register(target.reversed())}
+        scores = {
+            r: _score_mask(label_statistics(result)) for r, result in results.items()
+        }
+        reverse = scores[True] > scores[False]
+        coarse = results[reverse]
+    else:
+        coarse = register(target.reversed() if reverse else target)
+    if reverse:
+        target = target.reversed()
+    full = coarse.repeat(shrink, axis=1).repeat(shrink, axis=2)[
+        :, : target.shape[1], : target.shape[2]
+    ]
+    return full, target, reverse
 
 
 def transform(
     input_dicom_folder_1: Path,
-    input_mask_file: Path,
+    input_mask_file: Path | list[Path],
     input_dicom_folder_2: Path,
-    out_nii_file: Path,
+    out_nii_file: Path | list[Path],
     reverse: bool = None,
     subpixel_factor: int = 1,
+    backend: str = "sitk",
+    crop: bool = False,
+    trace_memory: bool = False,
+    chunk_slices: int = None,
+    sequential_trials: bool = False,
 ):
     """
     Transforms the mask image to align with the images in the second DICOM folder.
 
     Parameters:
     input_dicom_folder_1 (Path): Path to the first DICOM folder.
-    input_mask_file (Path): Path to the mask file.
+    input_mask_file (Path | list[Path]): Path to the mask file, or a list of mask files
+        that all belong to the first DICOM folder.
     input_dicom_folder_2 (Path): Path to the second DICOM folder.
-    out_nii_file (Path): Path to the output NIFTI file.
+    out_nii_file (Path | list[Path]): Path to the output NIFTI file, one per mask file.
     reverse (bool, optional): Read target in reverse order. None = auto-detect (default).
     subpixel_factor (int, optional): Upsample target Z-axis by this factor before registration,
         then downsample with OR logic. Preserves small structures. Default is 1 (disabled).
+    backend (str, optional): Resampling backend, "sitk" (default, SimpleITK
+        ResampleImageFilter) or "numpy" (cached vectorized resampling plans on the
+        integer mask, much faster for repeated geometries).
+    crop (bool, optional): Only resample the target region around the mask labels and
+        paste it into an empty target-sized result. Makes large subpixel factors cheap
+        for sparse masks. Default is False.
+    trace_memory (bool, optional): Record the peak allocated memory of every stage with
+        tracemalloc. Only Python and numpy allocations are counted, not those of
+        SimpleITK; the resident set size after every stage is reported regardless.
+        Slows the registration down several times. Default is False.
+    chunk_slices (int, optional): Register the target in slabs of this many slices to
+        bound the memory of the subpixel grid (see planner). Voxels exactly halfway
+        between two source voxels may land differently than on the full grid. Default
+        is None (whole target at once).
+    sequential_trials (bool, optional): With auto-detection keep only the scores of the
+        two trial directions and register the winner again, instead of holding both
+        results. Halves the memory of the results for one extra registration. Default
+        is False.
+
+    Both DICOM series are read once per call. With several masks the slice direction is
+    auto-detected once, using the summed score of all masks.
+
+    The result contains wall time, CPU time, peak allocated memory (with trace_memory)
+    and resident set size per stage under "timings" (see metrics.StageTimer), and per
+    mask the label preservation report of utils.label_report (source and registered
+    volume of every label, missing labels) under "labels".
     """
+    mask_files = (
+        input_mask_file
+        if isinstance(input_mask_file, (list, tuple))
+        else [input_mask_file]
+    )
+    out_files = (
+        out_nii_file if isinstance(out_nii_file, (list, tuple)) else [out_nii_file]
+    )
+    if len(mask_files) != len(out_files):
+        raise ValueError(
+            f"Got {len(mask_files)} mask files but {len(out_files)} output files"
+        )
+
+    timer = StageTimer(trace_memory)
     reader = sitk.ImageSeriesReader()
 
-    # Prepare mask as DICOM
+    # Prepare masks as DICOM
     temp_dir_mask_as_dcm = tempfile.TemporaryDirectory()
-    mask_to_dicom(input_dicom_folder_1, input_mask_file, Path(temp_dir_mask_as_dcm.name))
-    reader.SetFileNames(reader.GetGDCMSeriesFileNames(temp_dir_mask_as_dcm.name))
-    mask = sitk.Cast(reader.Execute(), sitk.sitkFloat32)
+    with timer.stage("read_headers"):
+        headers = read_dicom_headers(input_dicom_folder_1)
+    masks, source_stats = [], []
+    for i, mask_file in enumerate(mask_files):
+        mask_dir = Path(temp_dir_mask_as_dcm.name) / str(i)
+        mask_dir.mkdir()
+        with timer.stage("mask_to_dicom"):
+            mask_to_dicom(input_dicom_folder_1, mask_file, mask_dir, headers=headers)
+        with timer.stage("read_mask"):
+            reader.SetFileNames(reader.GetGDCMSeriesFileNames(mask_dir.as_posix()))
+            mask_image = reader.Execute()
+            masks.append(
+                (sitk.GetArrayFromImage(mask_image), Geometry.from_image(mask_image))
+            )
+        with timer.stage("labels"):
+            source_stats.append(label_statistics(masks[-1][0], masks[-1][1].spacing))
 
-    # Get target DICOM names
-    dicom_names = split_dcm(reader.GetGDCMSeriesFileNames(input_dicom_folder_2.as_posix()))[0]
+    # Only the target geometry is needed, the reversed order just moves its origin
+    with timer.stage("split_dcm"):
+        dicom_names = split_dcm(
+            reader.GetGDCMSeriesFileNames(input_dicom_folder_2.as_posix())
+        )[0]
+    with timer.stage("read_target"):
+        reader.SetFileNames(dicom_names)
+        target = Geometry.from_image(reader.Execute())
 
     auto_detect = reverse is None
     used_reverse = reverse
@@ -106,41 +296,98 @@ def transform(
         # Try both directions, pick the better one
         results = {}
         for try_reverse in [False, True]:
-            names = dicom_names[::-1] if try_reverse else dicom_names
-            reader.SetFileNames(names)
-            target = sitk.Cast(reader.Execute(), sitk.sitkFloat32)
-            registered = _register_mask(mask, target, subpixel_factor)
-            arr = sitk.GetArrayFromImage(registered)
-            score = _score_mask(arr)
-            results[try_reverse] = (registered, target, score)
+            try_target = target.reversed() if try_reverse else target
+            registered = [
+                _register_mask(
+                    mask,
+                    mask_geometry,
+                    try_target,
+                    subpixel_factor,
+                    backend,
+                    crop,
+                    timer,
+                    chunk_slices,
+                )
+                for mask, mask_geometry in masks
+            ]
+            with timer.stage("score"):
+                stats = [label_statistics(r, try_target.spacing) for r in registered]
+                scores = [_score_mask(s) for s in stats]
+            score = (sum(s[0] for s in scores), sum(s[1] for s in scores))
+            results[try_reverse] = (
+                None if sequential_trials else registered,
+                try_target,
+                score,
+                stats,
+            )
+            del registered
 
         # Pick direction with more labels, then more pixels
         score_normal = results[False][2]
         score_reverse = results[True][2]
 
-        if score_reverse > score_normal:
-            registered, target, _ = results[True]
-            used_reverse = True
-        else:
-            registered, target, _ = results[False]
-            used_reverse = False
+        used_reverse = score_reverse > score_normal
+        registered, target, _, registered_stats = results[used_reverse]
+        del results
+        if registered is None:
+            registered = [
+                _register_mask(
+                    mask,
+                    mask_geometry,
+                    target,
+                    subpixel_factor,
+                    backend,
+                    crop,
+                    timer,
+                    chunk_slices,
+                )
+                for mask, mask_geometry in masks
+            ]
     else:
         # Use specified direction
-        names = dicom_names[::-1] if reverse else dicom_names
-        reader.SetFileNames(names)
-        target = sitk.Cast(reader.Execute(), sitk.sitkFloat32)
-        registered = _register_mask(mask, target, subpixel_factor)
+        if reverse:
+            target = target.reversed()
+        registered = [
+            _register_mask(
+                mask,
+                mask_geometry,
+                target,
+                subpixel_factor,
+                backend,
+                crop,
+                timer,
+                chunk_slices,
+            )
+            for mask, mask_geometry in masks
+        ]
+        with timer.stage("labels"):
+            registered_stats = [label_statistics(r, target.spacing) for r in registered]
 
-    # Save result
+    # Save results
     writer = sitk.ImageFileWriter()
-    writer.SetFileName(out_nii_file.as_posix())
-    writer.Execute(registered)
+    for arr, out_file in zip(registered, out_files):
+        with timer.stage("write"):
+            image = sitk.GetImageFromArray(arr)
+            image.SetOrigin(target.origin)
+            image.SetSpacing(target.spacing)
+            image.SetDirection(target.direction)
+            writer.SetFileName(out_file.as_posix())
+            writer.Execute(image)
 
-    img_nifti = nib.load(out_nii_file)
-    img = img_nifti.get_fdata()
-    img_nifti = nib.Nifti1Image(img, img_nifti.affine, img_nifti.header)
-    nib.save(img_nifti, out_nii_file)
+        with timer.stage("write_nifti"):
+            img_nifti = nib.load(out_file)
+            img = img_nifti.get_fdata()
+            img_nifti = nib.Nifti1Image(img, img_nifti.affine, img_nifti.header)
+            nib.save(img_nifti, out_file)
 
     temp_dir_mask_as_dcm.cleanup()
 
-    return {"used_reverse": used_reverse}
+    return {
+        "used_reverse": used_reverse,
+        "outputs": list(out_files),
+        "labels": [
+            label_report(source, result)
+            for source, result in zip(source_stats, registered_stats)
+        ],
+        "timings": timer.as_dict(),
+    }
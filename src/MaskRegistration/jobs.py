@@ -0,0 +1,242 @@
+"""
+Registration jobs run in worker processes, shared by the watch daemon and the job API.
+
+A job is a plain dict (picklable for the worker processes) with the source and target
+DICOM folders, the mask files, one output file per mask and the transform options
+reverse ("auto", "true" or "false"), subpixel, backend and crop. With a memory limit,
+plan_job adds the chunk_slices and sequential_trials strategy of the planner.
+"""
+
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from MaskRegistration.planner import admits, plan_registration
+
+REVERSE_MODES = {"auto": None, "true": True, "false": False}
+
+
+def run_job(job: dict) -> dict:
+    """Run one registration (in a worker process) and return its label reports and stage timings."""
+    from MaskRegistration.backend import transform
+
+    options = job["options"]
+    for output in job["outputs"]:
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+    result = transform(
+        input_dicom_folder_1=Path(job["source"]),
+        input_mask_file=[Path(m) for m in job["masks"]],
+        input_dicom_folder_2=Path(job["target"]),
+        out_nii_file=[Path(o) for o in job["outputs"]],
+        reverse=REVERSE_MODES[options["reverse"]],
+        subpixel_factor=options["subpixel"],
+        backend=options["backend"],
+        crop=options["crop"],
+        trace_memory=False,
+        chunk_slices=options.get("chunk_slices"),
+        sequential_trials=options.get("sequential_trials", False),
+    )
+    return {
+        "used_reverse": result["used_reverse"],
+        "labels": result["labels"],
+        "timings": result["timings"],
+    }
+
+
+def plan_job(job: dict, memory_limit: int = None) -> dict:
+    """Plan a job from the headers of its inputs; a strategy that fits is added to its options."""
+    options = job["options"]
+    plan = plan_registration(
+        Path(job["source"]),
+        [Path(m) for m in job["masks"]],
+        Path(job["target"]),
+        subpixel_factor=options["subpixel"],
+        reverse=REVERSE_MODES[options["reverse"]],
+        backend=options["backend"],
+        crop=options["crop"],
+        memory_limit=memory_limit,
+    )
+    if plan["fits"]:
+        options.update(
+            {key: plan["options"][key] for key in ("chunk_slices", "sequential_trials")}
+        )
+    return plan
+
+
+def refusal(plan: dict) -> str:
+    return (
+        f"Estimated peak memory {plan['peak_bytes'] / 1024**3:.2f} GiB exceeds the limit of "
+        f"{plan['memory_limit'] / 1024**3:.2f} GiB even with chunking"
+    )
+
+
+class JobQueue:
+    """
+    Jobs run on a pool of worker processes, at most workers at a time; the others wait
+    in submission order and can be cancelled until they start. The pool is started with
+    the first job. Finished jobs are kept for polling, the oldest dropped beyond
+    max_finished.
+
+    With a memory_limit, jobs are planned (see plan) and the next one only starts when
+    its planned peak fits next to those of the running jobs, so large jobs lower the
+    concurrency.
+
+    A worker that dies (e.g. killed for running out of memory) breaks the pool: the jobs
+    running on it fail and the next job starts a new pool.
+    """
+
+    FINISHED = ("done", "failed", "cancelled")
+
+    def __init__(
+        self, workers: int = 2, max_finished: int = 1000, memory_limit: int = None
+    ):
+        if workers < 1:
+            raise ValueError(f"workers must be at least 1, got {workers}")
+        self.workers = workers
+        self.max_finished = max_finished
+        self.memory_limit = memory_limit
+        self.jobs = OrderedDict()
+        self._waiting = deque()
+        # Planned peak memory of the running jobs by id
+        self._running = {}
+        self._pool = None
+        self._closed = False
+        # Futures may complete (and call _done) before add_done_callback returns
+        self._lock = threading.RLock()
+
+    def plan(self, job: dict) -> dict | None:
+        """Plan a job for the memory limit (adding its strategy to the options), None without limit."""
+        if self.memory_limit is None:
+            return None
+        return plan_job(job, self.memory_limit)
+
+    def submit(self, job: dict, plan: dict = None) -> dict:
+        """Queue a job (without "id") with its plan, returning its record."""
+        if plan is not None and not plan["fits"]:
+            raise ValueError(refusal(plan))
+        record = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "submitted": time.time(),
+            "started": None,
+            "finished": None,
+            "spec": job,
+            "result": None,
+            "error": None,
+            "plan": plan,
+        }
+        with self._lock:
+            self.jobs[record["id"]] = record
+            self._waiting.append(record["id"])
+            self._dispatch()
+        return record
+
+    def get(self, job_id: str) -> dict | None:
+        return self.jobs.get(job_id)
+
+    def list(self, status: str = None) -> list[dict]:
+        with self._lock:
+            return [
+                job
+                for job in self.jobs.values()
+                if status is None or job["status"] == status
+            ]
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job; False if it already started or finished."""
+        with self._lock:
+            job = self.jobs[job_id]
+            if job["status"] != "queued":
+                return False
+            self._waiting.remove(job_id)
+            self._finish(job, "cancelled")
+            return True
+
+    def counts(self) -> dict:
+        with self._lock:
+            counts = dict.fromkeys(("queued", "running", *self.FINISHED), 0)
+            for job in self.jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for job_id in self._waiting:
+                self._finish(self.jobs[job_id], "cancelled")
+            self._waiting.clear()
+            pool, self._pool = self._pool, None
+            self._closed = True
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def _dispatch(self) -> None:
+        # Called with the lock held
+        while self._waiting and len(self._running) < self.workers:
+            job = self.jobs[self._waiting[0]]
+            peak = job["plan"]["peak_bytes"] if job["plan"] else 0
+            if not admits(list(self._running.values()), peak, self.memory_limit):
+                break
+            self._waiting.popleft()
+            job["status"], job["started"] = "running", time.time()
+            self._running[job["id"]] = peak
+            try:
+                pool, future = self._submit(job)
+            except Exception as e:
+                del self._running[job["id"]]
+                job["error"] = f"{type(e).__name__}: {e}"
+                self._finish(job, "failed")
+                continue
+            future.add_done_callback(
+                lambda future, job=job, pool=pool: self._done(job, future, pool)
+            )
+
+    def _submit(self, job: dict) -> tuple:
+        # A pool broken by a dead worker refuses new jobs, they get a new one
+        for attempt in range(2):
+            if self._pool is None:
+                # Forking a threaded server is unsafe, workers start from a fresh interpreter
+                self._pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            pool = self._pool
+            try:
+                return pool, pool.submit(run_job, job["spec"])
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                self._discard_pool(pool)
+
+    def _discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        if pool is self._pool:
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _done(self, job: dict, future, pool: ProcessPoolExecutor) -> None:
+        with self._lock:
+            del self._running[job["id"]]
+            try:
+                job["result"] = future.result()
+            except Exception as e:
+                job["error"] = f"{type(e).__name__}: {e}"
+                self._finish(job, "failed")
+                if isinstance(e, BrokenProcessPool):
+                    self._discard_pool(pool)
+            else:
+                self._finish(job, "done")
+            if not self._closed:
+                self._dispatch()
+
+    def _finish(self, job: dict, status: str) -> None:
+        job["status"], job["finished"] = status, time.time()
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job["status"] in self.FINISHED
+        ]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
@@ -0,0 +1,192 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Seconds; registration stages and slice requests both fall somewhere in this range
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+def _start_tracing() -> None:
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_users = 1
+        elif _tracing_users > 0:
+            _tracing_users += 1
+
+
+def _stop_tracing() -> None:
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 1:
+            tracemalloc.stop()
+        _tracing_users = max(_tracing_users - 1, 0)
+
+
+class StageTimer:
+    """
+    Accumulates wall time, CPU time and peak allocated memory per named stage.
+
+    peak_bytes is measured with tracemalloc (numpy reports its buffers there too) as the
+    peak above the allocation level at the start of the stage. It only covers Python and
+    numpy allocations: memory allocated by SimpleITK, GDCM or other native libraries is
+    not seen. rss_bytes is the resident set size of the process at the end of the stage
+    (the largest over its calls, None where /proc is not available), which includes it.
+    Stages must not be nested, and with concurrent timers in one process the memory
+    figures are approximate.
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            _start_tracing()
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            peak = 0
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1] - start_bytes, 0)
+                _stop_tracing()
+            rss = rss_bytes()
+            entry = self.stages.setdefault(
+                name,
+                {
+                    "wall_s": 0.0,
+                    "cpu_s": 0.0,
+                    "peak_bytes": 0,
+                    "rss_bytes": None,
+                    "calls": 0,
+                },
+            )
+            entry["wall_s"] += wall
+            entry["cpu_s"] += cpu
+            entry["peak_bytes"] = max(entry["peak_bytes"], peak)
+            if rss is not None:
+                entry["rss_bytes"] = max(entry["rss_bytes"] or 0, rss)
+            entry["calls"] += 1
+
+    def as_dict(self) -> dict:
+        """Stage results in execution order, rounded for logging."""
+        return {
+            name: {
+                "wall_s": round(entry["wall_s"], 6),
+                "cpu_s": round(entry["cpu_s"], 6),
+                "peak_bytes": entry["peak_bytes"],
+                "rss_bytes": entry["rss_bytes"],
+                "calls": entry["calls"],
+            }
+            for name, entry in self.stages.items()
+        }
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = {
+        k: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for k, v in labels.items()
+    }
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+
+class Histogram:
+    """Cumulative Prometheus histogram with one series per label combination."""
+
+    def __init__(
+        self, name: str, help: str, label_names: tuple, buckets: tuple = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        with self._lock:
+            counts, total = self._series.get(
+                label_values, ([0] * len(self.buckets), [0, 0.0])
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            total[0] += 1
+            total[1] += value
+            self._series[label_values] = (counts, total)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(
+                (k, (list(c), list(t))) for k, (c, t) in self._series.items()
+            )
+        for label_values, (counts, (count, total)) in series:
+            labels = dict(zip(self.label_names, label_values))
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_labels = _format_labels({**labels, "le": repr(float(bound))})
+                lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+            lines.append(
+                f'{self.name}_bucket{_format_labels({**labels, "le": "+Inf"})} {count}'
+            )
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+def render_metric(
+    name: str, kind: str, help: str, samples: list[tuple[dict, float]]
+) -> list[str]:
+    """Prometheus text lines for a counter or gauge given (labels, value) samples."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{_format_labels(labels)} {value}" for labels, value in samples)
+    return lines
+
+
+def rss_bytes() -> int | None:
+    """Current resident set size of this process, None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def peak_rss_bytes() -> int | None:
+    """Peak resident set size of this process, None where the platform does not report it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
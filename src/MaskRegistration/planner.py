@@ -0,0 +1,323 @@
+"""
+Resource planning for registrations: peak memory and runtime from the headers alone.
+
+    maskregistration -d1 dess -m mask.nii.gz -d2 t2 -o out.nii.gz --subpixel 9 --plan
+    maskregistration ... --max-memory 4G
+
+The estimates follow the arrays transform holds in every stage: the source DICOM
+datasets (read with their pixel data for mask_to_dicom), the masks as uint16, the
+subpixel grid during resampling and the OR reduction, one uint8 result per mask and
+trial direction, and the float64 copy made while writing the NIfTI. A constant factor
+covers allocator and library overhead, runtimes scale per voxel or byte with rates
+measured on the large benchmark study (benchmarks/suite.py --size large), so they are
+estimates for comparable machines, not guarantees.
+
+With a memory limit the fastest strategy that fits is chosen: the plain run, sequential
+auto-detect trials (only the scores of both directions are kept and the winner is
+registered again) and chunking (the target is registered in slabs of chunk_slices
+slices, bounding the subpixel grid). If nothing fits the job is refused. Services that
+run several jobs at once use the planned peaks to admit only as many as fit.
+"""
+
+import os
+import re
+from pathlib import Path
+
+# Interpreter with numpy, SimpleITK, nibabel and pydicom loaded
+BASE_BYTES = 150 * 1024**2
+# Measured peak RSS over the arrays counted below, for allocator and library overhead
+OVERHEAD_FACTOR = 1.5
+# Transient index tables per target voxel of the numpy backend (int32 plan, uint16 gather,
+# uint8 labels) and the float64 index arithmetic per voxel of a plan slab
+NUMPY_BYTES_PER_VOXEL = 7
+NUMPY_SLAB_BYTES_PER_VOXEL = 100
+NUMPY_SLAB_SLICES = 16
+
+# Seconds per unit on the reference machine
+SECONDS_PER_UNIT = {
+    "read_headers": 2e-9,  # per source file byte
+    "mask_to_dicom": 7e-9,  # per mask voxel
+    "read_mask": 6e-9,  # per mask voxel
+    "labels": 2e-9,  # per mask voxel
+    "split_dcm": 3.5e-9,  # per target file byte
+    "read_target": 6e-9,  # per target voxel
+    "resample_sitk": 8e-9,  # per subpixel grid voxel
+    "resample_numpy": 2e-7,  # per subpixel grid voxel, including the plan
+    "downsample": 2e-9,  # per subpixel grid voxel
+    "score": 1e-9,  # per target voxel
+    "write": 1.3e-8,  # per target voxel
+    "chunk": 2e-3,  # per slab
+    # per slab and mask voxel: every slab converts the whole mask again (sitk image copy)
+    "chunk_sitk": 1.3e-9,
+    "chunk_numpy": 7e-10,
+}
+CHUNK_SLICES = (64, 32, 16, 8, 4, 2, 1)
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size: str | int) -> int:
+    """Bytes of a size like 4G, 512M, 1.5GiB or a plain number of bytes."""
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(
+        r"\s*([\d.]+)\s*([KMGT]?)(?:i?B)?\s*", str(size), re.IGNORECASE
+    )
+    if not match:
+        raise ValueError(f"Invalid size: {size!r} (expected e.g. 4G or 512M)")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def memory_limit_from_env() -> int | None:
+    """MASKREGISTRATION_MAX_MEMORY in bytes, None when unset."""
+    limit = os.environ.get("MASKREGISTRATION_MAX_MEMORY")
+    return parse_size(limit) if limit else None
+
+
+def series_info(folder: Path) -> dict:
+    """Size and file bytes of a DICOM series, from the headers without pixel data."""
+    import pydicom
+    from pydicom.errors import InvalidDicomError
+
+    files, locations, total_bytes = 0, set(), 0
+    rows = columns = None
+    for path in sorted(Path(folder).iterdir()):
+        if not path.is_file() or path.name.startswith("."):
+            continue
+        try:
+            ds = pydicom.dcmread(
+                path,
+                stop_before_pixels=True,
+                specific_tags=[
+                    "Rows",
+                    "Columns",
+                    "SliceLocation",
+                    "ImagePositionPatient",
+                ],
+            )
+        except (InvalidDicomError, OSError):
+            continue
+        if "Rows" not in ds:
+            continue
+        files += 1
+        total_bytes += path.stat().st_size
+        rows, columns = int(ds.Rows), int(ds.Columns)
+        location = ds.get("SliceLocation")
+        if location is None and "ImagePositionPatient" in ds:
+            location = tuple(float(v) for v in ds.ImagePositionPatient)
+        locations.add(location)
+    if files == 0:
+        raise ValueError(f"No DICOM files found in {folder}")
+    slices = max(len(locations), 1)
+    return {
+        "size": [columns, rows, slices],
+        "echos": max(files // slices, 1),
+        "files": files,
+        "file_bytes": total_bytes,
+    }
+
+
+def mask_info(path: Path) -> dict:
+    """Shape and stored data type of a NIfTI mask, from its header."""
+    import nibabel as nib
+
+    img = nib.load(path)
+    return {
+        "shape": [int(v) for v in img.shape[:3]],
+        "itemsize": img.get_data_dtype().itemsize,
+    }
+
+
+def read_inputs(source: Path, masks: list[Path], target: Path) -> dict:
+    return {
+        "source": series_info(source),
+        "target": series_info(target),
+        "masks": [mask_info(m) for m in masks],
+    }
+
+
+def _prod(values) -> int:
+    result = 1
+    for v in values:
+        result *= int(v)
+    return result
+
+
+def estimate(
+    inputs: dict,
+    subpixel_factor: int = 1,
+    reverse: bool = None,
+    backend: str = "sitk",
+    crop: bool = False,
+    chunk_slices: int = None,
+    sequential_trials: bool = False,
+) -> dict:
+    """
+    Peak memory and runtime per stage of one transform call with these options.
+
+    With crop the label extent is unknown without reading the mask data, so the full
+    target grid is assumed (an upper bound).
+    """
+    source, target, masks = inputs["source"], inputs["target"], inputs["masks"]
+    n_masks = len(masks)
+    mask_voxels = max(_prod(m["shape"]) for m in masks)
+    mask_itemsize = max(m["itemsize"] for m in masks)
+    target_voxels = _prod(target["size"])
+    slices = target["size"][2]
+    chunk = min(chunk_slices, slices) if chunk_slices else slices
+    chunks = -(-slices // chunk)
+    grid_voxels = _prod(target["size"][:2]) * chunk * subpixel_factor
+    trials = 2 if reverse is None else 1
+    held_trials = 1 if sequential_trials else trials
+    registrations = n_masks * (trials + (1 if sequential_trials and trials == 2 else 0))
+    seconds = SECONDS_PER_UNIT
+
+    # Resident from the start: source datasets with pixel data; then the uint16 masks
+    headers = source["file_bytes"]
+    loaded_masks = n_masks * mask_voxels * 2
+    # Results of all masks of the held trial directions (chunked runs preallocate them)
+    results = held_trials * n_masks * target_voxels
+    if backend == "numpy":
+        resample_bytes = 2 * mask_voxels + NUMPY_BYTES_PER_VOXEL * grid_voxels
+        resample_bytes += (
+            NUMPY_SLAB_BYTES_PER_VOXEL * _prod(target["size"][:2]) * NUMPY_SLAB_SLICES
+        )
+    else:
+        resample_bytes = 2 * mask_voxels + 2 * grid_voxels
+    stages = {
+        "read_headers": (headers, seconds["read_headers"] * source["file_bytes"]),
+        "mask_to_dicom": (
+            headers + mask_voxels * mask_itemsize,
+            seconds["mask_to_dicom"] * n_masks * mask_voxels,
+        ),
+        "read_mask": (
+            headers + loaded_masks + 4 * mask_voxels,
+            seconds["read_mask"] * n_masks * mask_voxels,
+        ),
+        "labels": (headers + loaded_masks, seconds["labels"] * n_masks * mask_voxels),
+        "split_dcm": (
+            headers + loaded_masks,
+            seconds["split_dcm"] * target["file_bytes"],
+        ),
+        "read_target": (
+            headers + loaded_masks + 4 * target_voxels,
+            seconds["read_target"] * target_voxels,
+        ),
+        "resample": (
+            headers + loaded_masks + results + resample_bytes,
+            registrations
+            * (
+                seconds[f"resample_{backend}"] * grid_voxels * chunks
+                + (seconds["chunk"] + seconds[f"chunk_{backend}"] * mask_voxels)
+                * (chunks - 1)
+            ),
+        ),
+    }
+    if subpixel_factor > 1:
+        # The uint8 grid of the resampled labels and its reduction by the factor
+        stages["downsample"] = (
+            headers
+            + loaded_masks
+            + results
+            + grid_voxels
+            + grid_voxels // subpixel_factor,
+            registrations * seconds["downsample"] * grid_voxels * chunks,
+        )
+    stages["score"] = (
+        headers + loaded_masks + results,
+        seconds["score"] * trials * n_masks * target_voxels,
+    )
+    # sitk image of the result, then the float64 data and its scaled copy in nibabel
+    stages["write"] = (
+        headers + loaded_masks + results + 17 * target_voxels,
+        seconds["write"] * n_masks * target_voxels,
+    )
+
+    stages = {
+        name: {
+            "memory_bytes": int(BASE_BYTES + OVERHEAD_FACTOR * memory),
+            "seconds": round(duration, 3),
+        }
+        for name, (memory, duration) in stages.items()
+    }
+    return {
+        "options": {
+            "subpixel": subpixel_factor,
+            "reverse": reverse,
+            "backend": backend,
+            "crop": crop,
+            "chunk_slices": chunk_slices if chunk < slices else None,
+            "sequential_trials": sequential_trials and trials == 2,
+        },
+        "stages": stages,
+        "peak_bytes": max(stage["memory_bytes"] for stage in stages.values()),
+        "seconds": round(sum(stage["seconds"] for stage in stages.values()), 3),
+    }
+
+
+def choose_strategy(
+    inputs: dict,
+    subpixel_factor: int = 1,
+    reverse: bool = None,
+    backend: str = "sitk",
+    crop: bool = False,
+    memory_limit: int = None,
+) -> dict:
+    """
+    Estimate of the fastest strategy whose peak fits memory_limit.
+
+    "fits" is False (with the estimate of the leanest strategy) when none does; without
+    a limit the plain run is returned.
+    """
+    options = dict(
+        subpixel_factor=subpixel_factor, reverse=reverse, backend=backend, crop=crop
+    )
+    plain = estimate(inputs, **options)
+    if memory_limit is None or plain["peak_bytes"] <= memory_limit:
+        return {**plain, "memory_limit": memory_limit, "fits": True}
+
+    slices = inputs["target"]["size"][2]
+    candidates = [
+        estimate(inputs, **options, chunk_slices=chunk, sequential_trials=sequential)
+        for sequential in ((False, True) if reverse is None else (False,))
+        for chunk in (None, *(c for c in CHUNK_SLICES if c < slices))
+    ]
+    fitting = [c for c in candidates if c["peak_bytes"] <= memory_limit]
+    if fitting:
+        return {
+            **min(fitting, key=lambda c: c["seconds"]),
+            "memory_limit": memory_limit,
+            "fits": True,
+        }
+    return {
+        **min(candidates, key=lambda c: c["peak_bytes"]),
+        "memory_limit": memory_limit,
+        "fits": False,
+    }
+
+
+def plan_registration(
+    source: Path,
+    masks: list[Path],
+    target: Path,
+    subpixel_factor: int = 1,
+    reverse: bool = None,
+    backend: str = "sitk",
+    crop: bool = False,
+    memory_limit: int = None,
+) -> dict:
+    """Read the headers of a registration and choose its strategy (see choose_strategy)."""
+    inputs = read_inputs(Path(source), [Path(m) for m in masks], Path(target))
+    plan = choose_strategy(
+        inputs, subpixel_factor, reverse, backend, crop, memory_limit
+    )
+    return {"inputs": inputs, **plan}
+
+
+def admits(running_peaks: list[int], peak: int, memory_limit: int = None) -> bool:
+    """Whether a job with this peak may start next to the running ones; one always runs."""
+    return (
+        memory_limit is None
+        or not running_peaks
+        or sum(running_peaks) + peak <= memory_limit
+    )
@@ -0,0 +1,445 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from MaskRegistration.utils import downsample_with_or
+
+if TYPE_CHECKING:
+    import SimpleITK as sitk
+
+
+class Geometry:
+    """Voxel grid of an image in ITK order: (x, y, z) origin, spacing and size, row-major direction."""
+
+    def __init__(self, origin: tuple, spacing: tuple, direction: tuple, size: tuple):
+        self.origin = tuple(float(v) for v in origin)
+        self.spacing = tuple(float(v) for v in spacing)
+        self.direction = tuple(float(v) for v in direction)
+        self.size = tuple(int(v) for v in size)
+
+    @classmethod
+    def from_image(cls, image: "sitk.Image") -> "Geometry":
+        return cls(
+            image.GetOrigin(), image.GetSpacing(), image.GetDirection(), image.GetSize()
+        )
+
+    def key(self) -> tuple:
+        return self.origin, self.spacing, self.direction, self.size
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Geometry) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def __repr__(self) -> str:
+        return (
+            f"Geometry(origin={self.origin}, spacing={self.spacing}, "
+            f"direction={self.direction}, size={self.size})"
+        )
+
+    @property
+    def shape(self) -> tuple:
+        """Array shape in numpy (z, y, x) order."""
+        return self.size[::-1]
+
+    def index_to_physical(self) -> np.ndarray:
+        """Matrix mapping a continuous index to a physical offset from the origin."""
+        return np.array(self.direction, dtype=float).reshape(3, 3) @ np.diag(
+            self.spacing
+        )
+
+    def physical_to_index(self) -> np.ndarray:
+        """
+        Matrix mapping a physical offset from the origin to a continuous index.
+
+        Taken from ITK itself: its inverse of the direction matrix carries rounding noise
+        that decides on which side of a voxel boundary exactly-halfway points fall.
+        """
+        import SimpleITK as sitk
+
+        probe = sitk.Image([1, 1, 1], sitk.sitkUInt8)
+        probe.SetSpacing(self.spacing)
+        probe.SetDirection(self.direction)
+        columns = [
+            probe.TransformPhysicalPointToContinuousIndex(axis)
+            for axis in np.eye(3).tolist()
+        ]
+        return np.array(columns, dtype=float).T
+
+    def with_subpixel(self, factor: int) -> "Geometry":
+        """Geometry with the Z-axis upsampled by factor, as used for subpixel registration."""
+        if factor <= 1:
+            return self
+        spacing = (self.spacing[0], self.spacing[1], self.spacing[2] / factor)
+        size = (self.size[0], self.size[1], self.size[2] * factor)
+        return Geometry(self.origin, spacing, self.direction, size)
+
+    def in_plane_shrunk(self, factor: int) -> "Geometry":
+        """Geometry of every factor-th voxel in x and y, keeping the origin and the slices."""
+        if factor <= 1:
+            return self
+        spacing = (self.spacing[0] * factor, self.spacing[1] * factor, self.spacing[2])
+        size = (-(-self.size[0] // factor), -(-self.size[1] // factor), self.size[2])
+        return Geometry(self.origin, spacing, self.direction, size)
+
+    def reversed(self) -> "Geometry":
+        """Geometry of the same series read in reversed file order: origin at the last slice."""
+        index_to_physical = self.index_to_physical()
+        origin = np.asarray(self.origin) + index_to_physical[:, 2] * (self.size[2] - 1)
+        return Geometry(origin, self.spacing, self.direction, self.size)
+
+    def to_array(self) -> np.ndarray:
+        return np.concatenate(
+            [self.origin, self.spacing, self.direction, self.size]
+        ).astype(float)
+
+    @classmethod
+    def from_array(cls, arr: np.ndarray) -> "Geometry":
+        return cls(arr[0:3], arr[3:6], arr[6:15], arr[15:18].astype(int))
+
+
+def continuous_index(
+    source: Geometry,
+    target: Geometry,
+    index: np.ndarray,
+    transform: "sitk.Transform" = None,
+) -> np.ndarray:
+    """
+    Map target voxel indices (N x 3, ITK order) to continuous source indices.
+
+    The physical point is computed first, optionally mapped by an affine transform (e.g.
+    Euler3DTransform) and then mapped into the source grid, in the same order as ITK
+    does it, so that rounding matches ResampleImageFilter.
+    """
+    index_to_physical = target.index_to_physical()
+    points = np.broadcast_to(np.asarray(target.origin), index.shape).copy()
+    for j in range(3):
+        points += index[:, j : j + 1] * index_to_physical[:, j]
+    if transform is not None:
+        matrix = np.array(transform.GetMatrix(), dtype=float).reshape(3, 3)
+        center = np.array(transform.GetCenter(), dtype=float)
+        offset = (
+            np.array(transform.GetTranslation(), dtype=float) + center - matrix @ center
+        )
+        mapped = np.zeros_like(points)
+        for j in range(3):
+            mapped += points[:, j : j + 1] * matrix[:, j]
+        points = mapped + offset
+    physical_to_index = source.physical_to_index()
+    offset = points - np.asarray(source.origin)
+    cont = np.zeros_like(offset)
+    for j in range(3):
+        cont += offset[:, j : j + 1] * physical_to_index[:, j]
+    return cont
+
+
+def nearest_index(cont_index: np.ndarray, size: int) -> np.ndarray:
+    """Round continuous indices like ITK's nearest neighbour interpolator; -1 marks outside."""
+    inside = (cont_index >= -0.5) & (cont_index < size - 0.5)
+    return np.where(inside, np.floor(cont_index + 0.5), -1).astype(np.int32)
+
+
+def to_labels(arr: np.ndarray) -> np.ndarray:
+    """Convert to uint8 labels, clamping out-of-range values like ITK's output cast."""
+    if arr.dtype == np.uint8:
+        return arr
+    return np.clip(arr, 0, 255).astype(np.uint8)
+
+
+def flat_source_index(
+    source: Geometry,
+    target: Geometry,
+    z_start: int,
+    z_end: int,
+    transform: "sitk.Transform" = None,
+) -> np.ndarray:
+    """Flat source index (-1 outside) of every target voxel in the Z slab [z_start, z_end)."""
+    ys, xs = np.meshgrid(
+        np.arange(target.size[1]), np.arange(target.size[0]), indexing="ij"
+    )
+    zs = np.arange(z_start, z_end)[:, None, None]
+    index = np.stack(np.broadcast_arrays(xs[None], ys[None], zs), axis=-1).reshape(
+        -1, 3
+    )
+    nearest = [
+        nearest_index(cont, size)
+        for cont, size in zip(
+            continuous_index(source, target, index, transform).T, source.size
+        )
+    ]
+    inside = (nearest[0] >= 0) & (nearest[1] >= 0) & (nearest[2] >= 0)
+    flat = np.ravel_multi_index(
+        (nearest[2], nearest[1], nearest[0]), source.shape, mode="clip"
+    )
+    return (
+        np.where(inside, flat, -1)
+        .astype(np.int32)
+        .reshape(z_end - z_start, *target.shape[1:])
+    )
+
+
+class ResamplingPlan:
+    """
+    Precomputed nearest neighbour voxel correspondence between a source and a target grid.
+
+    When every target axis maps onto exactly one source axis the plan stores one index
+    table per axis, otherwise an int32 flat source index per target voxel. -1 marks
+    target voxels outside the source grid. Applying the plan is a single gather (plus
+    the OR reduction for subpixel plans) and matches ResampleImageFilter with nearest
+    neighbour interpolation, except for target points exactly halfway between two source
+    voxels along the x axis: ITK steps along each x scanline and its rounding noise can
+    put those on either side.
+    """
+
+    def __init__(
+        self,
+        source: Geometry,
+        target: Geometry,
+        subpixel_factor: int = 1,
+        reverse: bool = None,
+        tables: list = None,
+        axes: tuple = None,
+        flat_index: np.ndarray = None,
+    ):
+        self.source = source
+        self.target = target
+        self.subpixel_factor = subpixel_factor
+        self.reverse = reverse
+        # tables[k] indexes numpy axis k of the source and runs along target numpy axis axes[k]
+        self.tables = tables
+        self.axes = axes
+        self.flat_index = flat_index
+
+    @property
+    def separable(self) -> bool:
+        return self.tables is not None
+
+    @property
+    def nbytes(self) -> int:
+        if self.separable:
+            return sum(t.nbytes for t in self.tables)
+        return self.flat_index.nbytes
+
+    @classmethod
+    def build(
+        cls,
+        source: Geometry,
+        target: Geometry,
+        subpixel_factor: int = 1,
+        reverse: bool = None,
+        slab_size: int = 16,
+    ) -> "ResamplingPlan":
+        grid = target.with_subpixel(subpixel_factor)
+        # depends[k, j]: source index k picks up a non-zero term from target index j. Only
+        # exact zeros count, so per-axis tables do the same arithmetic as the full mapping.
+        depends = (source.physical_to_index() != 0).astype(int) @ (
+            grid.index_to_physical() != 0
+        )
+        depends = depends > 0
+        plan = cls(source, target, subpixel_factor, reverse)
+
+        if (depends.sum(axis=0) == 1).all() and (depends.sum(axis=1) == 1).all():
+            # Source axis k (ITK order) only depends on target axis itk_axes[k]
+            itk_axes = depends.argmax(axis=1)
+            tables = [None] * 3
+            for k in range(3):
+                j = itk_axes[k]
+                index = np.zeros((grid.size[j], 3))
+                index[:, j] = np.arange(grid.size[j])
+                cont = continuous_index(source, grid, index)[:, k]
+                tables[2 - k] = nearest_index(cont, source.size[k])
+            plan.tables = tables
+            plan.axes = tuple(int(2 - itk_axes[2 - k]) for k in range(3))
+            return plan
+
+        flat_index = np.empty(grid.shape, dtype=np.int32)
+        for z_start in range(0, grid.size[2], slab_size):
+            z_end = min(z_start + slab_size, grid.size[2])
+            flat_index[z_start:z_end] = flat_source_index(source, grid, z_start, z_end)
+        plan.flat_index = flat_index
+        return plan
+
+    def apply(self, arr: np.ndarray) -> np.ndarray:
+        """Resample a source array in numpy (z, y, x) order onto the target grid as uint8."""
+        if arr.shape != self.source.shape:
+            raise ValueError(
+                f"Expected an array of shape {self.source.shape}, got {arr.shape}"
+            )
+
+        if self.separable:
+            # A trailing zero plane on every axis lets the -1 entries gather background
+            padded = np.pad(arr, [(0, 1)] * 3)
+            gathered = padded[np.ix_(*self.tables)]
+            result = np.transpose(gathered, np.argsort(self.axes))
+        else:
+            flat = np.append(arr.ravel(), np.zeros(1, dtype=arr.dtype))
+            result = flat[self.flat_index]
+
+        result = to_labels(result)
+        if self.subpixel_factor > 1:
+            result = downsample_with_or(result, self.subpixel_factor)
+        return result
+
+    def save(self, path: Path) -> None:
+        arrays = {
+            "source": self.source.to_array(),
+            "target": self.target.to_array(),
+            "subpixel_factor": np.array(self.subpixel_factor),
+            "reverse": np.array(-1 if self.reverse is None else int(self.reverse)),
+        }
+        if self.separable:
+            arrays.update({f"table_{k}": t for k, t in enumerate(self.tables)})
+            arrays["axes"] = np.array(self.axes)
+        else:
+            arrays["flat_index"] = self.flat_index
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> "ResamplingPlan":
+        with np.load(path) as data:
+            reverse = int(data["reverse"])
+            plan = cls(
+                Geometry.from_array(data["source"]),
+                Geometry.from_array(data["target"]),
+                int(data["subpixel_factor"]),
+                None if reverse == -1 else bool(reverse),
+            )
+            if "flat_index" in data:
+                plan.flat_index = data["flat_index"]
+            else:
+                plan.tables = [data[f"table_{k}"] for k in range(3)]
+                plan.axes = tuple(int(a) for a in data["axes"])
+        return plan
+
+
+# Recently used plans, bounded by the memory of their index arrays
+_plan_cache: OrderedDict = OrderedDict()
+plan_cache_max_bytes = 512 * 1024**2
+plan_cache_stats = {"hits": 0, "misses": 0}
+
+
+def get_plan(
+    source: Geometry,
+    target: Geometry,
+    subpixel_factor: int = 1,
+    reverse: bool = None,
+    cache: bool = True,
+) -> ResamplingPlan:
+    """
+    Return the resampling plan for a geometry pair, reusing recently built plans.
+
+    With cache False a plan that is not cached yet is built without keeping it, e.g. for
+    the one-off slabs of a chunked registration.
+    """
+    key = (source, target, subpixel_factor, reverse)
+    if key in _plan_cache:
+        plan_cache_stats["hits"] += 1
+        _plan_cache.move_to_end(key)
+        return _plan_cache[key]
+
+    plan_cache_stats["misses"] += 1
+    plan = ResamplingPlan.build(source, target, subpixel_factor, reverse)
+    if not cache:
+        return plan
+    _plan_cache[key] = plan
+    while (
+        len(_plan_cache) > 1
+        and sum(p.nbytes for p in _plan_cache.values()) > plan_cache_max_bytes
+    ):
+        _plan_cache.popitem(last=False)
+    return plan
+
+
+class ResamplingBackend:
+    """Nearest neighbour resampling of label arrays in numpy (z, y, x) order onto a target grid."""
+
+    name = ""
+
+    def resample(
+        self,
+        arr: np.ndarray,
+        source: Geometry,
+        target: Geometry,
+        transform: "sitk.Transform" = None,
+    ) -> np.ndarray:
+        """Resample arr from the source grid onto the target grid, returning uint8 labels."""
+        raise NotImplementedError
+
+
+class SimpleITKBackend(ResamplingBackend):
+    """ResampleImageFilter on an image built from the array."""
+
+    name = "sitk"
+
+    def resample(self, arr, source, target, transform=None):
+        import SimpleITK as sitk
+
+        image = sitk.GetImageFromArray(arr)
+        image.SetOrigin(source.origin)
+        image.SetSpacing(source.spacing)
+        image.SetDirection(source.direction)
+
+        resampler = sitk.ResampleImageFilter()
+        resampler.SetInterpolator(sitk.sitkNearestNeighbor)
+        resampler.SetDefaultPixelValue(0)
+        resampler.SetSize(target.size)
+        resampler.SetOutputOrigin(target.origin)
+        resampler.SetOutputSpacing(target.spacing)
+        resampler.SetOutputDirection(target.direction)
+        resampler.SetOutputPixelType(sitk.sitkUInt8)
+        if transform is not None:
+            resampler.SetTransform(transform)
+        return sitk.GetArrayFromImage(resampler.Execute(image))
+
+
+class NumpyBackend(ResamplingBackend):
+    """
+    Vectorized index gather on the array in its own integer dtype.
+
+    Without a transform the ResamplingPlan of the geometry pair is applied, kept in the
+    plan cache unless cache_plans is False. Otherwise indices are computed and gathered
+    slab by slab, so the temporary index arrays never exceed slab_size target slices.
+    """
+
+    name = "numpy"
+
+    def __init__(
+        self, slab_size: int = 16, use_plans: bool = True, cache_plans: bool = True
+    ):
+        self.slab_size = slab_size
+        self.use_plans = use_plans
+        self.cache_plans = cache_plans
+
+    def resample(self, arr, source, target, transform=None):
+        if arr.shape != source.shape:
+            raise ValueError(
+                f"Expected an array of shape {source.shape}, got {arr.shape}"
+            )
+        if transform is None and self.use_plans:
+            return get_plan(source, target, cache=self.cache_plans).apply(arr)
+
+        flat = np.append(arr.ravel(), np.zeros(1, dtype=arr.dtype))
+        result = np.empty(target.shape, dtype=np.uint8)
+        for z_start in range(0, target.size[2], self.slab_size):
+            z_end = min(z_start + self.slab_size, target.size[2])
+            index = flat_source_index(source, target, z_start, z_end, transform)
+            result[z_start:z_end] = to_labels(flat[index])
+        return result
+
+
+BACKENDS = {"numpy": NumpyBackend, "sitk": SimpleITKBackend}
+
+
+def get_backend(name: str, cache_plans: bool = True) -> ResamplingBackend:
+    """Backend by name; cache_plans False keeps the numpy backend out of the plan cache."""
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown resampling backend: {name} (choose from {', '.join(BACKENDS)})"
+        )
+    if name == "numpy":
+        return NumpyBackend(cache_plans=cache_plans)
+    return BACKENDS[name]()
@@ -0,0 +1,226 @@
+"""
+Synthetic multi-echo DICOM series with matching label masks, for tests and benchmarks.
+
+    python -m MaskRegistration.synthetic out/source --orientation coronal --labels 3
+    python -m MaskRegistration.synthetic out/target --orientation axial --slices 24 --echoes 4
+
+Every series images the same phantom, a sphere of the given radius around center with
+label blobs on a ring inside it, so series written with different geometries of one
+study can be registered onto each other. Masks are written like the study folders the
+tool is used with: mask.nii.gz next to the DICOM files, slices in file order.
+"""
+
+import argparse
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import pydicom
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+# Row and column direction cosines (DICOM patient coordinates) of the image planes
+ORIENTATIONS = {
+    "axial": ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0)),
+    "coronal": ((1.0, 0.0, 0.0), (0.0, 0.0, -1.0)),
+    "sagittal": ((0.0, 1.0, 0.0), (0.0, 0.0, -1.0)),
+}
+SLICE_ORDERS = ("ascending", "descending", "interleaved")
+
+
+def _file_order(slices: int, slice_order: str) -> list[int]:
+    """Spatial slice index of every file, in file name order."""
+    if slice_order == "ascending":
+        return list(range(slices))
+    if slice_order == "descending":
+        return list(range(slices))[::-1]
+    if slice_order == "interleaved":
+        return list(range(0, slices, 2)) + list(range(1, slices, 2))
+    raise ValueError(
+        f"Unknown slice order '{slice_order}', expected one of {SLICE_ORDERS}"
+    )
+
+
+def _plane_axes(
+    orientation: str, tilt: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Row, column and normal direction, the plane tilted by tilt degrees around its row."""
+    if orientation not in ORIENTATIONS:
+        raise ValueError(
+            f"Unknown orientation '{orientation}', expected one of {list(ORIENTATIONS)}"
+        )
+    row, col = (np.array(v) for v in ORIENTATIONS[orientation])
+    normal = np.cross(row, col)
+    angle = np.radians(tilt)
+    col, normal = (
+        np.cos(angle) * col + np.sin(angle) * normal,
+        np.cos(angle) * normal - np.sin(angle) * col,
+    )
+    return row, col, normal
+
+
+def phantom(
+    points: np.ndarray, center: tuple, radius: float, labels: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Intensity and label of physical points (..., 3) in the synthetic phantom.
+
+    Labels 1..labels are spheres of radius/4 spread on a ring of radius/2 around center,
+    alternating above and below the ring plane.
+    """
+    offset = points - np.asarray(center, dtype=float)
+    distance = np.linalg.norm(offset, axis=-1) / radius
+    intensity = np.clip(1.2 - distance, 0, 1) * (
+        800 + 200 * np.sin(offset[..., 0] / 3) * np.cos(offset[..., 2] / 5)
+    )
+
+    label_map = np.zeros(points.shape[:-1], dtype=np.uint8)
+    for k in range(labels):
+        angle = 2 * np.pi * k / labels
+        blob = np.array([np.cos(angle), np.sin(angle), 0.5 * (-1) ** k]) * radius / 2
+        label_map[np.linalg.norm(offset - blob, axis=-1) <= radius / 4] = k + 1
+    intensity = intensity + 300 * (label_map > 0)
+    return intensity, label_map
+
+
+def write_series(
+    folder: Path,
+    size: tuple = (64, 64),
+    slices: int = 16,
+    echoes: int = 1,
+    orientation: str = "coronal",
+    slice_order: str = "ascending",
+    spacing: tuple = (0.5, 0.5, 2.0),
+    labels: int = 0,
+    tilt: float = 0.0,
+    center: tuple = (0.0, 0.0, 0.0),
+    radius: float = 15.0,
+) -> list[Path]:
+    """
+    Write a synthetic MR series of the phantom and return its files in file name order.
+
+    Parameters:
+    folder (Path): Output folder, created if missing.
+    size (tuple): In-plane (columns, rows).
+    slices (int): Number of slice locations.
+    echoes (int): Number of echoes, all sharing the slice locations of the series.
+    orientation (str): "axial", "coronal" or "sagittal".
+    slice_order (str): How file names run through the slice locations: "ascending" or
+        "descending" along the slice normal, or "interleaved" (even then odd slices).
+    spacing (tuple): (column, row, slice) spacing in mm.
+    labels (int): Number of labels; with labels > 0 the mask is written to mask.nii.gz.
+    tilt (float): Rotation of the image plane around its row direction in degrees.
+    center (tuple): Physical center of the series and of the phantom.
+    radius (float): Radius of the phantom in mm.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    columns, rows = size
+    row, col, normal = _plane_axes(orientation, tilt)
+    corner = (
+        np.asarray(center, dtype=float)
+        - row * spacing[0] * (columns - 1) / 2
+        - col * spacing[1] * (rows - 1) / 2
+        - normal * spacing[2] * (slices - 1) / 2
+    )
+    grid = (
+        np.arange(columns)[None, :, None] * spacing[0] * row
+        + np.arange(rows)[:, None, None] * spacing[1] * col
+    )
+
+    study, series, frame = generate_uid(), generate_uid(), generate_uid()
+    order = _file_order(slices, slice_order)
+    positions = [corner + normal * spacing[2] * z for z in order]
+    planes = [
+        phantom(position + grid, center, radius, labels) for position in positions
+    ]
+    files = []
+    for echo in range(echoes):
+        for i, (position, (intensity, _)) in enumerate(zip(positions, planes)):
+            meta = FileMetaDataset()
+            meta.MediaStorageSOPClassUID = MRImageStorage
+            meta.MediaStorageSOPInstanceUID = generate_uid()
+            meta.TransferSyntaxUID = ExplicitVRLittleEndian
+            ds = FileDataset(None, {}, file_meta=meta, preamble=b"\0" * 128)
+            ds.SOPClassUID = MRImageStorage
+            ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+            ds.Modality = "MR"
+            ds.PatientID = "SYNTHETIC"
+            ds.StudyInstanceUID = study
+            ds.SeriesInstanceUID = series
+            ds.FrameOfReferenceUID = frame
+            ds.SeriesNumber = 1
+            ds.InstanceNumber = echo * slices + i + 1
+            ds.EchoNumbers = echo + 1
+            ds.EchoTime = 5.0 + 10.0 * echo
+            ds.ImagePositionPatient = [float(v) for v in position]
+            ds.ImageOrientationPatient = [float(v) for v in (*row, *col)]
+            ds.SliceLocation = float(np.round(position @ normal, 4))
+            ds.PixelSpacing = [float(spacing[1]), float(spacing[0])]
+            ds.SliceThickness = float(spacing[2])
+            ds.Rows, ds.Columns = rows, columns
+            ds.SamplesPerPixel = 1
+            ds.PhotometricInterpretation = "MONOCHROME2"
+            ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 16, 15
+            ds.PixelRepresentation = 0
+            pixels = 50 + intensity * np.exp(-0.3 * echo)
+            ds.PixelData = pixels.astype(np.uint16).tobytes()
+
+            dcm_file = folder / f"IM_{echo + 1}_{i + 1:04d}.dcm"
+            ds.save_as(dcm_file, enforce_file_format=True)
+            files.append(dcm_file)
+
+    if labels:
+        # mask_to_dicom reads (columns, rows, file) arrays; the affine follows the file
+        # order for ascending and descending series (in RAS, as nibabel expects)
+        step = normal * spacing[2] * (-1 if slice_order == "descending" else 1)
+        affine = np.eye(4)
+        affine[:3, :3] = np.column_stack([row * spacing[0], col * spacing[1], step])
+        affine[:3, 3] = positions[0]
+        affine = np.diag([-1, -1, 1, 1]) @ affine
+        mask = np.stack([label_map for _, label_map in planes], axis=-1).transpose(
+            1, 0, 2
+        )
+        nib.save(nib.Nifti1Image(mask, affine), folder / "mask.nii.gz")
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic DICOM series and mask"
+    )
+    parser.add_argument("folder", type=Path, help="output folder")
+    parser.add_argument(
+        "--size", type=int, nargs=2, default=[64, 64], help="columns rows"
+    )
+    parser.add_argument("--slices", type=int, default=16)
+    parser.add_argument("--echoes", type=int, default=1)
+    parser.add_argument("--orientation", choices=list(ORIENTATIONS), default="coronal")
+    parser.add_argument("--slice-order", choices=SLICE_ORDERS, default="ascending")
+    parser.add_argument("--spacing", type=float, nargs=3, default=[0.5, 0.5, 2.0])
+    parser.add_argument(
+        "--labels", type=int, default=0, help="write mask.nii.gz with this many labels"
+    )
+    parser.add_argument("--tilt", type=float, default=0.0, help="plane tilt in degrees")
+    parser.add_argument(
+        "--radius", type=float, default=15.0, help="phantom radius in mm"
+    )
+    args = parser.parse_args()
+
+    files = write_series(
+        args.folder,
+        size=tuple(args.size),
+        slices=args.slices,
+        echoes=args.echoes,
+        orientation=args.orientation,
+        slice_order=args.slice_order,
+        spacing=tuple(args.spacing),
+        labels=args.labels,
+        tilt=args.tilt,
+        radius=args.radius,
+    )
+    print(f"Wrote {len(files)} files to {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
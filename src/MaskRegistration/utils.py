@@ -1,13 +1,15 @@
 import os
 from pathlib import Path
 
-import natsort
-import nibabel as nib
 import numpy as np
-import pydicom
+
+# natsort, nibabel and pydicom are imported inside the functions that need them, so that
+# importing the package (CLI --help, the web server, workers) stays cheap
 
 
 def split_dcm(dcm_list: list):
+    import pydicom
+
     locations = {}
     for f in dcm_list:
         try:
@@ -44,22 +46,272 @@ def check_locations(locations):
     return locations
 
 
-def mask_to_dicom(dcm_folder: Path, nii_file: Path, out_folder: Path):
-    mask = np.transpose(np.array(nib.load(nii_file).dataobj), (1, 0, 2))
+def read_dicom_headers(dcm_folder: Path) -> list:
+    """Read the DICOM files of a folder in natural sort order as (path, dataset) pairs."""
+    import natsort
+    import pydicom
+
     dicom_files = natsort.natsorted([_ for _ in dcm_folder.glob("*.dcm")])
-    mask = mask.astype("uint16")
-    for i, dcm_file in enumerate(dicom_files):
+    return [(dcm_file, pydicom.dcmread(dcm_file)) for dcm_file in dicom_files]
+
+
+def label_statistics(arr: np.ndarray, spacing: tuple = (1.0, 1.0, 1.0)) -> dict:
+    """
+    Voxel count, physical volume and bounding box of every label of a (z, y, x) mask.
+
+    One pass over the array finds the labelled voxels, everything else is computed from
+    those, so sparse masks are cheap. Values are rounded to integer labels, only positive
+    ones count (not e.g. -1 for "ignore"). spacing is in ITK (x, y, z) order; volume_mm3
+    is the voxel count times the voxel volume and bbox the (z, y, x) start and stop
+    index of the label. Returns {label: stats}.
+    """
+    # Cut the array to the box around all labels first, from two cheap projections
+    in_slices = np.flatnonzero(arr.any(axis=(1, 2)))
+    if len(in_slices) == 0:
+        return {}
+    z_offset = in_slices[0]
+    arr = arr[z_offset : in_slices[-1] + 1]
+    in_plane = arr.any(axis=0)
+    rows, columns = np.flatnonzero(in_plane.any(axis=1)), np.flatnonzero(
+        in_plane.any(axis=0)
+    )
+    offset = np.array([z_offset, rows[0], columns[0]])
+    arr = arr[:, rows[0] : rows[-1] + 1, columns[0] : columns[-1] + 1]
+
+    flat = arr.ravel()
+    indices = np.flatnonzero(flat)
+    values = flat[indices]
+    if values.dtype.kind == "f":
+        values = np.round(values)
+    positive = values > 0
+    indices, values = indices[positive], values[positive]
+    values = values.astype(np.int64)
+    if len(values) == 0:
+        return {}
+
+    # Histograms instead of sorting: per label counts, and per label and axis position
+    # presence, whose first and last hit give the bounding box
+    counts = np.bincount(values)
+    labels = np.flatnonzero(counts)
+    counts = counts[labels]
+    lookup = np.zeros(values.max() + 1, dtype=np.int64)
+    lookup[labels] = np.arange(len(labels))
+    inverse = lookup[values]
+    starts, stops = [], []
+    for coords, size in zip(np.unravel_index(indices, arr.shape), arr.shape):
+        present = (
+            np.bincount(inverse * size + coords, minlength=len(labels) * size).reshape(
+                len(labels), size
+            )
+            > 0
+        )
+        starts.append(present.argmax(axis=1))
+        stops.append(size - present[:, ::-1].argmax(axis=1))
+    starts, stops = np.stack(starts, axis=1) + offset, np.stack(stops, axis=1) + offset
+
+    voxel_volume = float(np.prod(spacing))
+    return {
+        int(label): {
+            "voxels": int(count),
+            "volume_mm3": float(count * voxel_volume),
+            "bbox": (tuple(int(v) for v in start), tuple(int(v) for v in stop)),
+        }
+        for label, count, start, stop in zip(labels, counts, starts, stops)
+    }
+
+
+def downsample_with_or(arr: np.ndarray, factor: int) -> np.ndarray:
+    """Downsample Z-axis using OR logic: if any sub-pixel is positive, result is positive."""
+    if arr.dtype != np.uint8:
+        arr = np.round(arr).astype(np.uint8)
+    new_z = arr.shape[0] // factor
+    # Where several labels hit the same voxel the highest wins, which is the maximum over
+    # the sub-pixels; reduced on a view, so only the result is allocated
+    blocks = arr[: new_z * factor].reshape(new_z, factor, *arr.shape[1:])
+    return blocks.max(axis=1)
+
+
+# Default size limit of the mask cache
+MASK_CACHE_SIZE = 2 * 1024**3
+
+
+def mask_cache_dir() -> Path:
+    """Folder of the decompressed .nii.gz masks, MASKREGISTRATION_CACHE_DIR or the user cache."""
+    if "MASKREGISTRATION_CACHE_DIR" in os.environ:
+        return Path(os.environ["MASKREGISTRATION_CACHE_DIR"])
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "maskregistration" / "masks"
+
+
+def mask_cache_size() -> int:
+    """Size limit of the mask cache in bytes, MASKREGISTRATION_CACHE_SIZE or 2 GiB."""
+    from MaskRegistration.planner import parse_size
+
+    size = os.environ.get("MASKREGISTRATION_CACHE_SIZE")
+    return parse_size(size) if size else MASK_CACHE_SIZE
+
+
+def prune_mask_cache(cache_dir: Path, keep: Path, limit: int) -> None:
+    """Remove the least recently used copies (other than keep) until the cache fits limit."""
+    entries = []
+    for path in cache_dir.glob("*.nii"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        if path == keep:
+            continue
+        try:
+            path.unlink()
+        except OSError:
+            # Removed by another process, or still mapped on Windows
+            continue
+        total -= size
+
+
+def decompressed_mask(nii_file: Path) -> Path:
+    """
+    Uncompressed copy of a .nii.gz file in the mask cache.
+
+    The copy is keyed by the resolved path, size and modification time of the file, so it
+    is written once and rebuilt when the file changes; other files are returned as they are.
+    Writing a copy removes the outdated copies of the same file and then the least
+    recently used ones beyond mask_cache_size (every use counts as a modification).
+    """
+    import gzip
+    import hashlib
+    import shutil
+    import tempfile
+
+    nii_file = Path(nii_file)
+    if not nii_file.name.endswith(".gz"):
+        return nii_file
+    stat = nii_file.stat()
+    resolved = str(nii_file.resolve())
+    identity = f"{resolved}:{stat.st_size}:{stat.st_mtime_ns}"
+    cache_dir = mask_cache_dir()
+    # Copies of one file share the prefix, so outdated ones can be found
+    prefix = hashlib.sha1(resolved.encode()).hexdigest()[:16]
+    cached = cache_dir / f"{prefix}-{hashlib.sha1(identity.encode()).hexdigest()}.nii"
+    if cached.exists():
+        try:
+            os.utime(cached)
+        except OSError:
+            pass
+    else:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # Written next to the final name and renamed, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(suffix=".nii.part", dir=cache_dir)
+        try:
+            with gzip.open(nii_file, "rb") as src, os.fdopen(fd, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024**2)
+            os.replace(tmp, cached)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        for outdated in cache_dir.glob(f"{prefix}-*.nii"):
+            if outdated != cached:
+                outdated.unlink(missing_ok=True)
+        prune_mask_cache(cache_dir, cached, mask_cache_size())
+    return cached
+
+
+def load_mask_array(nii_file: Path) -> np.ndarray:
+    """
+    Label array of a NIfTI mask in (x, y, z) order and its stored integer dtype.
+
+    Uncompressed data is memory-mapped read-only instead of read into memory, .nii.gz
+    files are mapped from their cached decompressed copy (see decompressed_mask). Scaled
+    data (scl_slope / scl_inter) is read and scaled as nibabel does.
+    """
+    import nibabel as nib
+
+    img = nib.load(decompressed_mask(nii_file), mmap="r")
+    return np.asanyarray(img.dataobj)
+
+
+def mask_to_dicom(
+    dcm_folder: Path, nii_file: Path, out_folder: Path, headers: list = None
+):
+    """
+    Write the mask slices into copies of the DICOM files of dcm_folder.
+
+    headers can be passed from read_dicom_headers to avoid re-reading the folder
+    when several masks belong to the same series.
+    """
+    # Slices are converted one at a time, the volume itself stays mapped
+    mask = np.transpose(load_mask_array(nii_file), (1, 0, 2))
+    if headers is None:
+        headers = read_dicom_headers(dcm_folder)
+    for i, (dcm_file, ds) in enumerate(headers):
         if i == mask.shape[2]:
             return None
-        ds = pydicom.dcmread(dcm_file)
-        ds.PixelData = mask[:, :, i].tobytes()
+        ds.PixelData = mask[:, :, i].astype("uint16").tobytes()
         ds.save_as(out_folder / os.path.basename(dcm_file))
 
 
-def check_transform_mask(org_mask: np.ndarray, transform_mask: np.ndarray):
+def mask_slice_order(dcm_folder: Path, slices: int) -> np.ndarray | None:
+    """
+    Mask slice of every series slice in slice location order, as mask_to_dicom places them.
+
+    mask_to_dicom writes mask slice i into the i-th DICOM file in natural sort order, while
+    series volumes are sorted by slice location, so mask[order] lines up with the volume.
+    None when those files do not cover distinct slice locations.
+    """
+    import natsort
+    import pydicom
+
+    files = natsort.natsorted(Path(dcm_folder).glob("*.dcm"))[:slices]
+    locations = [
+        float(
+            pydicom.dcmread(
+                f, stop_before_pixels=True, specific_tags=["SliceLocation"]
+            ).SliceLocation
+        )
+        for f in files
+    ]
+    if len(files) != slices or len(set(locations)) != slices:
+        return None
+    return np.argsort(locations, kind="stable")
+
+
+def label_report(source: dict, registered: dict) -> dict:
+    """
+    Compare the label_statistics of a mask before and after registration.
+
+    Per source label the source and registered volume (mm^3) and their ratio, plus the
+    labels that got lost and those that appeared.
+    """
+    labels = {}
+    for label, stats in source.items():
+        volume = registered[label]["volume_mm3"] if label in registered else 0.0
+        labels[label] = {
+            "source_mm3": stats["volume_mm3"],
+            "registered_mm3": volume,
+            "ratio": volume / stats["volume_mm3"],
+        }
+    return {
+        "labels": labels,
+        "missing": [label for label in source if label not in registered],
+        "added": [label for label in registered if label not in source],
+    }
+
+
+def check_transform_mask(
+    org_mask: np.ndarray,
+    transform_mask: np.ndarray,
+    org_spacing: tuple = (1.0, 1.0, 1.0),
+    transform_spacing: tuple = (1.0, 1.0, 1.0),
+) -> dict:
     """
-    Check that all regions are present after interpolation / registration
+    Check that all regions are present after interpolation / registration (see label_report)
     """
-    unique_org_mask = np.unique(org_mask)
-    unique_transform_mask = np.unique(transform_mask)
-    b = 2
+    return label_report(
+        label_statistics(org_mask, org_spacing),
+        label_statistics(transform_mask, transform_spacing),
+    )
@@ -0,0 +1,593 @@
+"""
+Watch-folder daemon that registers masks onto target series as studies arrive.
+
+    maskregistration watch /data/incoming --source "DESS*" --target "T2MAP*" --mask "*.nii.gz"
+    maskregistration watch --config watch.json
+
+Every immediate subfolder of a watched directory is a study. A rule matches, inside a
+study, source series folders, the mask files in each source folder and target series
+folders (glob patterns relative to the study and source folder). A series counts as
+complete once its file count, total size and newest modification time have not changed
+for --settle seconds. Each complete (source, target) pair becomes one job that registers
+all masks of the source; jobs run on a pool of --workers processes. With --max-memory
+jobs are planned from their headers before they start (see planner): jobs that cannot
+fit fail right away, the others wait until their planned peak fits next to the running
+ones.
+
+Queued, started, finished and failed jobs are appended to a JSON lines journal. After a
+restart finished jobs are skipped and interrupted ones run again. A job also runs again
+when one of its inputs changes; failed jobs only with --retry-failed.
+
+A config file holds the same settings as the command line plus a list of rules:
+
+    {
+        "watch": ["/data/incoming"],
+        "journal": "/data/incoming/.maskregistration-journal.jsonl",
+        "settle": 30,
+        "interval": 5,
+        "workers": 2,
+        "max_memory": "16G",
+        "rules": [
+            {"name": "dess_to_t2", "source": "DESS*", "mask": "*.nii.gz", "target": "T2MAP*",
+             "output": "registered/{target}/{mask}.nii.gz", "reverse": "auto", "subpixel": 3}
+        ]
+    }
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from MaskRegistration.jobs import REVERSE_MODES, plan_job, refusal, run_job
+from MaskRegistration.planner import admits, memory_limit_from_env, parse_size
+
+logger = logging.getLogger("MaskRegistration.watch")
+
+NIFTI_SUFFIXES = (".nii", ".nii.gz")
+
+
+def nifti_stem(path: Path) -> str:
+    name = path.name
+    for suffix in NIFTI_SUFFIXES[::-1]:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return path.stem
+
+
+def signature(path: Path) -> tuple | None:
+    """
+    (file count, total size, newest mtime) of a series folder or a single file, None if
+    it is gone. NIfTI files are ignored in folders, so masks and outputs written next to
+    the DICOM files do not change the signature of the series.
+    """
+    try:
+        if path.is_file():
+            stat = path.stat()
+            return 1, stat.st_size, stat.st_mtime_ns
+        count = size = newest = 0
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if (
+                    entry.name.startswith(".")
+                    or entry.name.endswith(NIFTI_SUFFIXES)
+                    or not entry.is_file()
+                ):
+                    continue
+                stat = entry.stat()
+                count += 1
+                size += stat.st_size
+                newest = max(newest, stat.st_mtime_ns)
+        return count, size, newest
+    except OSError:
+        return None
+
+
+class StabilityTracker:
+    """Remembers since when every path has had its current signature."""
+
+    def __init__(self, settle: float):
+        self.settle = settle
+        self._seen = {}
+
+    def is_stable(self, path: Path, current: tuple, now: float) -> bool:
+        """Whether path has had the signature current for at least settle seconds."""
+        previous = self._seen.get(path)
+        if previous is None or previous[0] != current:
+            self._seen[path] = previous = (current, now)
+        return now - previous[1] >= self.settle
+
+
+class Rule:
+    """How to find sources, masks and targets in a study and where to write the results."""
+
+    def __init__(
+        self,
+        name: str = "default",
+        source: str = "source",
+        mask: str = "*.nii.gz",
+        target: str = "target",
+        output: str = "registered/{target}/{mask}.nii.gz",
+        reverse: str = "auto",
+        subpixel: int = 1,
+        backend: str = "sitk",
+        crop: bool = False,
+    ):
+        if reverse not in REVERSE_MODES:
+            raise ValueError(
+                f"Rule '{name}': reverse must be one of {list(REVERSE_MODES)}, got '{reverse}'"
+            )
+        if subpixel < 1:
+            raise ValueError(
+                f"Rule '{name}': subpixel must be at least 1, got {subpixel}"
+            )
+        self.name, self.source, self.mask, self.target, self.output = (
+            name,
+            source,
+            mask,
+            target,
+            output,
+        )
+        self.reverse, self.subpixel, self.backend, self.crop = (
+            reverse,
+            subpixel,
+            backend,
+            crop,
+        )
+
+    @classmethod
+    def from_dict(cls, config: dict) -> "Rule":
+        unknown = set(config) - set(inspect.signature(cls).parameters)
+        if unknown:
+            raise ValueError(f"Unknown rule settings: {', '.join(sorted(unknown))}")
+        return cls(**config)
+
+    def output_path(self, study: Path, source: Path, target: Path, mask: Path) -> Path:
+        output = Path(
+            self.output.format(
+                study=study.name,
+                source=source.name,
+                target=target.name,
+                mask=nifti_stem(mask),
+            )
+        )
+        return output if output.is_absolute() else study / output
+
+    def options(self) -> dict:
+        return {
+            "reverse": self.reverse,
+            "subpixel": self.subpixel,
+            "backend": self.backend,
+            "crop": self.crop,
+        }
+
+
+def job_id(rule: Rule, source: Path, target: Path) -> str:
+    return hashlib.sha1(f"{rule.name}\0{source}\0{target}".encode()).hexdigest()[:16]
+
+
+class Journal:
+    """
+    Append-only JSON lines log of job states. Every line is written and flushed before the
+    state change it records takes effect, so the last line of a job is always true.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.jobs = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn last line after a crash
+                        continue
+                    self.jobs[entry["job"]] = entry
+
+    def record(self, job: dict, status: str, **fields) -> None:
+        entry = {
+            "job": job["id"],
+            "status": status,
+            "time": time.time(),
+            "inputs": job["inputs"],
+        }
+        entry.update(
+            {key: job[key] for key in ("rule", "source", "target") if key in job},
+            **fields,
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.jobs[job["id"]] = entry
+
+    def status(self, job: dict) -> str | None:
+        """Last status of the job for its current inputs, None if it never ran on them."""
+        entry = self.jobs.get(job["id"])
+        if entry is None or entry["inputs"] != job["inputs"]:
+            return None
+        return entry["status"]
+
+    def interrupted(self) -> list[str]:
+        return [
+            job
+            for job, entry in self.jobs.items()
+            if entry["status"] in ("queued", "started")
+        ]
+
+
+def find_jobs(
+    root: Path, rules: list[Rule], tracker: StabilityTracker, now: float
+) -> tuple[list[dict], int]:
+    """Jobs whose inputs are complete, and the number of matches still arriving."""
+    jobs, waiting = [], 0
+    try:
+        studies = sorted(
+            p for p in Path(root).iterdir() if p.is_dir() and not p.name.startswith(".")
+        )
+    except OSError:
+        return jobs, waiting
+    for study in studies:
+        for rule in rules:
+            sources = sorted(p for p in study.glob(rule.source) if p.is_dir())
+            targets = sorted(p for p in study.glob(rule.target) if p.is_dir())
+            for source in sources:
+                masks = sorted(p for p in source.glob(rule.mask) if p.is_file())
+                if not masks:
+                    continue
+                for target in targets:
+                    if target == source:
+                        continue
+                    paths = (source, target, *masks)
+                    inputs = [signature(path) for path in paths]
+                    # Folders without files yet are no series
+                    if any(sig is None or sig[0] == 0 for sig in inputs):
+                        continue
+                    if not all(
+                        [
+                            tracker.is_stable(path, sig, now)
+                            for path, sig in zip(paths, inputs)
+                        ]
+                    ):
+                        waiting += 1
+                        continue
+                    jobs.append(
+                        {
+                            "id": job_id(rule, source, target),
+                            "rule": rule.name,
+                            "source": source.as_posix(),
+                            "target": target.as_posix(),
+                            "masks": [mask.as_posix() for mask in masks],
+                            "outputs": [
+                                rule.output_path(study, source, target, mask).as_posix()
+                                for mask in masks
+                            ],
+                            "options": rule.options(),
+                            "inputs": [list(sig) for sig in inputs],
+                        }
+                    )
+    return jobs, waiting
+
+
+class WatchDaemon:
+    """
+    Scans the watched folders, queues complete jobs and runs them on a process pool.
+
+    A worker that dies (e.g. killed for running out of memory) breaks the pool: its jobs
+    are journaled as failed and the next job starts a new pool.
+    """
+
+    def __init__(
+        self,
+        roots: list[Path],
+        rules: list[Rule],
+        journal: Path,
+        settle: float = 30.0,
+        interval: float = 5.0,
+        workers: int = 1,
+        retry_failed: bool = False,
+        memory_limit: int = None,
+    ):
+        if workers < 1:
+            raise ValueError(f"workers must be at least 1, got {workers}")
+        self.roots = [Path(root) for root in roots]
+        self.rules = rules
+        self.journal = Journal(journal)
+        self.tracker = StabilityTracker(settle)
+        self.interval = interval
+        self.workers = workers
+        self.retry_failed = retry_failed
+        self.memory_limit = memory_limit
+        self.backlog = deque()
+        self.running = {}
+        self.pool = None
+        # Pool every running future was submitted to
+        self._pools = {}
+        self.stopping = threading.Event()
+
+    def scan(self) -> int:
+        """Queue new complete jobs; returns the number of matches still arriving."""
+        now = time.time()
+        active = {job["id"] for job in self.backlog} | {
+            job["id"] for job in self.running.values()
+        }
+        waiting = 0
+        for root in self.roots:
+            jobs, root_waiting = find_jobs(root, self.rules, self.tracker, now)
+            waiting += root_waiting
+            for job in jobs:
+                status = self.journal.status(job)
+                if (
+                    job["id"] in active
+                    or status == "done"
+                    or (status == "failed" and not self.retry_failed)
+                ):
+                    continue
+                self.journal.record(job, "queued")
+                self.backlog.append(job)
+                active.add(job["id"])
+                logger.info(
+                    "Queued %s -> %s (%d masks)",
+                    job["source"],
+                    job["target"],
+                    len(job["masks"]),
+                )
+        return waiting
+
+    def submit(self, job: dict):
+        # A pool broken by a dead worker refuses new jobs, they get a new one
+        for attempt in range(2):
+            if self.pool is None:
+                # Forking after SimpleITK or numpy started their threads can deadlock,
+                # workers start from a fresh interpreter as in jobs.JobQueue
+                self.pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            pool = self.pool
+            try:
+                future = pool.submit(run_job, job)
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                self.discard_pool(pool)
+            else:
+                self._pools[future] = pool
+                return future
+
+    def discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        if pool is self.pool:
+            logger.error("A worker process died, starting new workers")
+            self.pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def dispatch(self) -> None:
+        # Only as many jobs as workers are handed to the pool, the rest waits in the backlog
+        while (
+            self.backlog
+            and len(self.running) < self.workers
+            and not self.stopping.is_set()
+        ):
+            job = self.backlog[0]
+            if self.memory_limit is not None and "peak_bytes" not in job:
+                try:
+                    plan = plan_job(job, self.memory_limit)
+                except Exception as e:
+                    plan = {"fits": False, "error": f"{type(e).__name__}: {e}"}
+                if not plan["fits"]:
+                    self.backlog.popleft()
+                    error = plan.get("error") or refusal(plan)
+                    self.journal.record(job, "failed", error=error)
+                    logger.error(
+                        "Refused %s -> %s: %s", job["source"], job["target"], error
+                    )
+                    continue
+                job["peak_bytes"] = plan["peak_bytes"]
+            running_peaks = [
+                running.get("peak_bytes", 0) for running in self.running.values()
+            ]
+            if not admits(running_peaks, job.get("peak_bytes", 0), self.memory_limit):
+                break
+            self.backlog.popleft()
+            self.journal.record(job, "started")
+            job["started"] = time.perf_counter()
+            try:
+                self.running[self.submit(job)] = job
+            except Exception as e:
+                job.pop("started")
+                self.journal.record(job, "failed", error=f"{type(e).__name__}: {e}")
+                logger.error("Failed %s -> %s: %s", job["source"], job["target"], e)
+
+    def collect(self, timeout: float) -> None:
+        if not self.running:
+            self.stopping.wait(timeout)
+            return
+        done, _ = wait(list(self.running), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            job, pool = self.running.pop(future), self._pools.pop(future)
+            seconds = round(time.perf_counter() - job.pop("started"), 3)
+            try:
+                result = future.result()
+            except Exception as e:
+                self.journal.record(
+                    job, "failed", seconds=seconds, error=f"{type(e).__name__}: {e}"
+                )
+                logger.error("Failed %s -> %s: %s", job["source"], job["target"], e)
+                if isinstance(e, BrokenProcessPool):
+                    self.discard_pool(pool)
+            else:
+                self.journal.record(
+                    job, "done", seconds=seconds, outputs=job["outputs"], **result
+                )
+                logger.info(
+                    "Done %s -> %s in %.1f s", job["source"], job["target"], seconds
+                )
+
+    def run(self, once: bool = False) -> None:
+        """Run until stop() is called, or with once until nothing is left to do."""
+        interrupted = self.journal.interrupted()
+        if interrupted:
+            logger.info("Resuming %d interrupted job(s)", len(interrupted))
+        try:
+            while not self.stopping.is_set():
+                waiting = self.scan()
+                self.dispatch()
+                if once and not waiting and not self.backlog and not self.running:
+                    break
+                self.collect(self.interval)
+            # Jobs already running are finished and journaled, queued ones resume on restart
+            while self.running:
+                self.collect(self.interval)
+        finally:
+            pool, self.pool = self.pool, None
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+    def stop(self, *_) -> None:
+        logger.info("Stopping after the running jobs")
+        self.stopping.set()
+
+
+def load_config(path: Path | None) -> dict:
+    if path is None:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(
+        prog="maskregistration watch",
+        description="Register masks automatically as studies arrive",
+    )
+    parser.add_argument(
+        "folders", type=Path, nargs="*", help="watched folders, one subfolder per study"
+    )
+    parser.add_argument(
+        "--config", type=Path, default=None, help="JSON config with settings and rules"
+    )
+    parser.add_argument(
+        "--source",
+        type=str,
+        default=None,
+        help="source series folder pattern in a study",
+    )
+    parser.add_argument(
+        "--mask", type=str, default=None, help="mask file pattern in the source folder"
+    )
+    parser.add_argument(
+        "--target",
+        type=str,
+        default=None,
+        help="target series folder pattern in a study",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="output path template, relative to the study",
+    )
+    parser.add_argument("--reverse", choices=list(REVERSE_MODES), default=None)
+    parser.add_argument("--subpixel", type=int, default=None)
+    parser.add_argument("--backend", choices=["numpy", "sitk"], default=None)
+    parser.add_argument("--crop", action="store_true", default=None)
+    parser.add_argument(
+        "--journal",
+        type=Path,
+        default=None,
+        help="default: .maskregistration-journal.jsonl",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=None,
+        help="seconds a series must be unchanged (30)",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=None, help="seconds between scans (5)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="concurrent registrations (1)"
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=str,
+        default=None,
+        help="memory ceiling of the running jobs, e.g. 16G (no limit)",
+    )
+    parser.add_argument(
+        "--retry-failed", action="store_true", help="run failed jobs again"
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="exit once all complete studies are done"
+    )
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    roots = args.folders or [Path(folder) for folder in config.get("watch", [])]
+    if not roots:
+        parser.error(
+            "no folders to watch (pass them as arguments or as 'watch' in --config)"
+        )
+
+    rule_flags = {
+        key: value
+        for key, value in vars(args).items()
+        if key
+        in (
+            "source",
+            "mask",
+            "target",
+            "output",
+            "reverse",
+            "subpixel",
+            "backend",
+            "crop",
+        )
+        and value is not None
+    }
+    try:
+        if "rules" in config and not rule_flags:
+            rules = [Rule.from_dict(rule) for rule in config["rules"]]
+        else:
+            rules = [Rule(**rule_flags)]
+    except (TypeError, ValueError) as e:
+        parser.error(str(e))
+
+    def setting(name, default):
+        value = getattr(args, name)
+        return value if value is not None else config.get(name, default)
+
+    try:
+        max_memory = setting("max_memory", None)
+        memory_limit = parse_size(max_memory) if max_memory else memory_limit_from_env()
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    daemon = WatchDaemon(
+        roots,
+        rules,
+        journal=Path(setting("journal", roots[0] / ".maskregistration-journal.jsonl")),
+        settle=setting("settle", 30.0),
+        interval=setting("interval", 5.0),
+        workers=setting("workers", 1),
+        retry_failed=args.retry_failed or config.get("retry_failed", False),
+        memory_limit=memory_limit,
+    )
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run(once=args.once)
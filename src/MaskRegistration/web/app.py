@@ -1,61 +1,267 @@
+import asyncio
+import json
 import shutil
 import subprocess
 import sys
 import tempfile
+import time
 import uuid
-import webbrowser
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
-from threading import Thread
+from threading import RLock, Thread
 from typing import Literal
 
-import nibabel as nib
 import numpy as np
-import SimpleITK as sitk
-import uvicorn
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-
-from MaskRegistration.backend import transform
-from MaskRegistration.utils import split_dcm
-from MaskRegistration.web.viewer import slice_to_png, slice_with_mask_to_png
-
-app = FastAPI()
+from pydantic import BaseModel, ValidationError, validate_call
+
+from MaskRegistration import resampling
+from MaskRegistration.metrics import Histogram, peak_rss_bytes, render_metric, rss_bytes
+from MaskRegistration.resampling import Geometry, get_backend
+from MaskRegistration.utils import (
+    label_statistics,
+    load_mask_array,
+    mask_slice_order,
+    split_dcm,
+)
+from MaskRegistration.web import jobs
+from MaskRegistration.web.shared import VolumeRegistry, new_shared_dir, open_registry
+from MaskRegistration.web.viewer import (
+    RenderCache,
+    Viewport,
+    slice_to_png,
+    slice_with_mask_to_png,
+    window_levels,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    jobs.job_queue.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(jobs.router)
 
 static_dir = Path(__file__).parent / "static"
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
-
-class ImageMeta:
-    def __init__(self, origin: tuple, spacing: tuple, direction: tuple, size: tuple):
-        self.origin = origin
-        self.spacing = spacing
-        self.direction = direction
-        self.size = size
+# In-plane reduction of manual transform previews and of the proxy volumes they sample
+PREVIEW_SHRINK = 2
+
+request_latency = Histogram(
+    "maskregistration_request_duration_seconds",
+    "Latency of API requests by route",
+    ("method", "route", "status"),
+)
+stage_latency = Histogram(
+    "maskregistration_stage_duration_seconds",
+    "Wall time of registration stages",
+    ("stage",),
+)
+
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    # Another server process may have changed the loaded data; attaching it waits for
+    # writers, so it runs off the event loop
+    await run_in_threadpool(store.refresh)
+    response = await call_next(request)
+    route = request.scope.get("route")
+    # Route templates keep the label set small (no slice indices or task ids)
+    if route is not None and route.path.startswith("/api/"):
+        request_latency.observe(
+            time.perf_counter() - start,
+            request.method,
+            route.path,
+            str(response.status_code),
+        )
+    return response
 
 
 class EchoData:
     def __init__(self):
         self.volumes: list[np.ndarray] = []
-        self.metas: list[ImageMeta] = []
+        self.metas: list[Geometry] = []
         self.current_echo: int = 0
 
 
 class DataStore:
+    """
+    This process's view of the loaded state, which lives in a VolumeRegistry shared by
+    all server processes.
+
+    refresh() attaches the published state when it changed, changed() publishes the
+    volumes and masks and save() the paths and the current registration. Changes are made
+    within locked(), so no other thread or process changes the state in between.
+    """
+
+    MASKS = ("source_mask", "target_mask_registered", "target_mask_custom")
+    PATHS = (
+        "source_path",
+        "target_path",
+        "source_mask_path",
+        "output_path",
+        "temp_output_path",
+    )
+
     def __init__(self):
         self.source_echos: EchoData = EchoData()
         self.target_echos: EchoData = EchoData()
         self.source_mask: np.ndarray | None = None
         self.target_mask_registered: np.ndarray | None = None
         self.target_mask_custom: np.ndarray | None = None
-        self.target_mask_meta: ImageMeta | None = None
+        self.target_mask_meta: Geometry | None = None
         self.source_path: str = ""
         self.target_path: str = ""
         self.source_mask_path: str = ""
         self.output_path: str = ""
         self.temp_output_path: str = ""
-        self.tasks: dict[str, dict] = {}
+        # Latest registration task; results of older tasks are not published
+        self.registration: str | None = None
+        # Bumped on every change of the loaded data; part of the render cache keys
+        self.version: int = 0
+        self._derived: dict = {}
+        # Opened on first use, so importing the app creates no files
+        self.registry: VolumeRegistry | None = None
+        self._stamp = None
+        # Registry entries of the attached arrays and the arrays themselves, by name
+        self._entries: dict[str, dict] = {}
+        self._attached: dict[str, np.ndarray] = {}
+        self._lock = RLock()
+
+    def _registry(self) -> VolumeRegistry:
+        if self.registry is None:
+            self.registry = open_registry()
+        return self.registry
+
+    def _arrays(self) -> dict[str, np.ndarray]:
+        arrays = {
+            name: getattr(self, name)
+            for name in self.MASKS
+            if getattr(self, name) is not None
+        }
+        for side in ("source", "target"):
+            for i, volume in enumerate(getattr(self, f"{side}_echos").volumes):
+                arrays[f"{side}_echo_{i}"] = volume
+        return arrays
+
+    def _fields(self) -> dict:
+        fields = {name: getattr(self, name) for name in self.PATHS}
+        fields["registration"] = self.registration
+        for side in ("source", "target"):
+            echos = getattr(self, f"{side}_echos")
+            fields[f"{side}_echos"] = {
+                "metas": [m.key() for m in echos.metas],
+                "current_echo": echos.current_echo,
+            }
+        fields["target_mask_meta"] = (
+            self.target_mask_meta.key() if self.target_mask_meta else None
+        )
+        return fields
+
+    def _load(self, state: dict) -> None:
+        entries, attached = state["arrays"], {}
+        for name, entry in entries.items():
+            same = self._entries.get(name) == entry
+            attached[name] = (
+                self._attached[name] if same else VolumeRegistry.attach(entry)
+            )
+        fields = state["fields"]
+        for name in self.PATHS:
+            setattr(self, name, fields.get(name, ""))
+        self.registration = fields.get("registration")
+        for side in ("source", "target"):
+            echos, saved = EchoData(), fields.get(
+                f"{side}_echos", {"metas": [], "current_echo": 0}
+            )
+            echos.metas = [Geometry(*key) for key in saved["metas"]]
+            echos.volumes = [
+                attached[f"{side}_echo_{i}"] for i in range(len(echos.metas))
+            ]
+            echos.current_echo = saved["current_echo"]
+            setattr(self, f"{side}_echos", echos)
+        for name in self.MASKS:
+            setattr(self, name, attached.get(name))
+        meta = fields.get("target_mask_meta")
+        self.target_mask_meta = Geometry(*meta) if meta else None
+        self._entries, self._attached = entries, attached
+        if state["version"] != self.version:
+            self.version = state["version"]
+            self._derived = {}
+            render_cache.clear()
+
+    def refresh(self) -> None:
+        """Attach the published state if another process or thread changed it."""
+        registry = self._registry()
+        if registry.stamp() == self._stamp:
+            return
+        # Under the registry lock no writer removes the files of the state being attached
+        with registry.locked(), self._lock:
+            stamp = registry.stamp()
+            if stamp != self._stamp:
+                self._load(registry.read())
+                self._stamp = stamp
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the registry for a read-modify-write: the published state is attached, then
+        the block changes the store and publishes with changed() or save().
+        """
+        registry = self._registry()
+        with registry.locked(), self._lock:
+            self.refresh()
+            try:
+                yield self
+            except BaseException:
+                # Unpublished changes are replaced by the published state on next refresh
+                self._stamp = None
+                raise
+
+    def changed(self) -> None:
+        """Publish the volumes and masks and invalidate everything derived from them."""
+        registry = self._registry()
+        with registry.locked(), self._lock:
+            arrays, fields = self._arrays(), self._fields()
+
+            def change(state):
+                entries = {}
+                for name, arr in arrays.items():
+                    entry = state["arrays"].get(name)
+                    unchanged = entry is not None and entry == self._entries.get(name)
+                    unchanged = unchanged and self._attached.get(name) is arr
+                    entries[name] = entry if unchanged else registry.put(name, arr)
+                state["arrays"], state["fields"] = entries, fields
+                state["version"] += 1
+
+            # The local arrays are replaced by views of the published files
+            self._load(registry.update(change))
+
+    def save(self) -> None:
+        """Publish the paths and the current registration; the data stays valid."""
+        with self._registry().locked(), self._lock:
+            fields = {name: getattr(self, name) for name in self.PATHS}
+            fields["registration"] = self.registration
+            self._registry().update(lambda state: state["fields"].update(fields))
+
+    def set_task(self, task_id: str, task: dict) -> None:
+        self._registry().update(lambda state: state["tasks"].__setitem__(task_id, task))
+
+    def get_task(self, task_id: str) -> dict | None:
+        return self._registry().read()["tasks"].get(task_id)
+
+    def derived(self, key: tuple, compute):
+        """Value computed from the current data, kept until the next change."""
+        derived = self._derived
+        if key not in derived:
+            derived[key] = compute()
+        return derived[key]
 
     def get_dicom(self, side: str) -> np.ndarray | None:
         echos = self.source_echos if side == "source" else self.target_echos
@@ -63,31 +269,35 @@ class DataStore:
             return None
         return echos.volumes[echos.current_echo]
 
-    def get_meta(self, side: str) -> ImageMeta | None:
+    def get_meta(self, side: str) -> Geometry | None:
         echos = self.source_echos if side == "source" else self.target_echos
         if not echos.metas:
             return None
         return echos.metas[echos.current_echo]
 
     def reset(self) -> None:
-        self.source_echos = EchoData()
-        self.target_echos = EchoData()
-        self.source_mask = None
-        self.target_mask_registered = None
-        self.target_mask_custom = None
-        self.target_mask_meta = None
-        self.source_path = ""
-        self.target_path = ""
-        self.source_mask_path = ""
-        self.output_path = ""
-        self.temp_output_path = ""
-        self.tasks = {}
-
-
+        with self.locked():
+            self.source_echos = EchoData()
+            self.target_echos = EchoData()
+            self.source_mask = None
+            self.target_mask_registered = None
+            self.target_mask_custom = None
+            self.target_mask_meta = None
+            self.source_path = ""
+            self.target_path = ""
+            self.source_mask_path = ""
+            self.output_path = ""
+            self.temp_output_path = ""
+            self.registration = None
+            self.changed()
+            self._registry().update(lambda state: state["tasks"].clear())
+
+
+render_cache = RenderCache()
 store = DataStore()
 
 
-def select_target_mask(mask_mode: str) -> tuple[np.ndarray | None, ImageMeta | None]:
+def select_target_mask(mask_mode: str) -> tuple[np.ndarray | None, Geometry | None]:
     if mask_mode == "custom":
         return store.target_mask_custom, None
     return store.target_mask_registered, store.target_mask_meta
@@ -105,8 +315,7 @@ class RegisterRequest(BaseModel):
 @app.get("/")
 def root():
     return Response(
-        content=(static_dir / "index.html").read_text(),
-        media_type="text/html"
+        content=(static_dir / "index.html").read_text(), media_type="text/html"
     )
 
 
@@ -118,29 +327,26 @@ class BrowseRequest(BaseModel):
 def browse_macos(mode: str, initial_dir: str = "") -> str:
     if mode == "dir":
         script = 'tell application "System Events" to activate\n'
-        script += 'return POSIX path of (choose folder'
+        script += "return POSIX path of (choose folder"
         if initial_dir:
             script += f' default location POSIX file "{initial_dir}"'
-        script += ')'
+        script += ")"
     elif mode == "file":
         script = 'tell application "System Events" to activate\n'
-        script += 'return POSIX path of (choose file'
+        script += "return POSIX path of (choose file"
         if initial_dir:
             script += f' default location POSIX file "{initial_dir}"'
         script += ' of type {"nii", "gz", "public.item"})'
     else:
         script = 'tell application "System Events" to activate\n'
-        script += 'return POSIX path of (choose file name'
+        script += "return POSIX path of (choose file name"
         if initial_dir:
             script += f' default location POSIX file "{initial_dir}"'
         script += ' default name "mask.nii.gz")'
 
     try:
         result = subprocess.run(
-            ["osascript", "-e", script],
-            capture_output=True,
-            text=True,
-            timeout=120
+            ["osascript", "-e", script], capture_output=True, text=True, timeout=120
         )
         if result.returncode == 0:
             return result.stdout.strip()
@@ -168,13 +374,13 @@ def browse(req: BrowseRequest):
         elif req.mode == "file":
             path = filedialog.askopenfilename(
                 initialdir=initial,
-                filetypes=[("NIFTI files", "*.nii *.nii.gz"), ("All files", "*.*")]
+                filetypes=[("NIFTI files", "*.nii *.nii.gz"), ("All files", "*.*")],
             )
         else:
             path = filedialog.asksaveasfilename(
                 initialdir=initial,
                 defaultextension=".nii.gz",
-                filetypes=[("NIFTI files", "*.nii *.nii.gz")]
+                filetypes=[("NIFTI files", "*.nii *.nii.gz")],
             )
 
         root.destroy()
@@ -184,6 +390,8 @@ def browse(req: BrowseRequest):
 
 @app.post("/api/dicom/{side}")
 def load_dicom(side: Literal["source", "target"], req: PathRequest):
+    import SimpleITK as sitk
+
     path = Path(req.path)
     if not path.exists() or not path.is_dir():
         raise HTTPException(400, f"Invalid directory: {req.path}")
@@ -201,11 +409,11 @@ def load_dicom(side: Literal["source", "target"], req: PathRequest):
         image = reader.Execute()
         arr = sitk.GetArrayFromImage(image)
 
-        meta = ImageMeta(
+        meta = Geometry(
             origin=image.GetOrigin(),
             spacing=image.GetSpacing(),
             direction=image.GetDirection(),
-            size=image.GetSize()
+            size=image.GetSize(),
         )
 
         echos.volumes.append(arr)
@@ -213,12 +421,14 @@ def load_dicom(side: Literal["source", "target"], req: PathRequest):
 
     echos.current_echo = 0
 
-    if side == "source":
-        store.source_echos = echos
-        store.source_path = req.path
-    else:
-        store.target_echos = echos
-        store.target_path = req.path
+    with store.locked():
+        if side == "source":
+            store.source_echos = echos
+            store.source_path = req.path
+        else:
+            store.target_echos = echos
+            store.target_path = req.path
+        store.changed()
 
     first_meta = echos.metas[0]
     first_vol = echos.volumes[0]
@@ -234,14 +444,16 @@ def load_dicom(side: Literal["source", "target"], req: PathRequest):
 
 @app.post("/api/echo/{side}/{echo_idx}")
 def set_echo(side: Literal["source", "target"], echo_idx: int):
-    echos = store.source_echos if side == "source" else store.target_echos
+    with store.locked():
+        echos = store.source_echos if side == "source" else store.target_echos
 
-    if echo_idx < 0 or echo_idx >= len(echos.volumes):
-        raise HTTPException(400, f"Invalid echo index: {echo_idx}")
+        if echo_idx < 0 or echo_idx >= len(echos.volumes):
+            raise HTTPException(400, f"Invalid echo index: {echo_idx}")
 
-    echos.current_echo = echo_idx
-    meta = echos.metas[echo_idx]
-    vol = echos.volumes[echo_idx]
+        echos.current_echo = echo_idx
+        store.changed()
+        meta = echos.metas[echo_idx]
+        vol = echos.volumes[echo_idx]
 
     return {
         "slices": vol.shape[0],
@@ -257,18 +469,119 @@ def load_mask(side: Literal["source", "target"], req: PathRequest):
     if not path.exists():
         raise HTTPException(400, f"File not found: {req.path}")
 
-    nii = nib.load(path)
-    arr = np.asarray(nii.dataobj)
-    arr = np.transpose(arr, (2, 1, 0))
+    # Memory-mapped; NIfTI data is stored x fastest, so the (z, y, x) view is C-contiguous
+    arr = np.transpose(load_mask_array(path), (2, 1, 0))
 
-    if side == "source":
-        store.source_mask = arr
-        store.source_mask_path = req.path
-    else:
-        store.target_mask_custom = arr
+    with store.locked():
+        if side == "source":
+            store.source_mask = arr
+            store.source_mask_path = req.path
+        else:
+            store.target_mask_custom = arr
+        store.changed()
+
+    return {"slices": arr.shape[0], "labels": list(label_statistics(arr))}
+
+
+def target_image(reverse: bool):
+    """Current target echo as float SimpleITK image, built once per loaded state."""
+
+    def build():
+        import SimpleITK as sitk
 
-    labels = np.unique(arr[arr > 0]).tolist()
-    return {"slices": arr.shape[0], "labels": labels}
+        target_data = store.get_dicom("target")
+        if reverse:
+            target_data = target_data[::-1, :, :]
+        target_meta = store.get_meta("target")
+        target_img = sitk.GetImageFromArray(target_data.astype(np.float32))
+        target_img.SetOrigin(target_meta.origin)
+        target_img.SetSpacing(target_meta.spacing)
+        target_img.SetDirection(target_meta.direction)
+        return target_img
+
+    return store.derived(("target_image", reverse), build)
+
+
+def target_levels() -> tuple:
+    # One window for the whole (subsampled) target volume keeps the contrast of resampled
+    # views independent of slice, viewport and manual transform
+    return store.derived(
+        ("levels", "target"),
+        lambda: window_levels(store.get_dicom("target")[::2, ::2, ::2]),
+    )
+
+
+def resample_linear(image, grid: Geometry, transform=None) -> np.ndarray:
+    import SimpleITK as sitk
+
+    resampler = sitk.ResampleImageFilter()
+    resampler.SetSize(grid.size)
+    resampler.SetOutputOrigin(grid.origin)
+    resampler.SetOutputSpacing(grid.spacing)
+    resampler.SetOutputDirection(grid.direction)
+    resampler.SetInterpolator(sitk.sitkLinear)
+    resampler.SetDefaultPixelValue(0)
+    if transform is not None:
+        resampler.SetTransform(transform)
+    return sitk.GetArrayFromImage(resampler.Execute(image))
+
+
+def target_mask_volume(
+    mask_mode: str, reverse: bool
+) -> tuple[np.ndarray | None, Geometry | None]:
+    mask_data, mask_meta = select_target_mask(mask_mode)
+    if mask_data is None:
+        return None, None
+    if reverse:
+        mask_data = mask_data[::-1, :, :]
+    mask_meta = mask_meta if mask_meta else store.get_meta("target")
+    return mask_data, Geometry(
+        mask_meta.origin, mask_meta.spacing, mask_meta.direction, mask_data.shape[::-1]
+    )
+
+
+def target_proxy(reverse: bool):
+    """Target image averaged over PREVIEW_SHRINK x PREVIEW_SHRINK in-plane blocks."""
+
+    def build():
+        import SimpleITK as sitk
+
+        return sitk.BinShrink(
+            target_image(reverse), [PREVIEW_SHRINK, PREVIEW_SHRINK, 1]
+        )
+
+    return store.derived(("target_proxy", reverse), build)
+
+
+def target_mask_proxy(
+    mask_mode: str, reverse: bool
+) -> tuple[np.ndarray | None, Geometry | None]:
+    """Every PREVIEW_SHRINK-th mask voxel in-plane; keeps the labels and the origin."""
+
+    def build():
+        mask_data, mask_geometry = target_mask_volume(mask_mode, reverse)
+        if mask_data is None:
+            return None, None
+        proxy = np.ascontiguousarray(mask_data[:, ::PREVIEW_SHRINK, ::PREVIEW_SHRINK])
+        spacing = (
+            mask_geometry.spacing[0] * PREVIEW_SHRINK,
+            mask_geometry.spacing[1] * PREVIEW_SHRINK,
+            mask_geometry.spacing[2],
+        )
+        return proxy, Geometry(
+            mask_geometry.origin, spacing, mask_geometry.direction, proxy.shape[::-1]
+        )
+
+    return store.derived(("target_mask_proxy", mask_mode, reverse), build)
+
+
+def png_response(key: tuple, render) -> Response:
+    """Serve a rendered slice from the render cache, rendering it on a miss."""
+    png = render_cache.get(key)
+    if png is None:
+        png = render()
+        render_cache.put(key, png)
+    return Response(content=png, media_type="image/png")
 
 
 @app.get("/api/slice/aligned/{index}")
@@ -277,12 +590,18 @@ def get_aligned_slice(
     mask: bool = False,
     mask_mode: Literal["registered", "custom"] = "registered",
     reverse: bool = False,
-    t: str = None
+    backend: Literal["numpy", "sitk"] = "numpy",
+    roi_x: int = None,
+    roi_y: int = None,
+    roi_w: int = None,
+    roi_h: int = None,
+    out_w: int = None,
+    out_h: int = None,
+    t: str = None,
 ):
     source_dicom = store.get_dicom("source")
     target_dicom = store.get_dicom("target")
     source_meta = store.get_meta("source")
-    target_meta = store.get_meta("target")
 
     if source_dicom is None or target_dicom is None:
         raise HTTPException(400, "Both DICOMs must be loaded")
@@ -290,55 +609,44 @@ def get_aligned_slice(
     if index < 0 or index >= source_dicom.shape[0]:
         raise HTTPException(400, f"Invalid slice index: {index}")
 
-    target_data = target_dicom
-    if reverse:
-        target_data = target_data[::-1, :, :]
-
-    target_img = sitk.GetImageFromArray(target_data.astype(np.float32))
-    target_img.SetOrigin(target_meta.origin)
-    target_img.SetSpacing(target_meta.spacing)
-    target_img.SetDirection(target_meta.direction)
-
-    resampler = sitk.ResampleImageFilter()
-    resampler.SetSize([source_meta.size[0], source_meta.size[1], source_meta.size[2]])
-    resampler.SetOutputOrigin(source_meta.origin)
-    resampler.SetOutputSpacing(source_meta.spacing)
-    resampler.SetOutputDirection(source_meta.direction)
-    resampler.SetInterpolator(sitk.sitkLinear)
-    resampler.SetDefaultPixelValue(0)
-
-    aligned = resampler.Execute(target_img)
-    aligned_arr = sitk.GetArrayFromImage(aligned)
-
-    mask_vol = None
-    if mask:
-        mask_data, mask_meta = select_target_mask(mask_mode)
-        if mask_data is not None:
-            if reverse:
-                mask_data = mask_data[::-1, :, :]
-            mask_img = sitk.GetImageFromArray(mask_data.astype(np.float32))
-            mask_meta = mask_meta if mask_meta else target_meta
-            mask_img.SetOrigin(mask_meta.origin)
-            mask_img.SetSpacing(mask_meta.spacing)
-            mask_img.SetDirection(mask_meta.direction)
-
-            mask_resampler = sitk.ResampleImageFilter()
-            mask_resampler.SetSize([source_meta.size[0], source_meta.size[1], source_meta.size[2]])
-            mask_resampler.SetOutputOrigin(source_meta.origin)
-            mask_resampler.SetOutputSpacing(source_meta.spacing)
-            mask_resampler.SetOutputDirection(source_meta.direction)
-            mask_resampler.SetInterpolator(sitk.sitkNearestNeighbor)
-            mask_resampler.SetDefaultPixelValue(0)
-
-            aligned_mask = mask_resampler.Execute(mask_img)
-            mask_vol = sitk.GetArrayFromImage(aligned_mask).astype(np.uint8)
-
-    if mask_vol is not None:
-        png = slice_with_mask_to_png(aligned_arr, mask_vol, index)
-    else:
-        png = slice_to_png(aligned_arr, index)
-
-    return Response(content=png, media_type="image/png")
+    # Only the viewport of the requested slice is resampled
+    viewport = Viewport.parse(
+        source_meta.size[0],
+        source_meta.size[1],
+        roi_x,
+        roi_y,
+        roi_w,
+        roi_h,
+        out_w,
+        out_h,
+    )
+    grid = viewport.grid(source_meta, index)
+
+    def render():
+        aligned_arr = resample_linear(target_image(reverse), grid)
+        mask_vol = None
+        if mask:
+            mask_data, mask_meta = target_mask_volume(mask_mode, reverse)
+            if mask_data is not None:
+                mask_vol = get_backend(backend).resample(mask_data, mask_meta, grid)
+
+        if mask_vol is not None:
+            return slice_with_mask_to_png(
+                aligned_arr, mask_vol, 0, levels=target_levels()
+            )
+        return slice_to_png(aligned_arr, 0, levels=target_levels())
+
+    key = (
+        "aligned",
+        store.version,
+        index,
+        mask,
+        mask_mode,
+        reverse,
+        backend,
+        viewport.key(),
+    )
+    return png_response(key, render)
 
 
 @app.get("/api/slice/{side}/{index}")
@@ -347,7 +655,13 @@ def get_slice(
     index: int,
     mask: bool = False,
     mask_mode: Literal["registered", "custom"] = "registered",
-    t: str = None
+    roi_x: int = None,
+    roi_y: int = None,
+    roi_w: int = None,
+    roi_h: int = None,
+    out_w: int = None,
+    out_h: int = None,
+    t: str = None,
 ):
     dicom = store.get_dicom(side)
     if dicom is None:
@@ -356,19 +670,29 @@ def get_slice(
     if index < 0 or index >= dicom.shape[0]:
         raise HTTPException(400, f"Invalid slice index: {index}")
 
-    mask_vol = None
-    if mask:
-        if side == "source":
-            mask_vol = store.source_mask
-        else:
-            mask_vol, _ = select_target_mask(mask_mode)
+    viewport = Viewport.parse(
+        dicom.shape[2], dicom.shape[1], roi_x, roi_y, roi_w, roi_h, out_w, out_h
+    )
 
-    if mask_vol is not None:
-        png = slice_with_mask_to_png(dicom, mask_vol, index)
-    else:
-        png = slice_to_png(dicom, index)
+    def render():
+        mask_vol = None
+        if mask:
+            if side == "source":
+                mask_vol = store.source_mask
+            else:
+                mask_vol, _ = select_target_mask(mask_mode)
 
-    return Response(content=png, media_type="image/png")
+        levels = store.derived(
+            ("levels", side, index), lambda: window_levels(dicom[index])
+        )
+        if mask_vol is not None:
+            return slice_with_mask_to_png(
+                dicom, mask_vol, index, viewport=viewport, levels=levels
+            )
+        return slice_to_png(dicom, index, viewport=viewport, levels=levels)
+
+    key = ("slice", store.version, side, index, mask, mask_mode, viewport.key())
+    return png_response(key, render)
 
 
 @app.get("/api/transform/{index}")
@@ -376,16 +700,40 @@ def get_transformed_slice(
     index: int,
     mask: str = "false",
     mask_mode: Literal["registered", "custom"] = "registered",
-    offset_x: float = 0, offset_y: float = 0, offset_z: float = 0,
-    rotation_x: float = 0, rotation_y: float = 0, rotation_z: float = 0,
-    scale_x: float = 1, scale_y: float = 1, scale_z: float = 1,
-    apply_offset: str = "false", apply_rotation: str = "false", apply_scale: str = "false",
+    offset_x: float = 0,
+    offset_y: float = 0,
+    offset_z: float = 0,
+    rotation_x: float = 0,
+    rotation_y: float = 0,
+    rotation_z: float = 0,
+    scale_x: float = 1,
+    scale_y: float = 1,
+    scale_z: float = 1,
+    apply_offset: str = "false",
+    apply_rotation: str = "false",
+    apply_scale: str = "false",
     reverse: str = "false",
     output: Literal["source", "target"] = "source",
-    t: str = None
+    backend: Literal["numpy", "sitk"] = "numpy",
+    roi_x: int = None,
+    roi_y: int = None,
+    roi_w: int = None,
+    roi_h: int = None,
+    out_w: int = None,
+    out_h: int = None,
+    preview: str = "false",
+    t: str = None,
 ):
+    """
+    Target slice under a manual transform. With preview=true (while the transform is being
+    dragged) the slice is rendered at reduced resolution from in-plane downsampled proxies
+    of the target and its mask.
+    """
+    import SimpleITK as sitk
+
     # Parse string booleans
     mask = mask.lower() == "true"
+    preview = preview.lower() == "true"
     apply_offset = apply_offset.lower() == "true"
     apply_rotation = apply_rotation.lower() == "true"
     apply_scale = apply_scale.lower() == "true"
@@ -406,10 +754,6 @@ def get_transformed_slice(
         if index < 0 or index >= target_dicom.shape[0]:
             raise HTTPException(400, f"Invalid slice index: {index}")
 
-    target_data = target_dicom
-    if reverse:
-        target_data = target_data[::-1, :, :]
-
     # Build transform around the target image center for intuitive rotations.
     transform = sitk.Euler3DTransform()
     transform.SetCenter(physical_center(target_meta))
@@ -417,87 +761,197 @@ def get_transformed_slice(
     # Apply rotation (convert degrees to radians)
     if apply_rotation:
         transform.SetRotation(
-            np.radians(rotation_x),
-            np.radians(rotation_y),
-            np.radians(rotation_z)
+            np.radians(rotation_x), np.radians(rotation_y), np.radians(rotation_z)
         )
 
     # Apply offset
     if apply_offset:
         transform.SetTranslation((offset_x, offset_y, offset_z))
 
-    # Create target image
-    target_img = sitk.GetImageFromArray(target_data.astype(np.float32))
-    target_img.SetOrigin(target_meta.origin)
-    target_img.SetSpacing(target_meta.spacing)
-    target_img.SetDirection(target_meta.direction)
-
     output_meta = source_meta if output == "source" else target_meta
     # Apply scale by modifying output spacing
     output_spacing = list(output_meta.spacing)
     if apply_scale:
         output_spacing = [
-            output_meta.spacing[0] / scale_x if scale_x != 0 else output_meta.spacing[0],
-            output_meta.spacing[1] / scale_y if scale_y != 0 else output_meta.spacing[1],
-            output_meta.spacing[2] / scale_z if scale_z != 0 else output_meta.spacing[2],
+            output_meta.spacing[0] / scale_x
+            if scale_x != 0
+            else output_meta.spacing[0],
+            output_meta.spacing[1] / scale_y
+            if scale_y != 0
+            else output_meta.spacing[1],
+            output_meta.spacing[2] / scale_z
+            if scale_z != 0
+            else output_meta.spacing[2],
         ]
+    output_grid = Geometry(
+        output_meta.origin, output_spacing, output_meta.direction, output_meta.size
+    )
 
-    # Resample with transform
-    resampler = sitk.ResampleImageFilter()
-    resampler.SetSize([output_meta.size[0], output_meta.size[1], output_meta.size[2]])
-    resampler.SetOutputOrigin(output_meta.origin)
-    resampler.SetOutputSpacing(output_spacing)
-    resampler.SetOutputDirection(output_meta.direction)
-    resampler.SetInterpolator(sitk.sitkLinear)
-    resampler.SetDefaultPixelValue(0)
-    resampler.SetTransform(transform)
-
-    aligned = resampler.Execute(target_img)
-    aligned_arr = sitk.GetArrayFromImage(aligned)
-
-    # Handle mask if requested
-    mask_vol = None
-    if mask:
-        mask_data, mask_meta = select_target_mask(mask_mode)
-        if mask_data is not None:
-            if reverse:
-                mask_data = mask_data[::-1, :, :]
-            mask_img = sitk.GetImageFromArray(mask_data.astype(np.float32))
-            mask_meta = mask_meta if mask_meta else target_meta
-            mask_img.SetOrigin(mask_meta.origin)
-            mask_img.SetSpacing(mask_meta.spacing)
-            mask_img.SetDirection(mask_meta.direction)
-
-            mask_resampler = sitk.ResampleImageFilter()
-            mask_resampler.SetSize([output_meta.size[0], output_meta.size[1], output_meta.size[2]])
-            mask_resampler.SetOutputOrigin(output_meta.origin)
-            mask_resampler.SetOutputSpacing(output_spacing)
-            mask_resampler.SetOutputDirection(output_meta.direction)
-            mask_resampler.SetInterpolator(sitk.sitkNearestNeighbor)
-            mask_resampler.SetDefaultPixelValue(0)
-            mask_resampler.SetTransform(transform)
-
-            aligned_mask = mask_resampler.Execute(mask_img)
-            mask_vol = sitk.GetArrayFromImage(aligned_mask).astype(np.uint8)
-
-    if mask_vol is not None:
-        png = slice_with_mask_to_png(aligned_arr, mask_vol, index)
-    else:
-        png = slice_to_png(aligned_arr, index)
+    # Only the viewport of the requested slice is resampled
+    viewport = Viewport.parse(
+        output_meta.size[0],
+        output_meta.size[1],
+        roi_x,
+        roi_y,
+        roi_w,
+        roi_h,
+        out_w,
+        out_h,
+    )
+    if preview:
+        viewport = viewport.reduced(PREVIEW_SHRINK)
+    grid = viewport.grid(output_grid, index)
+
+    def render():
+        image = target_proxy(reverse) if preview else target_image(reverse)
+        aligned_arr = resample_linear(image, grid, transform)
+
+        # Handle mask if requested
+        mask_vol = None
+        if mask:
+            mask_data, mask_meta = (
+                target_mask_proxy if preview else target_mask_volume
+            )(mask_mode, reverse)
+            if mask_data is not None:
+                mask_vol = get_backend(backend).resample(
+                    mask_data, mask_meta, grid, transform
+                )
+
+        if mask_vol is not None:
+            return slice_with_mask_to_png(
+                aligned_arr, mask_vol, 0, levels=target_levels()
+            )
+        return slice_to_png(aligned_arr, 0, levels=target_levels())
+
+    key = (
+        "transform",
+        store.version,
+        index,
+        mask,
+        mask_mode,
+        output,
+        reverse,
+        backend,
+        transform.GetParameters(),
+        transform.GetFixedParameters(),
+        tuple(output_spacing),
+        viewport.key(),
+    )
+    return png_response(key, render)
+
+
+# Renderers available to the slice stream, parameters as for the HTTP endpoints
+STREAM_ENDPOINTS = {
+    "slice": validate_call(get_slice),
+    "aligned": validate_call(get_aligned_slice),
+    "transform": validate_call(get_transformed_slice),
+}
+stream_frames = {"sent": 0, "superseded": 0}
+
+
+def render_view(view: dict) -> bytes:
+    store.refresh()
+    endpoint = STREAM_ENDPOINTS.get(view.get("endpoint"))
+    if endpoint is None:
+        raise HTTPException(400, f"Unknown endpoint: {view.get('endpoint')}")
+    return endpoint(**view.get("params", {})).body
+
+
+def encode_frame(header: dict, png: bytes = b"") -> bytes:
+    """Stream frame: 4 byte big-endian header length, JSON header, PNG."""
+    header = json.dumps(header).encode()
+    return len(header).to_bytes(4, "big") + header + png
+
+
+@app.websocket("/api/stream")
+async def stream_slices(websocket: WebSocket):
+    """
+    Push rendered slices for the newest view state of every channel.
+
+    The client sends {"channel", "seq", "endpoint", "params"} messages, where endpoint is
+    "slice", "aligned" or "transform" and params are the path and query parameters of the
+    matching HTTP endpoint. A view replaced by a newer one on the same channel before its
+    rendering started is dropped, so at most one render per connection runs at a time and
+    the client always gets the latest state next. Every frame carries {"channel", "seq"}
+    and the PNG, or an "error" instead.
+    """
+    await websocket.accept()
+    pending = {}
+    ready = asyncio.Event()
+    closed = asyncio.Event()
+
+    async def receive():
+        try:
+            while True:
+                try:
+                    view = json.loads(await websocket.receive_text())
+                except ValueError:
+                    continue
+                if not isinstance(view, dict):
+                    continue
+                channel = view.get("channel")
+                if channel in pending:
+                    stream_frames["superseded"] += 1
+                # Re-inserting moves the channel behind the others that are waiting
+                pending.pop(channel, None)
+                pending[channel] = view
+                ready.set()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            closed.set()
+            ready.set()
 
-    return Response(content=png, media_type="image/png")
+    receiver = asyncio.create_task(receive())
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            if closed.is_set():
+                break
+            while pending and not closed.is_set():
+                channel = next(iter(pending))
+                view = pending.pop(channel)
+                header, png, status = (
+                    {"channel": channel, "seq": view.get("seq")},
+                    b"",
+                    200,
+                )
+                start = time.perf_counter()
+                try:
+                    png = await run_in_threadpool(render_view, view)
+                except HTTPException as e:
+                    header["error"], status = e.detail, e.status_code
+                except (ValidationError, TypeError) as e:
+                    header["error"], status = str(e), 422
+                except Exception as e:
+                    # A failed render (e.g. in SimpleITK) only fails its frame, not the stream
+                    header["error"], status = f"{type(e).__name__}: {e}", 500
+                request_latency.observe(
+                    time.perf_counter() - start, "WS", "/api/stream", str(status)
+                )
+                await websocket.send_bytes(encode_frame(header, png))
+                stream_frames["sent"] += 1
+    except WebSocketDisconnect:
+        # Client went away while a frame was being sent
+        pass
+    finally:
+        receiver.cancel()
 
 
 @app.post("/api/output")
 def set_output(req: PathRequest):
-    store.output_path = req.path
+    with store.locked():
+        store.output_path = req.path
+        store.save()
     return {"path": req.path}
 
 
 @app.post("/api/reset")
 def reset_state():
-    temp_output = store.temp_output_path
-    store.reset()
+    with store.locked():
+        temp_output = store.temp_output_path
+        store.reset()
     if temp_output:
         try:
             path = Path(temp_output)
@@ -513,7 +967,7 @@ def direction_to_rotation(direction: tuple) -> dict:
     d = np.array(direction).reshape(3, 3)
     # Extract Euler angles (XYZ convention) from rotation matrix
     # Clamp values to avoid numerical issues with asin
-    sy = np.sqrt(d[0, 0]**2 + d[1, 0]**2)
+    sy = np.sqrt(d[0, 0] ** 2 + d[1, 0] ** 2)
     singular = sy < 1e-6
 
     if not singular:
@@ -528,11 +982,11 @@ def direction_to_rotation(direction: tuple) -> dict:
     return {
         "x": round(np.degrees(x), 2),
         "y": round(np.degrees(y), 2),
-        "z": round(np.degrees(z), 2)
+        "z": round(np.degrees(z), 2),
     }
 
 
-def physical_center(meta: ImageMeta) -> tuple[float, float, float]:
+def physical_center(meta: Geometry) -> tuple[float, float, float]:
     direction = np.array(meta.direction, dtype=float).reshape(3, 3)
     spacing = np.array(meta.spacing, dtype=float)
     size = np.array(meta.size, dtype=float)
@@ -555,7 +1009,7 @@ def get_spatial_relation():
             "max": [meta.origin[i] + size_phys[i] for i in range(3)],
             "size": list(meta.size),
             "spacing": list(meta.spacing),
-            "size_mm": size_phys
+            "size_mm": size_phys,
         }
 
     source_bounds = get_bounds(sm)
@@ -567,8 +1021,16 @@ def get_spatial_relation():
         overlap_max = min(source_bounds["max"][i], target_bounds["max"][i])
         overlap[i] = max(0, overlap_max - overlap_min)
 
-    source_vol = source_bounds["size_mm"][0] * source_bounds["size_mm"][1] * source_bounds["size_mm"][2]
-    target_vol = target_bounds["size_mm"][0] * target_bounds["size_mm"][1] * target_bounds["size_mm"][2]
+    source_vol = (
+        source_bounds["size_mm"][0]
+        * source_bounds["size_mm"][1]
+        * source_bounds["size_mm"][2]
+    )
+    target_vol = (
+        target_bounds["size_mm"][0]
+        * target_bounds["size_mm"][1]
+        * target_bounds["size_mm"][2]
+    )
     overlap_vol = overlap[0] * overlap[1] * overlap[2]
 
     overlap_pct_source = (overlap_vol / source_vol * 100) if source_vol > 0 else 0
@@ -582,7 +1044,7 @@ def get_spatial_relation():
     rotation_diff = {
         "x": round(target_rot["x"] - source_rot["x"], 2),
         "y": round(target_rot["y"] - source_rot["y"], 2),
-        "z": round(target_rot["z"] - source_rot["z"], 2)
+        "z": round(target_rot["z"] - source_rot["z"], 2),
     }
 
     # Spacing ratio (target / source)
@@ -604,57 +1066,134 @@ def get_spatial_relation():
         "source_rotation": source_rot,
         "target_rotation": target_rot,
         "warning": overlap_pct_source < 50 or overlap_pct_target < 50,
-        "error": overlap_vol == 0
+        "error": overlap_vol == 0,
     }
 
 
 @app.post("/api/register")
 def register(req: RegisterRequest):
-    if not store.source_path:
-        raise HTTPException(400, "No source DICOM loaded")
-    if not store.source_mask_path:
-        raise HTTPException(400, "No source mask loaded")
-    if not store.target_path:
-        raise HTTPException(400, "No target DICOM loaded")
-
-    # Use temp file if no output path specified
-    if not store.output_path:
-        store.temp_output_path = tempfile.mktemp(suffix=".nii.gz")
-    output_file = store.output_path or store.temp_output_path
-
     reverse_map = {"auto": None, "normal": False, "reverse": True}
     reverse = reverse_map[req.reverse]
-
     task_id = str(uuid.uuid4())
-    store.tasks[task_id] = {"status": "running", "message": ""}
+
+    with store.locked():
+        if not store.source_path:
+            raise HTTPException(400, "No source DICOM loaded")
+        if not store.source_mask_path:
+            raise HTTPException(400, "No source mask loaded")
+        if not store.target_path:
+            raise HTTPException(400, "No target DICOM loaded")
+
+        # Use temp file if no output path specified
+        if not store.output_path:
+            store.temp_output_path = tempfile.mktemp(suffix=".nii.gz")
+        output_file = store.output_path or store.temp_output_path
+        source_path, source_mask_path, target_path = (
+            store.source_path,
+            store.source_mask_path,
+            store.target_path,
+        )
+
+        store.set_task(task_id, {"status": "running", "message": "", "quality": None})
+        store.registration = task_id
+        store.save()
+
+    def publish(arr: np.ndarray, geometry: Geometry) -> bool:
+        with store.locked():
+            if store.registration != task_id:
+                return False
+            store.target_mask_registered = arr
+            store.target_mask_meta = geometry
+            store.changed()
+        return True
+
+    def run_coarse():
+        """Publish a quick in-plane downsampled result while the full registration runs."""
+        from MaskRegistration.backend import coarse_register
+
+        source_meta, target_meta = store.get_meta("source"), store.get_meta("target")
+        mask = store.source_mask
+        if (
+            source_meta is None
+            or target_meta is None
+            or mask is None
+            or mask.shape != source_meta.shape
+        ):
+            return
+        start = time.perf_counter()
+        # The mask slices follow the file order, the source volume the slice locations
+        order = mask_slice_order(Path(source_path), mask.shape[0])
+        if order is None:
+            return
+        mask = mask[order]
+        arr, geometry, used_reverse = coarse_register(
+            mask, source_meta, target_meta, reverse, PREVIEW_SHRINK
+        )
+        stage_latency.observe(time.perf_counter() - start, "coarse_register")
+        if publish(arr, geometry):
+            used_direction = "reverse" if used_reverse else "normal"
+            store.set_task(
+                task_id,
+                {
+                    "status": "running",
+                    "message": f"Showing coarse preview (direction: {used_direction}), full registration running",
+                    "quality": "coarse",
+                    "used_direction": used_direction,
+                },
+            )
 
     def run_task():
         try:
+            import SimpleITK as sitk
+
+            from MaskRegistration.backend import transform
+
+            try:
+                run_coarse()
+            except Exception:
+                # The preview is optional, the full registration reports real problems
+                pass
             result = transform(
-                input_dicom_folder_1=Path(store.source_path),
-                input_mask_file=Path(store.source_mask_path),
-                input_dicom_folder_2=Path(store.target_path),
+                input_dicom_folder_1=Path(source_path),
+                input_mask_file=Path(source_mask_path),
+                input_dicom_folder_2=Path(target_path),
                 out_nii_file=Path(output_file),
                 reverse=reverse,
                 subpixel_factor=req.subpixel,
+                trace_memory=False,
             )
+            for stage, timing in result["timings"].items():
+                stage_latency.observe(timing["wall_s"], stage)
             nii_img = sitk.ReadImage(output_file)
-            arr = sitk.GetArrayFromImage(nii_img)
-            store.target_mask_registered = arr
-            store.target_mask_meta = ImageMeta(
-                origin=nii_img.GetOrigin(),
-                spacing=nii_img.GetSpacing(),
-                direction=nii_img.GetDirection(),
-                size=nii_img.GetSize()
+            publish(
+                sitk.GetArrayFromImage(nii_img),
+                Geometry(
+                    origin=nii_img.GetOrigin(),
+                    spacing=nii_img.GetSpacing(),
+                    direction=nii_img.GetDirection(),
+                    size=nii_img.GetSize(),
+                ),
             )
             used_direction = "reverse" if result["used_reverse"] else "normal"
-            store.tasks[task_id] = {
-                "status": "done",
-                "message": f"Registration complete (direction: {used_direction})",
-                "used_direction": used_direction
-            }
+            message = f"Registration complete (direction: {used_direction})"
+            if result["labels"][0]["missing"]:
+                message += f", missing labels: {', '.join(map(str, result['labels'][0]['missing']))}"
+            store.set_task(
+                task_id,
+                {
+                    "status": "done",
+                    "message": message,
+                    "quality": "full",
+                    "used_direction": used_direction,
+                    "labels": result["labels"][0],
+                    "timings": result["timings"],
+                },
+            )
         except Exception as e:
-            store.tasks[task_id] = {"status": "error", "message": str(e)}
+            quality = store.get_task(task_id).get("quality")
+            store.set_task(
+                task_id, {"status": "error", "message": str(e), "quality": quality}
+            )
 
     thread = Thread(target=run_task)
     thread.start()
@@ -664,9 +1203,80 @@ def register(req: RegisterRequest):
 
 @app.get("/api/status/{task_id}")
 def get_status(task_id: str):
-    if task_id not in store.tasks:
+    task = store.get_task(task_id)
+    if task is None:
         raise HTTPException(404, "Task not found")
-    return store.tasks[task_id]
+    return task
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    """Latency histograms, cache statistics and memory in the Prometheus text format."""
+    hits, misses = (
+        resampling.plan_cache_stats["hits"],
+        resampling.plan_cache_stats["misses"],
+    )
+    lines = request_latency.render() + stage_latency.render()
+    lines += render_metric(
+        "maskregistration_plan_cache_requests_total",
+        "counter",
+        "Resampling plan lookups by result",
+        [({"result": "hit"}, hits), ({"result": "miss"}, misses)],
+    )
+    lines += render_metric(
+        "maskregistration_plan_cache_hit_ratio",
+        "gauge",
+        "Share of resampling plan lookups served from the cache",
+        [({}, hits / (hits + misses) if hits + misses else 0.0)],
+    )
+    lines += render_metric(
+        "maskregistration_render_cache_requests_total",
+        "counter",
+        "Rendered slice lookups by result",
+        [
+            ({"result": "hit"}, render_cache.stats["hits"]),
+            ({"result": "miss"}, render_cache.stats["misses"]),
+        ],
+    )
+    lines += render_metric(
+        "maskregistration_stream_frames_total",
+        "counter",
+        "Slice stream views by outcome",
+        [({"result": result}, count) for result, count in stream_frames.items()],
+    )
+    lines += render_metric(
+        "maskregistration_jobs",
+        "gauge",
+        "Jobs of the /api/v1/jobs queue by status",
+        [
+            ({"status": status}, count)
+            for status, count in jobs.job_queue.counts().items()
+        ],
+    )
+    lines += render_metric(
+        "maskregistration_plan_cache_bytes",
+        "gauge",
+        "Memory held by cached resampling plans",
+        [({}, sum(plan.nbytes for plan in list(resampling._plan_cache.values())))],
+    )
+    rss, peak_rss = rss_bytes(), peak_rss_bytes()
+    if rss is not None:
+        lines += render_metric(
+            "maskregistration_rss_bytes",
+            "gauge",
+            "Resident set size of the server",
+            [({}, rss)],
+        )
+    if peak_rss is not None:
+        lines += render_metric(
+            "maskregistration_peak_rss_bytes",
+            "gauge",
+            "Peak resident set size of the server",
+            [({}, peak_rss)],
+        )
+    return PlainTextResponse(
+        "\n".join(lines) + "\n", media_type="text/plain; version=0.0.4"
+    )
 
 
 @app.post("/api/export")
@@ -684,8 +1294,40 @@ def export_mask(req: PathRequest):
 
 
 def main():
+    import argparse
+    import os
+    import webbrowser
+
+    parser = argparse.ArgumentParser(description="Interactive mask registration viewer")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="server processes sharing the loaded volumes (default: 1)",
+    )
+    args = parser.parse_args()
+
+    import uvicorn
+
     webbrowser.open("http://localhost:8000")
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    if args.workers <= 1:
+        uvicorn.run(app, host="127.0.0.1", port=8000)
+        return
+    # The workers import the app themselves and attach to one registry folder
+    shared_dir = None
+    if not os.environ.get("MASKREGISTRATION_SHARED_DIR"):
+        shared_dir = new_shared_dir()
+        os.environ["MASKREGISTRATION_SHARED_DIR"] = str(shared_dir)
+    try:
+        uvicorn.run(
+            "MaskRegistration.web.app:app",
+            host="127.0.0.1",
+            port=8000,
+            workers=args.workers,
+        )
+    finally:
+        if shared_dir is not None:
+            shutil.rmtree(shared_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+"""
+Stateless job API for pipeline integration: /api/v1/jobs.
+
+Unlike the viewer endpoints this does not use the loaded store. Every job carries its
+complete spec (paths and options), and many jobs can be submitted in one request. Jobs
+run on a shared pool of MASKREGISTRATION_JOB_WORKERS worker processes (default 2). With
+MASKREGISTRATION_MAX_MEMORY (e.g. 16G) every job is planned from its headers, jobs that
+cannot fit are rejected and the others only run side by side while their peaks fit.
+"""
+
+import os
+from pathlib import Path
+from typing import Literal
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+
+from MaskRegistration.jobs import JobQueue, refusal
+from MaskRegistration.planner import memory_limit_from_env
+
+router = APIRouter(prefix="/api/v1/jobs", tags=["jobs"])
+job_queue = JobQueue(
+    workers=int(os.environ.get("MASKREGISTRATION_JOB_WORKERS", 2)),
+    memory_limit=memory_limit_from_env(),
+)
+
+
+class JobSpec(BaseModel):
+    source: str
+    masks: list[str] = Field(min_length=1)
+    target: str
+    outputs: list[str]
+    reverse: Literal["auto", "true", "false"] = "auto"
+    subpixel: int = Field(1, ge=1)
+    backend: Literal["numpy", "sitk"] = "sitk"
+    crop: bool = False
+
+    def problems(self) -> list[str]:
+        problems = []
+        if len(self.masks) != len(self.outputs):
+            problems.append(f"{len(self.masks)} masks but {len(self.outputs)} outputs")
+        for folder in (self.source, self.target):
+            if not Path(folder).is_dir():
+                problems.append(f"DICOM folder not found: {folder}")
+        for mask in self.masks:
+            if not Path(mask).is_file():
+                problems.append(f"Mask not found: {mask}")
+        return problems
+
+    def to_job(self) -> dict:
+        return {
+            "source": self.source,
+            "target": self.target,
+            "masks": self.masks,
+            "outputs": self.outputs,
+            "options": {
+                "reverse": self.reverse,
+                "subpixel": self.subpixel,
+                "backend": self.backend,
+                "crop": self.crop,
+            },
+        }
+
+
+def summary(job: dict) -> dict:
+    return {
+        key: job[key] for key in ("id", "status", "submitted", "started", "finished")
+    }
+
+
+def plan_summary(plan: dict | None) -> dict | None:
+    if plan is None:
+        return None
+    return {key: plan[key] for key in ("peak_bytes", "seconds", "memory_limit")} | {
+        key: plan["options"][key] for key in ("chunk_slices", "sequential_trials")
+    }
+
+
+def details(job: dict) -> dict:
+    result = job["result"] or {}
+    started, finished = job["started"], job["finished"]
+    left_queue = started or finished
+    return {
+        **summary(job),
+        "spec": job["spec"],
+        "queue_s": left_queue - job["submitted"] if left_queue else None,
+        "run_s": finished - started if started and finished else None,
+        "used_reverse": result.get("used_reverse"),
+        "labels": result.get("labels"),
+        "timings": result.get("timings"),
+        "plan": plan_summary(job["plan"]),
+        "error": job["error"],
+    }
+
+
+def get_job(job_id: str) -> dict:
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
+
+
+@router.post("", status_code=202)
+def submit_jobs(specs: JobSpec | list[JobSpec]):
+    """Queue one job or a list of jobs; nothing is queued if any spec is invalid."""
+    specs = specs if isinstance(specs, list) else [specs]
+    problems = {i: spec.problems() for i, spec in enumerate(specs)}
+    problems = {i: p for i, p in problems.items() if p}
+    if problems:
+        raise HTTPException(
+            422, [{"job": i, "problems": p} for i, p in problems.items()]
+        )
+    jobs = [spec.to_job() for spec in specs]
+    plans = []
+    for i, job in enumerate(jobs):
+        try:
+            plans.append(job_queue.plan(job))
+        except ValueError as e:
+            problems[i] = [str(e)]
+            continue
+        if plans[-1] is not None and not plans[-1]["fits"]:
+            problems[i] = [refusal(plans[-1])]
+    if problems:
+        raise HTTPException(
+            422, [{"job": i, "problems": p} for i, p in problems.items()]
+        )
+    return {
+        "jobs": [summary(job_queue.submit(job, plan)) for job, plan in zip(jobs, plans)]
+    }
+
+
+@router.get("")
+def list_jobs(
+    status: Literal["queued", "running", "done", "failed", "cancelled"] = None
+):
+    return {"jobs": [summary(job) for job in job_queue.list(status)]}
+
+
+@router.get("/{job_id}")
+def get_job_details(job_id: str):
+    return details(get_job(job_id))
+
+
+@router.delete("/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued job. Running jobs cannot be interrupted."""
+    get_job(job_id)
+    if not job_queue.cancel(job_id):
+        raise HTTPException(
+            409,
+            f"Job is {job_queue.get(job_id)['status']}, only queued jobs can be cancelled",
+        )
+    return summary(job_queue.get(job_id))
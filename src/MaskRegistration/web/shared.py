@@ -0,0 +1,136 @@
+"""
+Loaded state of the viewer in a folder shared by several server processes.
+
+    maskregistration-web --workers 4
+
+Every array of the state (echo volumes, masks, registration results) is a raw file in the
+registry folder, and state.json next to them names the files together with the rest of
+the state: paths, geometries, selected echos, registration tasks and a version. Workers
+map the files read-only, so the data is held once however many workers attach. The
+folder is MASKREGISTRATION_SHARED_DIR, or a private folder removed at exit; new folders
+are created in /dev/shm where available, so the files live in shared memory. Masks are
+copied there too, even when memory-mapped from a file (see utils.load_mask_array): the
+mask cache may remove that file and the user may overwrite it while workers map it.
+
+state.json is replaced atomically and changed under a file lock, which a thread may take
+again while it holds it. Array files are written
+before the state names them and removed once it no longer does; a worker still mapping
+a removed file keeps its pages until it attaches the new state.
+"""
+
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the threads of one process are serialised
+    fcntl = None
+
+
+def empty_state() -> dict:
+    return {"revision": 0, "version": 0, "arrays": {}, "fields": {}, "tasks": {}}
+
+
+class VolumeRegistry:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.state_file = self.root / "state.json"
+        self._lock = threading.RLock()
+        self._held = False
+
+    @contextmanager
+    def locked(self):
+        with self._lock:
+            if self._held:
+                yield
+                return
+            with open(self.root / "lock", "a") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                self._held = True
+                try:
+                    yield
+                finally:
+                    self._held = False
+
+    def stamp(self) -> tuple | None:
+        """Changes whenever the state is replaced (every replacement is a new file)."""
+        try:
+            stat = self.state_file.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def read(self) -> dict:
+        try:
+            return json.loads(self.state_file.read_text())
+        except FileNotFoundError:
+            return empty_state()
+
+    def update(self, change) -> dict:
+        """Apply change(state) under the lock, publish the state and remove unused arrays."""
+        with self.locked():
+            state = self.read()
+            change(state)
+            state["revision"] += 1
+            fd, tmp = tempfile.mkstemp(suffix=".json.part", dir=self.root)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp, self.state_file)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            used = {entry["file"] for entry in state["arrays"].values()}
+            for path in self.root.glob("*.bin"):
+                if str(path) not in used:
+                    path.unlink(missing_ok=True)
+        return state
+
+    def put(self, name: str, arr: np.ndarray) -> dict:
+        """Entry for arr, written to a new array file. Call within update."""
+        path = self.root / f"{name}-{uuid.uuid4().hex}.bin"
+        np.ascontiguousarray(arr).tofile(path)
+        return {
+            "dtype": arr.dtype.str,
+            "shape": list(arr.shape),
+            "file": str(path),
+            "offset": 0,
+        }
+
+    @staticmethod
+    def attach(entry: dict) -> np.ndarray:
+        """Read-only view of an entry's file; no data is copied."""
+        dtype, shape = np.dtype(entry["dtype"]), tuple(entry["shape"])
+        if 0 in shape:
+            return np.empty(shape, dtype)
+        return np.memmap(
+            entry["file"], dtype=dtype, mode="r", offset=entry["offset"], shape=shape
+        )
+
+
+def new_shared_dir() -> Path:
+    """Fresh registry folder, in shared memory (/dev/shm) where available."""
+    shm = "/dev/shm"
+    base = shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else None
+    return Path(tempfile.mkdtemp(prefix="maskregistration-", dir=base))
+
+
+def open_registry() -> VolumeRegistry:
+    """Registry in MASKREGISTRATION_SHARED_DIR, or in a private folder removed at exit."""
+    root = os.environ.get("MASKREGISTRATION_SHARED_DIR")
+    if root:
+        return VolumeRegistry(Path(root))
+    root = new_shared_dir()
+    atexit.register(shutil.rmtree, root, True)
+    return VolumeRegistry(root)
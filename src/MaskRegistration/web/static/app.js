@@ -22,6 +22,8 @@ const state = {
     curtainDir: 'horizontal',
     blend: 0.5,
     zoom: 1,
+    // Layout of the source frame on screen from the last render (non-split modes)
+    view: null,
     currentSlice: 0,
     targetSlice: 0,
     direction: 'normal',
@@ -36,11 +38,13 @@ const state = {
         applyRotation: false,
         applyScale: false,
         active: false,
-        userEdited: false
+        userEdited: false,
+        preview: false
     }
 };
 
 let sliceUpdateTimeout = null;
+let viewportUpdateTimeout = null;
 function isTargetAligned() {
     return state.targetView === 'auto';
 }
@@ -48,6 +52,12 @@ function isTargetAligned() {
 function debouncedUpdateSlice(changedSide = null) {
     if (sliceUpdateTimeout) clearTimeout(sliceUpdateTimeout);
 
+    // The stream drops superseded views itself
+    if (streamOpen()) {
+        updateSlice();
+        return;
+    }
+
     // Immediately update the changed side, debounce the other
     if (changedSide) {
         updateSliceSingle(changedSide);
@@ -220,7 +230,8 @@ function resetManualTransformUI() {
         applyRotation: false,
         applyScale: false,
         active: false,
-        userEdited: false
+        userEdited: false,
+        preview: false
     };
 
     const checkboxIds = ['apply-offset', 'apply-rotation', 'apply-scale'];
@@ -423,29 +434,37 @@ async function autoRegister() {
     }
 }
 
-async function pollRegistration(taskId) {
+async function showRegisteredMask(data) {
+    state.target.hasRegisteredMask = true;
+    if (state.target.maskMode === 'off') {
+        state.target.maskMode = 'registered';
+    }
+    updateTargetMaskControls();
+
+    // Update direction dropdown if auto was used
+    if (data.used_direction) {
+        document.getElementById('reverse-select').value = data.used_direction;
+        state.direction = data.used_direction;
+    }
+    await updateSlice();
+}
+
+async function pollRegistration(taskId, quality = null) {
     const data = await (await fetch(`/api/status/${taskId}`)).json();
     if (data.status === 'running') {
-        return setTimeout(() => pollRegistration(taskId), 500);
+        // The coarse preview is shown as soon as it is published, the full result replaces it
+        if (data.quality === 'coarse' && quality !== 'coarse') {
+            showStatus(data.message, 'info');
+            await showRegisteredMask(data);
+        }
+        return setTimeout(() => pollRegistration(taskId, data.quality), 500);
     }
 
     if (data.status === 'done') {
         state.registrationDone = true;
         state.settingsChanged = false;
-        state.target.hasRegisteredMask = true;
-        if (state.target.maskMode === 'off') {
-            state.target.maskMode = 'registered';
-        }
-        updateTargetMaskControls();
-
-        // Update direction dropdown if auto was used
-        if (data.used_direction) {
-            document.getElementById('reverse-select').value = data.used_direction;
-            state.direction = data.used_direction;
-        }
-
+        await showRegisteredMask(data);
         showStatus(data.message, 'success');
-        await updateSlice();
         updateUI();
     } else {
         showStatus(`Error: ${data.message}`, 'error');
@@ -496,34 +515,83 @@ async function resetAll() {
     window.location.reload();
 }
 
-async function loadSourceImage() {
-    if (state.source.slices === 0) return null;
-    const url = `/api/slice/source/${state.currentSlice}?mask=${state.source.hasMask}&t=${Date.now()}`;
+// Visible part of the source frame (in frame pixels) and the device pixels it covers,
+// so the server renders only what is on screen. Null renders the full frame.
+function getSourceViewport() {
+    const view = state.view;
+    const [frameW, frameH] = state.source.size;
+    if (!view || state.mode === 'split' || !frameW || !frameH) return null;
+    const x0 = Math.max(0, Math.floor(-view.offsetX / view.scale));
+    const y0 = Math.max(0, Math.floor(-view.offsetY / view.scale));
+    const x1 = Math.min(frameW, Math.ceil((view.containerW - view.offsetX) / view.scale));
+    const y1 = Math.min(frameH, Math.ceil((view.containerH - view.offsetY) / view.scale));
+    if (x1 <= x0 || y1 <= y0) return null;
+    const ratio = window.devicePixelRatio || 1;
+    return {
+        x: x0,
+        y: y0,
+        w: x1 - x0,
+        h: y1 - y0,
+        outW: Math.ceil((x1 - x0) * view.scale * ratio),
+        outH: Math.ceil((y1 - y0) * view.scale * ratio),
+        frameW,
+        frameH
+    };
+}
+
+function setViewportParams(params, viewport) {
+    if (!viewport) return;
+    params.set('roi_x', viewport.x);
+    params.set('roi_y', viewport.y);
+    params.set('roi_w', viewport.w);
+    params.set('roi_h', viewport.h);
+    params.set('out_w', viewport.outW);
+    params.set('out_h', viewport.outH);
+}
+
+function loadImage(url, viewport = null) {
     return new Promise((resolve) => {
         const img = new Image();
-        img.onload = () => resolve(img);
+        img.onload = () => {
+            img.viewport = viewport;
+            resolve(img);
+        };
         img.onerror = () => resolve(null);
         img.src = url;
     });
 }
 
-async function loadTargetAligned() {
+// Fetch the slices again once zooming, panning or resizing has settled
+function debouncedViewportUpdate() {
+    if (viewportUpdateTimeout) clearTimeout(viewportUpdateTimeout);
+    viewportUpdateTimeout = setTimeout(() => {
+        if (state.source.imageData || state.target.imageData) updateSlice();
+    }, 150);
+}
+
+// Slice requests are described as views: the endpoint ('slice', 'aligned' or
+// 'transform'), path parameters, query parameters and the requested viewport. They are
+// fetched over HTTP or, while the slice stream is open, sent through it.
+function sourceView() {
+    if (state.source.slices === 0) return null;
+    const viewport = getSourceViewport();
+    const params = new URLSearchParams({ mask: state.source.hasMask });
+    setViewportParams(params, viewport);
+    return { endpoint: 'slice', side: 'source', index: state.currentSlice, params, viewport };
+}
+
+function alignedView() {
     if (state.target.slices === 0) return null;
     const reverse = state.direction === 'reverse';
     const maskQuery = getTargetMaskQuery();
     const params = new URLSearchParams({
         mask: maskQuery.mask,
-        reverse,
-        t: Date.now()
+        reverse
     });
     if (maskQuery.maskMode) params.set('mask_mode', maskQuery.maskMode);
-    const url = `/api/slice/aligned/${state.currentSlice}?${params}`;
-    return new Promise((resolve) => {
-        const img = new Image();
-        img.onload = () => resolve(img);
-        img.onerror = () => resolve(null);
-        img.src = url;
-    });
+    const viewport = getSourceViewport();
+    setViewportParams(params, viewport);
+    return { endpoint: 'aligned', index: state.currentSlice, params, viewport };
 }
 
 function applyManualTransform() {
@@ -557,7 +625,7 @@ function applyManualTransform() {
     updateSlice();
 }
 
-async function loadTargetOriginal() {
+function originalView() {
     if (state.target.slices === 0) return null;
     let targetSliceIdx = state.targetSlice;
     // Only sync with source when target view is auto-aligned and not in split mode.
@@ -572,21 +640,12 @@ async function loadTargetOriginal() {
     const maskQuery = state.targetView === 'original'
         ? getOriginalTargetMaskQuery()
         : getTargetMaskQuery();
-    const params = new URLSearchParams({
-        mask: maskQuery.mask,
-        t: Date.now()
-    });
+    const params = new URLSearchParams({ mask: maskQuery.mask });
     if (maskQuery.maskMode) params.set('mask_mode', maskQuery.maskMode);
-    const url = `/api/slice/target/${targetSliceIdx}?${params}`;
-    return new Promise((resolve) => {
-        const img = new Image();
-        img.onload = () => resolve(img);
-        img.onerror = () => resolve(null);
-        img.src = url;
-    });
+    return { endpoint: 'slice', side: 'target', index: targetSliceIdx, params, viewport: null };
 }
 
-async function loadTargetWithManualTransform() {
+function manualView() {
     if (state.target.slices === 0) return null;
     if (state.targetView !== 'manual') return null;
 
@@ -609,67 +668,167 @@ async function loadTargetWithManualTransform() {
         apply_rotation: mt.applyRotation,
         apply_scale: mt.applyScale,
         output: 'target',
-        reverse,
-        t: Date.now()
+        reverse
     });
     if (maskQuery.maskMode) params.set('mask_mode', maskQuery.maskMode);
-    const url = `/api/transform/${sliceIndex}?${params}`;
-    return new Promise((resolve) => {
-        const img = new Image();
-        img.onload = () => resolve(img);
-        img.onerror = () => resolve(null);
-        img.src = url;
-    });
+    if (mt.preview) params.set('preview', true);
+    // Previews come at reduced resolution, draw them over the whole target frame
+    const [frameW, frameH] = state.target.size;
+    const viewport = { x: 0, y: 0, w: frameW, h: frameH, frameW, frameH };
+    return { endpoint: 'transform', index: sliceIndex, params, viewport };
 }
 
-async function updateSliceSingle(side) {
-    if (side === 'source') {
-        document.getElementById('slice-info').textContent =
-            `${state.currentSlice + 1} / ${state.source.slices}`;
-        const img = await loadSourceImage();
-        if (img) state.source.imageData = img;
-    } else {
-        if (state.target.slices > 0) {
-            document.getElementById('target-slice-slider-info').textContent =
-                `${state.targetSlice + 1} / ${state.target.slices}`;
-        }
-        const [aligned, original, manual] = await Promise.all([
-            loadTargetAligned(),
-            loadTargetOriginal(),
-            loadTargetWithManualTransform()
-        ]);
-        state.target.imageData = aligned || original;
-        state.target.originalImageData = original;
-        state.target.manualTransformData = manual;
+function viewUrl(view) {
+    let path = `/api/transform/${view.index}`;
+    if (view.endpoint === 'slice') path = `/api/slice/${view.side}/${view.index}`;
+    if (view.endpoint === 'aligned') path = `/api/slice/aligned/${view.index}`;
+    const params = new URLSearchParams(view.params);
+    params.set('t', Date.now());
+    return `${path}?${params}`;
+}
+
+async function loadView(view) {
+    return view ? loadImage(viewUrl(view), view.viewport) : null;
+}
+
+// Views of the displayed images by stream channel
+function sideViews(side) {
+    if (side === 'source') return { source: sourceView() };
+    return { aligned: alignedView(), original: originalView(), manual: manualView() };
+}
+
+function setImages(images) {
+    Object.assign(stream.images, images);
+    if ('source' in images) state.source.imageData = images.source;
+    if ('original' in images) {
+        state.target.imageData = images.aligned || images.original;
+        state.target.originalImageData = images.original;
+        state.target.manualTransformData = images.manual;
     }
     document.getElementById('viewer-placeholder').classList.toggle('hidden',
         state.source.imageData || state.target.imageData);
     renderViewer();
 }
 
-async function updateSlice() {
+async function loadViews(views) {
+    const channels = Object.keys(views);
+    const images = await Promise.all(channels.map(channel => loadView(views[channel])));
+    setImages(Object.fromEntries(channels.map((channel, i) => [channel, images[i]])));
+}
+
+function updateSliceInfo() {
     document.getElementById('slice-info').textContent =
         `${state.currentSlice + 1} / ${state.source.slices}`;
-
     if (state.target.slices > 0) {
         document.getElementById('target-slice-slider-info').textContent =
             `${state.targetSlice + 1} / ${state.target.slices}`;
     }
+}
+
+async function updateSliceSingle(side) {
+    updateSliceInfo();
+    const views = sideViews(side);
+    if (!streamViews(views)) await loadViews(views);
+}
 
-    const [sourceImg, targetAligned, targetOriginal, targetManual] = await Promise.all([
-        loadSourceImage(),
-        loadTargetAligned(),
-        loadTargetOriginal(),
-        loadTargetWithManualTransform()
-    ]);
+async function updateSlice() {
+    updateSliceInfo();
+    const views = { ...sideViews('source'), ...sideViews('target') };
+    if (!streamViews(views)) await loadViews(views);
+}
 
-    state.source.imageData = sourceImg;
-    state.target.imageData = targetAligned || targetOriginal;
-    state.target.originalImageData = targetOriginal;
-    state.target.manualTransformData = targetManual;
+// Slice stream: the server renders only the newest view per channel and pushes frames
+// as they finish, so views are sent without debouncing and never pile up.
+const stream = {
+    socket: null,
+    seq: 0,
+    // Newest frame accepted per channel, and the viewport of every view in flight
+    shown: {},
+    viewports: {},
+    images: { source: null, aligned: null, original: null, manual: null }
+};
 
-    document.getElementById('viewer-placeholder').classList.toggle('hidden', sourceImg || targetAligned || targetOriginal);
-    renderViewer();
+function streamOpen() {
+    return stream.socket !== null && stream.socket.readyState === WebSocket.OPEN;
+}
+
+function connectStream() {
+    const protocol = location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${protocol}://${location.host}/api/stream`);
+    socket.binaryType = 'arraybuffer';
+    socket.onopen = () => { stream.socket = socket; };
+    socket.onmessage = (e) => handleStreamFrame(e.data);
+    // Fall back to HTTP requests while reconnecting
+    socket.onclose = () => {
+        stream.socket = null;
+        setTimeout(connectStream, 2000);
+    };
+}
+
+function streamViews(views) {
+    if (!streamOpen()) return false;
+    for (const [channel, view] of Object.entries(views)) {
+        const seq = ++stream.seq;
+        if (!view) {
+            stream.shown[channel] = seq;
+            stream.images[channel] = null;
+            continue;
+        }
+        stream.viewports[channel] = stream.viewports[channel] || new Map();
+        stream.viewports[channel].set(seq, view.viewport);
+        const params = Object.fromEntries(view.params);
+        params.index = view.index;
+        if (view.side) params.side = view.side;
+        stream.socket.send(JSON.stringify({ channel, seq, endpoint: view.endpoint, params }));
+    }
+    setImages(stream.images);
+    return true;
+}
+
+function handleStreamFrame(buffer) {
+    const length = new DataView(buffer).getUint32(0);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, length)));
+    const { channel, seq } = header;
+    const viewports = stream.viewports[channel] || new Map();
+    const viewport = viewports.get(seq) || null;
+    for (const key of viewports.keys()) {
+        if (key <= seq) viewports.delete(key);
+    }
+    // Frames of views older than the displayed one arrive late, skip them
+    if (seq <= (stream.shown[channel] || 0)) return;
+    stream.shown[channel] = seq;
+    if (header.error) {
+        stream.images[channel] = null;
+        setImages(stream.images);
+        return;
+    }
+    const url = URL.createObjectURL(new Blob([new Uint8Array(buffer, 4 + length)], { type: 'image/png' }));
+    const img = new Image();
+    img.onload = () => {
+        URL.revokeObjectURL(url);
+        if (stream.shown[channel] !== seq) return;
+        img.viewport = viewport;
+        stream.images[channel] = img;
+        setImages(stream.images);
+    };
+    img.src = url;
+}
+
+// Size of the full frame an image shows (a part of)
+function frameSize(img) {
+    return img.viewport ? [img.viewport.frameW, img.viewport.frameH] : [img.width, img.height];
+}
+
+// Draw an image into the frame rectangle (x, y, w, h), a viewport image at its region
+function drawFrameImage(ctx, img, x, y, w, h) {
+    const viewport = img.viewport;
+    if (!viewport) {
+        ctx.drawImage(img, x, y, w, h);
+        return;
+    }
+    const scaleX = w / viewport.frameW;
+    const scaleY = h / viewport.frameH;
+    ctx.drawImage(img, x + viewport.x * scaleX, y + viewport.y * scaleY, viewport.w * scaleX, viewport.h * scaleY);
 }
 
 function renderViewer() {
@@ -709,11 +868,13 @@ function renderViewer() {
         const paneW = Math.max(1, Math.floor((containerW - gap) / 2));
         const paneH = containerH;
 
+        state.view = null;
         const getSplitMetrics = (img) => {
             if (!img) return null;
-            const scale = Math.min(paneW / img.width, paneH / img.height) * state.zoom;
-            const w = Math.floor(img.width * scale);
-            const h = Math.floor(img.height * scale);
+            const [frameW, frameH] = frameSize(img);
+            const scale = Math.min(paneW / frameW, paneH / frameH) * state.zoom;
+            const w = Math.floor(frameW * scale);
+            const h = Math.floor(frameH * scale);
             const maxPanX = Math.max(0, (w - paneW) / 2);
             const maxPanY = Math.max(0, (h - paneH) / 2);
             return { w, h, maxPanX, maxPanY };
@@ -749,7 +910,7 @@ function renderViewer() {
             const offsetY = Math.round((paneH - metrics.h) / 2 + state.pan.y);
             const ctx = canvas.getContext('2d');
             ctx.clearRect(0, 0, paneW, paneH);
-            ctx.drawImage(img, offsetX, offsetY, metrics.w, metrics.h);
+            drawFrameImage(ctx, img, offsetX, offsetY, metrics.w, metrics.h);
         };
 
         renderSplit(sourceCanvas, sourceImg, sourceMetrics);
@@ -764,8 +925,7 @@ function renderViewer() {
 
     const baseImg = state.mode === 'target' ? (targetImg || sourceImg) : (sourceImg || targetImg);
     if (!baseImg) return;
-    const baseW = baseImg.width;
-    const baseH = baseImg.height;
+    const [baseW, baseH] = frameSize(baseImg);
     const displayScale = Math.min(containerW / baseW, containerH / baseH) * state.zoom;
 
     const w = Math.floor(baseW * displayScale);
@@ -780,6 +940,9 @@ function renderViewer() {
     const canPan = maxPanX > 0 || maxPanY > 0;
     state.pan.canPan = canPan;
     container.style.cursor = state.pan.isDragging ? 'grabbing' : (canPan ? 'grab' : 'default');
+    state.view = baseImg === sourceImg
+        ? { scale: w / baseW, offsetX: panOffsetX, offsetY: panOffsetY, containerW, containerH }
+        : null;
 
     [sourceCanvas, targetCanvas].forEach(canvas => {
         canvas.style.display = 'block';
@@ -797,7 +960,7 @@ function renderViewer() {
     sourceCtx.clearRect(0, 0, w, h);
     targetCtx.clearRect(0, 0, w, h);
 
-    if (sourceImg) sourceCtx.drawImage(sourceImg, 0, 0, w, h);
+    if (sourceImg) drawFrameImage(sourceCtx, sourceImg, 0, 0, w, h);
     if (targetImg) {
         const showOriginalOverlay = (state.targetView === 'original' ||
             (state.targetView === 'manual' && !state.manualTransform.active)) &&
@@ -817,11 +980,11 @@ function renderViewer() {
                 targetImg,
                 Math.floor(offsetX * displayScale),
                 Math.floor(offsetY * displayScale),
-                Math.floor(targetImg.width * scaleX),
-                Math.floor(targetImg.height * scaleY)
+                Math.floor(frameSize(targetImg)[0] * scaleX),
+                Math.floor(frameSize(targetImg)[1] * scaleY)
             );
         } else {
-            targetCtx.drawImage(targetImg, 0, 0, w, h);
+            drawFrameImage(targetCtx, targetImg, 0, 0, w, h);
         }
     }
 
@@ -1051,6 +1214,7 @@ document.getElementById('zoom-slider').addEventListener('input', (e) => {
     state.zoom = parseInt(e.target.value) / 100;
     document.getElementById('zoom-info').textContent = `${e.target.value}%`;
     renderViewer();
+    debouncedViewportUpdate();
 });
 
 document.getElementById('target-slice-slider').addEventListener('input', (e) => {
@@ -1150,6 +1314,7 @@ window.addEventListener('mouseup', () => {
     if (!state.pan.isDragging) return;
     state.pan.isDragging = false;
     renderViewer();
+    debouncedViewportUpdate();
 });
 
 // Spatial drag
@@ -1170,7 +1335,10 @@ window.addEventListener('mousemove', (e) => {
 window.addEventListener('mouseup', () => spatialViz.isDragging = false);
 
 // Resize
-window.addEventListener('resize', renderViewer);
+window.addEventListener('resize', () => {
+    renderViewer();
+    debouncedViewportUpdate();
+});
 
 // Transform controls - live update
 const transformGroups = [
@@ -1192,9 +1360,26 @@ function syncTransformInputs() {
 }
 
 let transformDebounce = null;
+let transformSettleTimeout = null;
+// While the parameters change the transformed slice is rendered as a low resolution
+// preview; the full resolution render follows once they have been still for a moment
+function previewManualTransform() {
+    state.manualTransform.preview = true;
+    applyManualTransform();
+    if (transformSettleTimeout) clearTimeout(transformSettleTimeout);
+    transformSettleTimeout = setTimeout(() => {
+        state.manualTransform.preview = false;
+        updateSliceSingle('target');
+    }, 300);
+}
+
 function debouncedTransformUpdate() {
     if (transformDebounce) clearTimeout(transformDebounce);
-    transformDebounce = setTimeout(applyManualTransform, 150);
+    if (streamOpen()) {
+        previewManualTransform();
+        return;
+    }
+    transformDebounce = setTimeout(previewManualTransform, 150);
 }
 
 ['apply-offset', 'apply-rotation', 'apply-scale'].forEach(id => {
@@ -1226,3 +1411,4 @@ transformValueInputs.forEach(id => {
 
 syncTransformInputs();
 updateTargetMaskControls();
+connectStream();
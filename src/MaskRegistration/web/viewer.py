@@ -1,64 +1,242 @@
+import threading
+from collections import OrderedDict
 from io import BytesIO
 
 import numpy as np
-from PIL import Image
+
+from MaskRegistration.resampling import Geometry
 
 LABEL_COLORS = [
-    (255, 0, 0),      # Red
-    (0, 255, 0),      # Green
-    (0, 0, 255),      # Blue
-    (255, 255, 0),    # Yellow
-    (255, 0, 255),    # Magenta
-    (0, 255, 255),    # Cyan
-    (255, 128, 0),    # Orange
-    (128, 0, 255),    # Purple
-    (0, 255, 128),    # Spring Green
-    (255, 0, 128),    # Rose
+    (255, 0, 0),  # Red
+    (0, 255, 0),  # Green
+    (0, 0, 255),  # Blue
+    (255, 255, 0),  # Yellow
+    (255, 0, 255),  # Magenta
+    (0, 255, 255),  # Cyan
+    (255, 128, 0),  # Orange
+    (128, 0, 255),  # Purple
+    (0, 255, 128),  # Spring Green
+    (255, 0, 128),  # Rose
 ]
 
 
-def normalize_dicom(arr: np.ndarray) -> np.ndarray:
+class Viewport:
+    """
+    Part of a slice frame to render: the pixel box (x, y, width, height) in columns and
+    rows of the full frame, scaled to out_width x out_height. The output never has more
+    pixels than the box, the browser scales up further when zoomed in.
+    """
+
+    def __init__(
+        self, x: int, y: int, width: int, height: int, out_width: int, out_height: int
+    ):
+        self.x, self.y, self.width, self.height = (
+            int(x),
+            int(y),
+            int(width),
+            int(height),
+        )
+        self.out_width, self.out_height = int(out_width), int(out_height)
+
+    @classmethod
+    def parse(
+        cls,
+        frame_width: int,
+        frame_height: int,
+        roi_x: int = None,
+        roi_y: int = None,
+        roi_w: int = None,
+        roi_h: int = None,
+        out_w: int = None,
+        out_h: int = None,
+    ) -> "Viewport":
+        """Viewport from query parameters, clipped to the frame; missing values select the full frame."""
+        x = min(max(roi_x or 0, 0), frame_width - 1)
+        y = min(max(roi_y or 0, 0), frame_height - 1)
+        width = min(max(roi_w or frame_width, 1), frame_width - x)
+        height = min(max(roi_h or frame_height, 1), frame_height - y)
+        out_width = min(max(out_w or width, 1), width)
+        out_height = min(max(out_h or height, 1), height)
+        return cls(x, y, width, height, out_width, out_height)
+
+    def key(self) -> tuple:
+        return self.x, self.y, self.width, self.height, self.out_width, self.out_height
+
+    def __repr__(self) -> str:
+        return f"Viewport{self.key()}"
+
+    @property
+    def is_scaled(self) -> bool:
+        return (self.out_width, self.out_height) != (self.width, self.height)
+
+    def reduced(self, factor: int) -> "Viewport":
+        """Same region at 1/factor of the output size."""
+        out_width = max(1, -(-self.out_width // factor))
+        out_height = max(1, -(-self.out_height // factor))
+        return Viewport(self.x, self.y, self.width, self.height, out_width, out_height)
+
+    def pixel_centers(self) -> tuple[np.ndarray, np.ndarray]:
+        """Frame column and row coordinates of the output pixel centres."""
+        scale_x, scale_y = self.width / self.out_width, self.height / self.out_height
+        columns = self.x + (np.arange(self.out_width) + 0.5) * scale_x - 0.5
+        rows = self.y + (np.arange(self.out_height) + 0.5) * scale_y - 0.5
+        return columns, rows
+
+    def nearest(self, arr: np.ndarray) -> np.ndarray:
+        """Nearest neighbour samples of a 2D frame array (labels) at the output pixels."""
+        columns, rows = self.pixel_centers()
+        columns = np.clip(np.floor(columns + 0.5).astype(np.intp), 0, arr.shape[1] - 1)
+        rows = np.clip(np.floor(rows + 0.5).astype(np.intp), 0, arr.shape[0] - 1)
+        return arr[np.ix_(rows, columns)]
+
+    def grid(self, frame: Geometry, index: int) -> Geometry:
+        """Single slice output grid of this viewport on slice index of a volume grid."""
+        columns, rows = self.pixel_centers()
+        corner = np.array([columns[0], rows[0], index], dtype=float)
+        origin = np.asarray(frame.origin) + frame.index_to_physical() @ corner
+        spacing = (
+            frame.spacing[0] * self.width / self.out_width,
+            frame.spacing[1] * self.height / self.out_height,
+            frame.spacing[2],
+        )
+        return Geometry(
+            origin, spacing, frame.direction, (self.out_width, self.out_height, 1)
+        )
+
+
+def window_levels(arr: np.ndarray) -> tuple:
+    """Display window (1st and 99th percentile) of an image or volume."""
+    return tuple(np.percentile(arr.astype(np.float32), (1, 99)))
+
+
+def normalize_dicom(arr: np.ndarray, levels: tuple = None) -> np.ndarray:
     arr = arr.astype(np.float32)
-    p1, p99 = np.percentile(arr, (1, 99))
+    p1, p99 = levels if levels is not None else np.percentile(arr, (1, 99))
     arr = np.clip(arr, p1, p99)
     arr = (arr - p1) / (p99 - p1 + 1e-8) * 255
     return arr.astype(np.uint8)
 
 
-def slice_to_png(dicom_volume: np.ndarray, slice_idx: int) -> bytes:
-    slice_data = dicom_volume[slice_idx]
-    normalized = normalize_dicom(slice_data)
-    img = Image.fromarray(normalized, mode='L').convert('RGB')
+def overlay_mask(
+    gray: np.ndarray, mask_slice: np.ndarray, alpha: float = 0.4
+) -> np.ndarray:
+    """Blend the label colours into a grayscale slice, returning RGB."""
+    rgb = np.stack([gray, gray, gray], axis=-1)
+    labeled = mask_slice > 0
+    if labeled.any():
+        colors = np.array(LABEL_COLORS)
+        label_colors = colors[
+            (mask_slice[labeled] - 1).astype(np.int64) % len(LABEL_COLORS)
+        ]
+        rgb[labeled] = (1 - alpha) * rgb[labeled] + alpha * label_colors
+    return rgb
+
+
+def _render_gray(
+    slice_data: np.ndarray, viewport: Viewport | None, levels: tuple | None
+) -> np.ndarray:
+    from PIL import Image
+
+    if viewport is None:
+        return normalize_dicom(slice_data, levels)
+    # Window of the whole slice, so that the contrast does not change with zoom and pan
+    levels = levels if levels is not None else window_levels(slice_data)
+    region = slice_data[
+        viewport.y : viewport.y + viewport.height,
+        viewport.x : viewport.x + viewport.width,
+    ]
+    gray = normalize_dicom(region, levels)
+    if viewport.is_scaled:
+        gray = np.asarray(
+            Image.fromarray(gray, mode="L").resize(
+                (viewport.out_width, viewport.out_height), Image.BILINEAR
+            )
+        )
+    return gray
+
+
+def _encode_png(img) -> bytes:
     buffer = BytesIO()
-    img.save(buffer, format='PNG')
+    img.save(buffer, format="PNG")
     return buffer.getvalue()
 
 
+def slice_to_png(
+    dicom_volume: np.ndarray,
+    slice_idx: int,
+    viewport: Viewport = None,
+    levels: tuple = None,
+) -> bytes:
+    from PIL import Image
+
+    normalized = _render_gray(dicom_volume[slice_idx], viewport, levels)
+    img = Image.fromarray(normalized, mode="L").convert("RGB")
+    return _encode_png(img)
+
+
 def slice_with_mask_to_png(
     dicom_volume: np.ndarray,
     mask_volume: np.ndarray,
     slice_idx: int,
-    alpha: float = 0.4
+    alpha: float = 0.4,
+    viewport: Viewport = None,
+    levels: tuple = None,
 ) -> bytes:
-    slice_data = dicom_volume[slice_idx]
-    normalized = normalize_dicom(slice_data)
-    rgb = np.stack([normalized, normalized, normalized], axis=-1)
+    """
+    Render a slice with the label overlay.
+
+    With a viewport only its region is windowed, scaled, blended and encoded; levels
+    default to the window of the slice.
+    """
+    from PIL import Image
+
+    normalized = _render_gray(dicom_volume[slice_idx], viewport, levels)
 
     if mask_volume is not None and slice_idx < mask_volume.shape[0]:
         mask_slice = mask_volume[slice_idx]
-        labels = np.unique(mask_slice[mask_slice > 0])
-
-        for label in labels:
-            color = LABEL_COLORS[int(label - 1) % len(LABEL_COLORS)]
-            mask = mask_slice == label
-            for c in range(3):
-                rgb[:, :, c] = np.where(
-                    mask,
-                    (1 - alpha) * rgb[:, :, c] + alpha * color[c],
-                    rgb[:, :, c]
-                )
-
-    img = Image.fromarray(rgb.astype(np.uint8), mode='RGB')
-    buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    return buffer.getvalue()
+        if viewport is not None:
+            mask_slice = viewport.nearest(mask_slice)
+        rgb = overlay_mask(normalized, mask_slice, alpha)
+    else:
+        rgb = np.stack([normalized, normalized, normalized], axis=-1)
+
+    img = Image.fromarray(rgb.astype(np.uint8), mode="RGB")
+    return _encode_png(img)
+
+
+class RenderCache:
+    """Least recently used cache of encoded slices, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes: int = 64 * 1024**2):
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes | None:
+        with self._lock:
+            if key in self._entries:
+                self.stats["hits"] += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: tuple, data: bytes) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._bytes -= len(self._entries.popitem(last=False)[1])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
@@ -1,6 +1,8 @@
-import pytest
 import tempfile
 from pathlib import Path
+
+import pytest
+
 from src.MaskRegistration import transform
 
 
@@ -65,5 +67,26 @@ def test_transform_dess_to_t1rho(test_data, temp_path):
     assert output_file.exists(), "Output file was not created"
 
 
+def test_transform_multiple_masks(test_data, temp_path):
+    dess_folder = test_data / "6_PRE_dess_cor_16654"
+    t2_folder = test_data / "10_T2_map_cor_25681"
+    output_files = [
+        temp_path / "output_mask_a.nii.gz",
+        temp_path / "output_mask_b.nii.gz",
+    ]
+
+    result = transform(
+        input_dicom_folder_1=dess_folder,
+        input_mask_file=[dess_folder / "mask.nii.gz", dess_folder / "mask.nii.gz"],
+        input_dicom_folder_2=t2_folder,
+        out_nii_file=output_files,
+    )
+
+    # Both masks share one direction detection and get their own output file.
+    assert result["outputs"] == output_files
+    for output_file in output_files:
+        assert output_file.exists(), "Output file was not created"
+
+
 if __name__ == "__main__":
     pytest.main()
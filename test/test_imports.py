@@ -0,0 +1,46 @@
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ["SimpleITK", "nibabel", "pydicom", "natsort", "PIL", "uvicorn"]
+
+
+def loaded_heavy_modules(code: str) -> list[str]:
+    """Run code in a fresh interpreter and return the heavy modules it imported."""
+    check = f"import sys\n{code}\nprint(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", check], capture_output=True, text=True, check=True
+    )
+    return result.stdout.splitlines()[-1].split()
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import MaskRegistration",
+        "import MaskRegistration.resampling, MaskRegistration.utils, MaskRegistration.metrics",
+        "import MaskRegistration.web.app",
+        "import MaskRegistration.watch",
+    ],
+)
+def test_imports_do_not_load_imaging_libraries(code):
+    assert loaded_heavy_modules(code) == []
+
+
+def test_cli_help_does_not_load_imaging_libraries():
+    code = (
+        "from MaskRegistration.MaskRegistration import main\n"
+        "sys.argv = ['maskregistration', '--help']\n"
+        "try:\n    main()\nexcept SystemExit:\n    pass"
+    )
+    assert loaded_heavy_modules(code) == []
+
+
+def test_transform_is_loaded_on_first_access():
+    import MaskRegistration
+    from MaskRegistration.backend import transform
+
+    assert MaskRegistration.transform is transform
+    with pytest.raises(AttributeError):
+        MaskRegistration.missing
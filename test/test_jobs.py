@@ -0,0 +1,175 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import nibabel as nib
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from MaskRegistration import jobs as jobs_module
+from MaskRegistration.jobs import JobQueue, plan_job, run_job
+from MaskRegistration.synthetic import write_series
+from MaskRegistration.web.app import app
+from MaskRegistration.web.jobs import JobSpec
+
+
+@pytest.fixture(scope="module")
+def study(tmp_path_factory):
+    root = tmp_path_factory.mktemp("study")
+    write_series(root / "source", labels=2)
+    write_series(
+        root / "target", orientation="axial", slices=12, spacing=(0.6, 0.6, 1.5)
+    )
+    return root
+
+
+def run_or_crash(job):
+    """run_job, or kill the worker process like the OOM killer would for jobs marked crash."""
+    if job.get("crash"):
+        os._exit(137)
+    return run_job(job)
+
+
+def spec(study, output, **options):
+    return {
+        "source": (study / "source").as_posix(),
+        "masks": [(study / "source" / "mask.nii.gz").as_posix()],
+        "target": (study / "target").as_posix(),
+        "outputs": [output.as_posix()],
+        **options,
+    }
+
+
+def wait_for(client, job_id, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/api/v1/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.1)
+    raise TimeoutError(job_id)
+
+
+def test_job_api_runs_batch_and_reports_timings(study, tmp_path):
+    client = TestClient(app)
+
+    response = client.post(
+        "/api/v1/jobs",
+        json=[
+            spec(study, tmp_path / "a.nii.gz"),
+            spec(study, tmp_path / "b.nii.gz", reverse="false"),
+        ],
+    )
+    assert response.status_code == 202
+    ids = [job["id"] for job in response.json()["jobs"]]
+    jobs = [wait_for(client, job_id) for job_id in ids]
+
+    assert [job["status"] for job in jobs] == ["done", "done"]
+    assert jobs[1]["used_reverse"] is False
+    assert "resample" in jobs[0]["timings"] and jobs[0]["run_s"] > 0
+    assert jobs[0]["labels"][0]["missing"] == [] and set(
+        jobs[0]["labels"][0]["labels"]
+    ) == {"1", "2"}
+    assert set(np.unique(np.round(nib.load(tmp_path / "a.nii.gz").get_fdata()))) == {
+        0,
+        1,
+        2,
+    }
+    listed = {
+        job["id"] for job in client.get("/api/v1/jobs?status=done").json()["jobs"]
+    }
+    assert set(ids) <= listed
+
+
+def test_job_api_rejects_invalid_specs(study, tmp_path):
+    client = TestClient(app)
+    bad = spec(study, tmp_path / "a.nii.gz") | {"masks": ["missing.nii.gz"]}
+
+    response = client.post(
+        "/api/v1/jobs", json=[spec(study, tmp_path / "b.nii.gz"), bad]
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"] == [
+        {"job": 1, "problems": ["Mask not found: missing.nii.gz"]}
+    ]
+    assert client.get("/api/v1/jobs/unknown").status_code == 404
+
+
+def test_queue_runs_at_most_workers_and_cancels_waiting_jobs(study, tmp_path):
+    queue = JobQueue(workers=1)
+    try:
+        first = queue.submit(JobSpec(**spec(study, tmp_path / "a.nii.gz")).to_job())
+        second = queue.submit(JobSpec(**spec(study, tmp_path / "b.nii.gz")).to_job())
+
+        assert (first["status"], second["status"]) == ("running", "queued")
+        assert queue.cancel(second["id"]) and second["status"] == "cancelled"
+        assert not queue.cancel(first["id"])
+    finally:
+        queue.shutdown()
+    assert first["status"] == "done"
+    assert queue.counts() == {
+        "queued": 0,
+        "running": 0,
+        "done": 1,
+        "failed": 0,
+        "cancelled": 1,
+    }
+
+
+def test_queue_memory_limit_lowers_concurrency(study, tmp_path):
+    jobs = [
+        JobSpec(**spec(study, tmp_path / f"{name}.nii.gz")).to_job() for name in "ab"
+    ]
+    peak = plan_job(jobs[0])["peak_bytes"]
+    queue = JobQueue(workers=2, memory_limit=int(peak * 1.5))
+    try:
+        first, second = (queue.submit(job, queue.plan(job)) for job in jobs)
+        assert (first["status"], second["status"]) == ("running", "queued")
+        deadline = time.time() + 120
+        while second["status"] != "done" and time.time() < deadline:
+            time.sleep(0.1)
+    finally:
+        queue.shutdown()
+    assert first["status"] == second["status"] == "done"
+    assert second["started"] >= first["finished"]
+    with pytest.raises(ValueError, match="exceeds the limit"):
+        small = JobQueue(workers=1, memory_limit=1024)
+        small.submit(jobs[0], small.plan(jobs[0]))
+
+
+def test_queue_recovers_from_a_dead_worker(study, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs_module, "run_job", run_or_crash)
+    queue = JobQueue(workers=1)
+    try:
+        crashed = queue.submit(
+            JobSpec(**spec(study, tmp_path / "a.nii.gz")).to_job() | {"crash": True}
+        )
+        deadline = time.time() + 60
+        while crashed["status"] == "running" and time.time() < deadline:
+            time.sleep(0.05)
+        after = queue.submit(JobSpec(**spec(study, tmp_path / "b.nii.gz")).to_job())
+        while after["status"] == "running" and time.time() < deadline + 60:
+            time.sleep(0.1)
+        # A pool that broke before its callbacks ran is replaced when the next job is submitted
+        broken = ProcessPoolExecutor(1)
+        with pytest.raises(BrokenProcessPool):
+            broken.submit(os._exit, 137).result()
+        queue._pool = broken
+        last = queue.submit(JobSpec(**spec(study, tmp_path / "c.nii.gz")).to_job())
+        while last["status"] == "running" and time.time() < deadline + 120:
+            time.sleep(0.1)
+    finally:
+        queue.shutdown()
+
+    assert crashed["status"] == "failed" and "BrokenProcessPool" in crashed["error"]
+    assert after["status"] == last["status"] == "done"
+    assert queue.counts() == {
+        "queued": 0,
+        "running": 0,
+        "done": 2,
+        "failed": 1,
+        "cancelled": 0,
+    }
@@ -0,0 +1,52 @@
+import numpy as np
+from fastapi.testclient import TestClient
+
+from MaskRegistration.metrics import Histogram, StageTimer
+from MaskRegistration.web.app import app
+
+
+def test_stage_timer_accumulates_calls_and_memory():
+    timer = StageTimer()
+
+    for _ in range(2):
+        with timer.stage("allocate"):
+            np.ones(1_000_000, dtype=np.uint8)
+    with timer.stage("idle"):
+        pass
+
+    timings = timer.as_dict()
+    assert list(timings) == ["allocate", "idle"]
+    assert timings["allocate"]["calls"] == 2
+    assert timings["allocate"]["peak_bytes"] >= 1_000_000
+    assert timings["idle"]["peak_bytes"] < 1_000_000
+    assert all(
+        stage["rss_bytes"] is None or stage["rss_bytes"] > 0
+        for stage in timings.values()
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(
+        "test_seconds", "Test histogram", ("stage",), buckets=(0.1, 1.0)
+    )
+
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, 'say "hi"')
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="say \\"hi\\"",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="say \\"hi\\"",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{stage="say \\"hi\\"",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="say \\"hi\\""} 3' in lines
+
+
+def test_metrics_endpoint_reports_route_latency():
+    client = TestClient(app)
+    client.get("/api/status/unknown")
+
+    response = client.get("/api/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'route="/api/status/{task_id}",status="404"' in response.text
+    assert "maskregistration_plan_cache_requests_total" in response.text
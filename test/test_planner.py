@@ -0,0 +1,208 @@
+import json
+import subprocess
+import sys
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from MaskRegistration.metrics import peak_rss_bytes
+from MaskRegistration.planner import (
+    admits,
+    choose_strategy,
+    estimate,
+    parse_size,
+    read_inputs,
+)
+from MaskRegistration.synthetic import write_series
+
+
+@pytest.fixture(scope="module")
+def study(tmp_path_factory):
+    root = tmp_path_factory.mktemp("study")
+    write_series(root / "source", size=(64, 48), slices=16, echoes=2, labels=2)
+    write_series(
+        root / "target",
+        size=(40, 40),
+        slices=12,
+        orientation="axial",
+        spacing=(0.6, 0.6, 1.5),
+    )
+    return root
+
+
+# Runs the command line tool and reports the peak resident memory of the process
+MEASURED_RUN = """
+import sys
+from MaskRegistration.MaskRegistration import main
+from MaskRegistration.metrics import peak_rss_bytes
+
+sys.argv = ["maskregistration", *sys.argv[1:]]
+main()
+print(peak_rss_bytes())
+"""
+
+
+@pytest.fixture(scope="module")
+def inputs(study):
+    return read_inputs(
+        study / "source", [study / "source" / "mask.nii.gz"], study / "target"
+    )
+
+
+def test_parse_size():
+    assert parse_size("512M") == 512 * 1024**2
+    assert parse_size("1.5GiB") == int(1.5 * 1024**3)
+    assert parse_size("2048") == 2048
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_inputs_are_read_from_headers(inputs):
+    assert inputs["source"]["size"] == [64, 48, 16] and inputs["source"]["echos"] == 2
+    assert inputs["target"]["size"] == [40, 40, 12] and inputs["target"]["files"] == 12
+    assert inputs["masks"] == [
+        {"shape": [64, 48, 16], "itemsize": inputs["masks"][0]["itemsize"]}
+    ]
+
+
+def test_estimates_follow_the_grid_and_the_held_results(inputs):
+    plain = estimate(inputs, subpixel_factor=1)
+    subpixel = estimate(inputs, subpixel_factor=9)
+    chunked = estimate(inputs, subpixel_factor=9, chunk_slices=2)
+    sequential = estimate(inputs, subpixel_factor=9, sequential_trials=True)
+
+    assert (
+        subpixel["stages"]["resample"]["memory_bytes"]
+        > plain["stages"]["resample"]["memory_bytes"]
+    )
+    assert (
+        chunked["stages"]["resample"]["memory_bytes"]
+        < subpixel["stages"]["resample"]["memory_bytes"]
+    )
+    assert (
+        sequential["stages"]["score"]["memory_bytes"]
+        < subpixel["stages"]["score"]["memory_bytes"]
+    )
+    # The winner of the trials is registered again
+    assert (
+        sequential["stages"]["resample"]["seconds"]
+        > subpixel["stages"]["resample"]["seconds"]
+    )
+    assert (
+        chunked["options"]["chunk_slices"] == 2
+        and sequential["options"]["sequential_trials"]
+    )
+    assert plain["peak_bytes"] == max(
+        stage["memory_bytes"] for stage in plain["stages"].values()
+    )
+
+
+def test_memory_limit_picks_a_strategy_or_refuses(inputs):
+    plain = estimate(inputs, subpixel_factor=50)
+    leanest = estimate(
+        inputs, subpixel_factor=50, chunk_slices=1, sequential_trials=True
+    )
+
+    assert (
+        choose_strategy(inputs, subpixel_factor=50)["options"]["chunk_slices"] is None
+    )
+    plan = choose_strategy(
+        inputs, subpixel_factor=50, memory_limit=plain["peak_bytes"] - 1
+    )
+    assert plan["fits"] and plan["peak_bytes"] < plain["peak_bytes"]
+    assert plan["options"]["chunk_slices"] or plan["options"]["sequential_trials"]
+    assert not choose_strategy(
+        inputs, subpixel_factor=50, memory_limit=leanest["peak_bytes"] - 1
+    )["fits"]
+
+
+def test_admission_keeps_running_peaks_under_the_limit():
+    assert admits([], 10, memory_limit=5)
+    assert admits([4], 4, memory_limit=8)
+    assert not admits([4], 5, memory_limit=8)
+    assert admits([4, 4], 100, memory_limit=None)
+
+
+def test_cli_plan_reads_headers_only(study, tmp_path):
+    args = [
+        "-d1",
+        study / "source",
+        "-m",
+        study / "source" / "mask.nii.gz",
+        "-d2",
+        study / "target",
+    ]
+    command = [
+        sys.executable,
+        "-m",
+        "MaskRegistration.MaskRegistration",
+        *map(str, args),
+        "--subpixel",
+        "3",
+    ]
+
+    plan = json.loads(
+        subprocess.run(
+            [*command, "--plan"], capture_output=True, text=True, check=True
+        ).stdout
+    )
+    refused = subprocess.run(
+        [*command, "-o", str(tmp_path / "out.nii.gz"), "--max-memory", "1M"],
+        capture_output=True,
+        text=True,
+    )
+
+    assert (
+        plan["fits"]
+        and "downsample" in plan["stages"]
+        and plan["options"]["subpixel"] == 3
+    )
+    assert not (tmp_path / "out.nii.gz").exists()
+    assert refused.returncode == 1 and "Refusing the job" in refused.stderr
+
+
+@pytest.mark.skipif(
+    peak_rss_bytes() is None, reason="peak resident memory is not reported"
+)
+@pytest.mark.parametrize(
+    "dense, backend, limit, chunked",
+    [(False, "numpy", "280M", True), (True, "sitk", "250M", False)],
+)
+def test_run_stays_under_the_memory_limit(tmp_path, dense, backend, limit, chunked):
+    # The subpixel grid (192 x 192 x 64 x 9 voxels) needs chunking below 280M on the
+    # numpy backend; its full resampling plan alone would take 85 MiB
+    write_series(tmp_path / "source", size=(64, 64), slices=64, labels=2)
+    write_series(
+        tmp_path / "target",
+        size=(192, 192),
+        slices=64,
+        orientation="axial",
+        tilt=10,
+        spacing=(0.4, 0.4, 1.2),
+    )
+    mask = tmp_path / "source" / "mask.nii.gz"
+    if dense:
+        # Every voxel labelled, the worst case for the label reduction and statistics
+        image = nib.load(mask)
+        labels = np.random.default_rng(0).integers(0, 4, image.shape, np.uint8)
+        mask = tmp_path / "dense.nii.gz"
+        nib.save(nib.Nifti1Image(labels, image.affine, image.header), mask)
+    args = ["-d1", tmp_path / "source", "-m", mask, "-d2", tmp_path / "target"]
+    args = [*map(str, args), "-o", str(tmp_path / "out.nii.gz"), "--subpixel", "9"]
+    args += ["--reverse", "false", "--backend", backend, "--max-memory", limit]
+
+    cli = [sys.executable, "-m", "MaskRegistration.MaskRegistration"]
+    plan = subprocess.run(
+        [*cli, *args, "--plan"], capture_output=True, text=True, check=True
+    )
+    run = subprocess.run(
+        [sys.executable, "-c", MEASURED_RUN, *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    plan = json.loads(plan.stdout)
+    assert plan["fits"] and bool(plan["options"]["chunk_slices"]) == chunked
+    assert int(run.stdout.splitlines()[-1]) <= parse_size(limit)
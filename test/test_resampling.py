@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from MaskRegistration.backend import _register_mask, _register_mask_cropped
+from MaskRegistration.resampling import (
+    Geometry,
+    NumpyBackend,
+    ResamplingPlan,
+    SimpleITKBackend,
+)
+from MaskRegistration.utils import downsample_with_or
+
+CORONAL = (1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, -1.0, 0.0)
+SAGITTAL = (0.0, 0.0, -1.0, 1.0, 0.0, 0.0, 0.0, -1.0, 0.0)
+c, s = np.cos(np.radians(12)), np.sin(np.radians(12))
+OBLIQUE = tuple(
+    (np.array(CORONAL).reshape(3, 3) @ [[c, -s, 0], [s, c, 0], [0, 0, 1]]).ravel()
+)
+
+
+def sitk_register(
+    arr: np.ndarray, source: Geometry, target: Geometry, subpixel_factor: int
+):
+    mask = sitk.GetImageFromArray(arr.astype(np.float32))
+    mask.SetOrigin(source.origin)
+    mask.SetSpacing(source.spacing)
+    mask.SetDirection(source.direction)
+
+    grid = target.with_subpixel(subpixel_factor)
+    resampler = sitk.ResampleImageFilter()
+    resampler.SetInterpolator(sitk.sitkNearestNeighbor)
+    resampler.SetSize(grid.size)
+    resampler.SetOutputOrigin(grid.origin)
+    resampler.SetOutputSpacing(grid.spacing)
+    resampler.SetOutputDirection(grid.direction)
+    resampler.SetOutputPixelType(sitk.sitkInt8)
+    result = sitk.GetArrayFromImage(sitk.Cast(resampler.Execute(mask), sitk.sitkUInt8))
+    return (
+        downsample_with_or(result, subpixel_factor) if subpixel_factor > 1 else result
+    )
+
+
+@pytest.fixture
+def source():
+    return Geometry((-3.2, 10.5, 4.1), (0.7, 0.55, 1.5), CORONAL, (30, 26, 14))
+
+
+@pytest.fixture
+def labels(source):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 5, source.shape).astype(np.uint8)
+
+
+@pytest.mark.parametrize(
+    "direction, separable",
+    [(CORONAL, True), (SAGITTAL, True), (OBLIQUE, False)],
+)
+@pytest.mark.parametrize("subpixel_factor", [1, 3])
+def test_plan_matches_simpleitk(source, labels, direction, separable, subpixel_factor):
+    target = Geometry((-1.9, 11.0, 3.3), (0.9, 0.8, 2.1), direction, (22, 20, 9))
+
+    plan = ResamplingPlan.build(source, target, subpixel_factor)
+
+    assert plan.separable == separable
+    np.testing.assert_array_equal(
+        plan.apply(labels), sitk_register(labels, source, target, subpixel_factor)
+    )
+
+
+def test_plan_matches_simpleitk_on_half_voxel_grid(source, labels):
+    # Upsampling the source grid itself puts every other target point exactly halfway
+    plan = ResamplingPlan.build(source, source, subpixel_factor=2)
+
+    np.testing.assert_array_equal(
+        plan.apply(labels), sitk_register(labels, source, source, 2)
+    )
+
+
+def test_plan_roundtrip(source, labels, tmp_path):
+    target = Geometry((-1.9, 11.0, 3.3), (0.9, 0.8, 2.1), OBLIQUE, (22, 20, 9))
+    plan = ResamplingPlan.build(source, target, reverse=True)
+
+    plan.save(tmp_path / "plan.npz")
+    loaded = ResamplingPlan.load(tmp_path / "plan.npz")
+
+    assert (
+        loaded.source == source and loaded.target == target and loaded.reverse is True
+    )
+    np.testing.assert_array_equal(loaded.apply(labels), plan.apply(labels))
+
+
+@pytest.mark.parametrize("use_plans", [True, False])
+@pytest.mark.parametrize("direction", [CORONAL, OBLIQUE])
+def test_numpy_backend_matches_simpleitk_backend(source, direction, use_plans):
+    rng = np.random.default_rng(1)
+    labels = rng.integers(0, 300, source.shape).astype(np.uint16)
+    target = Geometry((-1.9, 11.0, 3.3), (0.9, 0.8, 2.1), direction, (22, 20, 9))
+
+    result = NumpyBackend(slab_size=4, use_plans=use_plans).resample(
+        labels, source, target
+    )
+
+    assert result.dtype == np.uint8
+    np.testing.assert_array_equal(
+        result, SimpleITKBackend().resample(labels, source, target)
+    )
+
+
+def test_numpy_backend_with_transform(source, labels):
+    target = Geometry((-1.9, 11.0, 3.3), (0.9, 0.8, 2.1), CORONAL, (22, 20, 9))
+    euler = sitk.Euler3DTransform()
+    euler.SetCenter((4.0, 12.0, 0.5))
+    euler.SetRotation(0.1, -0.05, 0.2)
+    euler.SetTranslation((1.5, -0.7, 2.0))
+
+    result = NumpyBackend(slab_size=4).resample(labels, source, target, euler)
+
+    np.testing.assert_array_equal(
+        result, SimpleITKBackend().resample(labels, source, target, euler)
+    )
+
+
+@pytest.mark.parametrize("backend", ["numpy", "sitk"])
+@pytest.mark.parametrize("direction", [CORONAL, OBLIQUE])
+def test_cropped_registration_matches_full_grid(source, direction, backend):
+    labels = np.zeros(source.shape, dtype=np.uint8)
+    labels[4:8, 10:14, 6:11] = 2
+    labels[6, 12, 20] = 1
+    target = Geometry((-1.9, 11.0, 3.3), (0.9, 0.8, 2.1), direction, (22, 20, 9))
+
+    full = _register_mask(labels, source, target, 3, backend)
+    cropped, offset = _register_mask_cropped(labels, source, target, 3, backend)
+
+    assert cropped.size < full.size
+    assert np.count_nonzero(cropped) == np.count_nonzero(full)
+    np.testing.assert_array_equal(
+        _register_mask(labels, source, target, 3, backend, crop=True), full
+    )
+
+
+def test_cropped_registration_of_empty_mask(source):
+    target = Geometry((-1.9, 11.0, 3.3), (0.9, 0.8, 2.1), CORONAL, (22, 20, 9))
+    empty = np.zeros(source.shape, dtype=np.uint8)
+
+    result = _register_mask(empty, source, target, 3, "numpy", crop=True)
+
+    assert result.shape == target.shape and not result.any()
+
+
+@pytest.mark.parametrize("backend", ["numpy", "sitk"])
+@pytest.mark.parametrize("direction", [CORONAL, OBLIQUE])
+def test_chunked_registration_matches_full_grid(source, labels, direction, backend):
+    target = Geometry((-1.9, 11.0, 3.3), (0.9, 0.8, 2.1), direction, (22, 20, 9))
+
+    full = _register_mask(labels, source, target, 3, backend)
+
+    for chunk_slices in (1, 4):
+        chunked = _register_mask(
+            labels, source, target, 3, backend, chunk_slices=chunk_slices
+        )
+        np.testing.assert_array_equal(chunked, full)
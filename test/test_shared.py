@@ -0,0 +1,174 @@
+import base64
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from MaskRegistration.synthetic import write_series
+from MaskRegistration.web.app import DataStore, app, store
+from MaskRegistration.web.shared import VolumeRegistry
+
+# Second server process: attaches to the registry and answers a few requests
+WORKER = """
+import base64, json, sys
+from fastapi.testclient import TestClient
+from MaskRegistration.web.app import DataStore, app, store
+
+client = TestClient(app)
+png = client.get("/api/slice/source/5?mask=true").content
+client.post("/api/output", json={"path": "from-worker.nii.gz"}).raise_for_status()
+volume = store.get_dicom("source")
+print(json.dumps({
+    "png": base64.b64encode(png).decode(),
+    "status": client.get("/api/status/task").json(),
+    "files": [volume.filename, store.source_mask.filename],
+    "writeable": bool(volume.flags.writeable),
+}))
+"""
+
+
+@pytest.fixture
+def shared_store(tmp_path, monkeypatch):
+    write_series(tmp_path / "source", size=(48, 40), slices=10, labels=2)
+    monkeypatch.setattr(store, "registry", VolumeRegistry(tmp_path / "shared"))
+    monkeypatch.setattr(store, "_stamp", None)
+    store.reset()
+    yield tmp_path
+    store.reset()
+
+
+def test_registry_writes_arrays_once_and_copies_mapped_files(tmp_path):
+    registry = VolumeRegistry(tmp_path / "shared")
+    volume = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+    mapped = np.memmap(
+        tmp_path / "mask.raw",
+        dtype=np.uint8,
+        mode="w+",
+        offset=0,
+        shape=(4, 3, 2),
+        order="F",
+    )
+    mapped[:] = 1
+    mapped.flush()
+
+    state = registry.update(
+        lambda s: s["arrays"].update(
+            volume=registry.put("volume", volume), mask=registry.put("mask", mapped.T)
+        )
+    )
+    attached = {
+        name: VolumeRegistry.attach(entry) for name, entry in state["arrays"].items()
+    }
+
+    np.testing.assert_array_equal(attached["volume"], volume)
+    np.testing.assert_array_equal(attached["mask"], mapped.T)
+    assert sorted(p.name for p in (tmp_path / "shared").glob("*.bin")) == sorted(
+        os.path.basename(arr.filename) for arr in attached.values()
+    )
+    # A memory-mapped array is copied, so removing its file does not affect the state
+    del mapped
+    os.unlink(tmp_path / "mask.raw")
+    np.testing.assert_array_equal(VolumeRegistry.attach(state["arrays"]["mask"]), 1)
+    # Files the state no longer names are removed
+    registry.update(lambda s: s["arrays"].clear())
+    assert list((tmp_path / "shared").glob("*.bin")) == []
+
+
+def test_second_process_serves_the_same_data_without_copies(shared_store):
+    client = TestClient(app)
+    client.post(
+        "/api/dicom/source", json={"path": (shared_store / "source").as_posix()}
+    ).raise_for_status()
+    client.post(
+        "/api/mask/source",
+        json={"path": (shared_store / "source" / "mask.nii.gz").as_posix()},
+    )
+    store.set_task("task", {"status": "done", "message": "", "quality": "full"})
+    expected = client.get("/api/slice/source/5?mask=true").content
+
+    env = {**os.environ, "MASKREGISTRATION_SHARED_DIR": str(shared_store / "shared")}
+    worker = subprocess.run(
+        [sys.executable, "-c", WORKER],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(worker.stdout.splitlines()[-1])
+
+    assert base64.b64decode(result["png"]) == expected
+    assert result["status"]["quality"] == "full"
+    # Volume and mask are files of the registry, mapped read-only
+    for file in result["files"]:
+        assert os.path.dirname(file) == str(shared_store / "shared")
+    assert not result["writeable"]
+    # Changes of the other process are attached on the next request
+    client.get("/api/spatial-relation")
+    assert store.output_path == "from-worker.nii.gz"
+
+
+def test_changes_of_two_processes_are_not_lost(tmp_path):
+    first, second = DataStore(), DataStore()
+    first.registry, second.registry = VolumeRegistry(tmp_path), VolumeRegistry(tmp_path)
+
+    def change_mask_path():
+        with second.locked():
+            second.source_mask_path = "mask.nii.gz"
+            second.save()
+
+    with first.locked():
+        first.output_path = "out.nii.gz"
+        other = threading.Thread(target=change_mask_path)
+        other.start()
+        # The second store waits for the first one to publish before it reads the state
+        other.join(timeout=0.2)
+        assert other.is_alive()
+        first.save()
+    other.join()
+
+    fields = VolumeRegistry(tmp_path).read()["fields"]
+    assert (
+        fields["output_path"] == "out.nii.gz"
+        and fields["source_mask_path"] == "mask.nii.gz"
+    )
+    first.refresh()
+    assert first.source_mask_path == "mask.nii.gz"
+
+
+def test_refresh_waits_for_writers_and_retries_failed_attaches(tmp_path, monkeypatch):
+    writer, reader = DataStore(), DataStore()
+    writer.registry, reader.registry = VolumeRegistry(tmp_path), VolumeRegistry(
+        tmp_path
+    )
+    with writer.locked():
+        writer.source_mask = np.ones((2, 3, 4), dtype=np.uint8)
+        writer.changed()
+
+    attach = VolumeRegistry.attach
+
+    def missing(entry):
+        raise FileNotFoundError(entry["file"])
+
+    monkeypatch.setattr(VolumeRegistry, "attach", staticmethod(missing))
+    with pytest.raises(FileNotFoundError):
+        reader.refresh()
+    monkeypatch.setattr(VolumeRegistry, "attach", staticmethod(attach))
+    # The state was not attached, so the next refresh tries again
+    reader.refresh()
+    np.testing.assert_array_equal(reader.source_mask, 1)
+
+    with writer.locked():
+        writer.source_mask = np.zeros((2, 3, 4), dtype=np.uint8)
+        writer.changed()
+        other = threading.Thread(target=reader.refresh)
+        other.start()
+        # The files of the old state are removed while the writer holds the lock
+        other.join(timeout=0.2)
+        assert other.is_alive()
+    other.join()
+    np.testing.assert_array_equal(reader.source_mask, 0)
@@ -0,0 +1,139 @@
+import sys
+
+import nibabel as nib
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from MaskRegistration import transform
+from MaskRegistration.MaskRegistration import main
+from MaskRegistration.synthetic import write_series
+from MaskRegistration.utils import split_dcm
+
+
+def read_labels(nii_file):
+    return np.round(nib.load(nii_file).get_fdata()).astype(np.uint8)
+
+
+@pytest.mark.parametrize("slice_order", ["ascending", "descending", "interleaved"])
+def test_series_echoes_and_slice_order(tmp_path, slice_order):
+    files = write_series(
+        tmp_path, size=(24, 20), slices=6, echoes=3, slice_order=slice_order, labels=2
+    )
+
+    reader = sitk.ImageSeriesReader()
+    echoes = split_dcm(reader.GetGDCMSeriesFileNames(tmp_path.as_posix()))
+
+    assert len(files) == 18
+    assert [len(echo) for echo in echoes] == [6, 6, 6]
+    assert read_labels(tmp_path / "mask.nii.gz").shape == (24, 20, 6)
+
+
+def test_transform_onto_itself_keeps_mask(tmp_path):
+    write_series(tmp_path / "series", labels=3)
+    output = tmp_path / "out.nii.gz"
+
+    result = transform(
+        tmp_path / "series",
+        tmp_path / "series" / "mask.nii.gz",
+        tmp_path / "series",
+        output,
+    )
+
+    assert result["used_reverse"] is False
+    np.testing.assert_array_equal(
+        read_labels(output), read_labels(tmp_path / "series" / "mask.nii.gz")
+    )
+
+
+def test_transform_across_orientations_keeps_labels(tmp_path):
+    write_series(tmp_path / "source", labels=3, echoes=2)
+    write_series(
+        tmp_path / "target",
+        size=(48, 40),
+        slices=24,
+        echoes=3,
+        orientation="axial",
+        slice_order="descending",
+        spacing=(0.7, 0.7, 1.5),
+        tilt=10,
+    )
+    output = tmp_path / "out.nii.gz"
+
+    result = transform(
+        tmp_path / "source",
+        tmp_path / "source" / "mask.nii.gz",
+        tmp_path / "target",
+        output,
+    )
+
+    assert set(np.unique(read_labels(output))) == {0, 1, 2, 3}
+    assert "resample" in result["timings"]
+
+
+def test_transform_registers_several_masks_in_one_pass(tmp_path):
+    write_series(tmp_path / "source", labels=3)
+    write_series(
+        tmp_path / "target",
+        size=(48, 40),
+        slices=20,
+        orientation="axial",
+        spacing=(0.7, 0.7, 1.5),
+    )
+    mask = nib.load(tmp_path / "source" / "mask.nii.gz")
+    single = np.where(
+        read_labels(tmp_path / "source" / "mask.nii.gz") == 2, 2, 0
+    ).astype(np.uint8)
+    nib.save(nib.Nifti1Image(single, mask.affine), tmp_path / "single.nii.gz")
+    masks = [tmp_path / "source" / "mask.nii.gz", tmp_path / "single.nii.gz"]
+    outputs = [tmp_path / "all.nii.gz", tmp_path / "label2.nii.gz"]
+
+    result = transform(tmp_path / "source", masks, tmp_path / "target", outputs)
+
+    assert result["outputs"] == outputs and len(result["labels"]) == 2
+    for mask_file, output in zip(masks, outputs):
+        alone = transform(
+            tmp_path / "source",
+            mask_file,
+            tmp_path / "target",
+            tmp_path / "alone.nii.gz",
+        )
+        assert alone["used_reverse"] == result["used_reverse"]
+        np.testing.assert_array_equal(
+            read_labels(output), read_labels(tmp_path / "alone.nii.gz")
+        )
+    assert set(np.unique(read_labels(outputs[1]))) == {0, 2}
+
+
+def test_transform_needs_one_output_per_mask(tmp_path):
+    write_series(tmp_path / "source", size=(24, 20), slices=6, labels=2)
+    mask = tmp_path / "source" / "mask.nii.gz"
+
+    with pytest.raises(ValueError, match="2 mask files but 1 output files"):
+        transform(
+            tmp_path / "source",
+            [mask, mask],
+            tmp_path / "source",
+            [tmp_path / "out.nii.gz"],
+        )
+    assert not (tmp_path / "out.nii.gz").exists()
+
+
+@pytest.mark.parametrize(
+    "args, message",
+    [
+        (["-d1", "a", "-d2", "b", "-o", "out.nii.gz"], "-m/--input_mask"),
+        (["-d1", "a", "-m", "mask.nii.gz", "-d2", "b"], "-o/--output_mask"),
+        (
+            ["-d1", "a", "-m", "m1.nii.gz", "m2.nii.gz", "-d2", "b", "-o", "o.nii.gz"],
+            "number of output files",
+        ),
+    ],
+)
+def test_cli_reports_missing_arguments(monkeypatch, capsys, args, message):
+    monkeypatch.setattr(sys, "argv", ["maskregistration", *args])
+
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+
+    assert exit_info.value.code == 2 and message in capsys.readouterr().err
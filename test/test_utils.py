@@ -0,0 +1,132 @@
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from MaskRegistration.utils import (
+    check_transform_mask,
+    decompressed_mask,
+    downsample_with_or,
+    label_statistics,
+    load_mask_array,
+)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    monkeypatch.setenv("MASKREGISTRATION_CACHE_DIR", cache.as_posix())
+    return cache
+
+
+@pytest.fixture
+def labels():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 4, (12, 10, 6)).astype(np.int16)
+
+
+@pytest.mark.parametrize("suffix", [".nii", ".nii.gz"])
+def test_mask_is_memory_mapped_in_stored_dtype(tmp_path, cache_dir, labels, suffix):
+    path = tmp_path / f"mask{suffix}"
+    nib.save(nib.Nifti1Image(labels, np.eye(4)), path)
+
+    arr = load_mask_array(path)
+
+    assert isinstance(arr, np.memmap)
+    assert arr.dtype == np.int16
+    np.testing.assert_array_equal(arr, labels)
+    # The (z, y, x) view used by the viewer needs no copy
+    assert np.transpose(arr, (2, 1, 0)).flags.c_contiguous
+    assert not cache_dir.exists() or suffix == ".nii.gz"
+
+
+def test_decompressed_copy_is_reused_until_the_file_changes(
+    tmp_path, cache_dir, labels
+):
+    path = tmp_path / "mask.nii.gz"
+    nib.save(nib.Nifti1Image(labels, np.eye(4)), path)
+
+    cached = decompressed_mask(path)
+    assert cached.parent == cache_dir and cached.suffix == ".nii"
+    written = cached.stat()
+    assert decompressed_mask(path) == cached
+    # Not written again (a new copy would be a new file)
+    assert cached.stat().st_ino == written.st_ino
+
+    nib.save(nib.Nifti1Image(labels + 1, np.eye(4)), path)
+    os.utime(path, ns=(written.st_mtime_ns + 10**9,) * 2)
+    assert decompressed_mask(path) != cached
+    np.testing.assert_array_equal(load_mask_array(path), labels + 1)
+    # The outdated copy is removed
+    assert list(cache_dir.iterdir()) == [decompressed_mask(path)]
+
+
+def test_mask_cache_evicts_least_recently_used_copies(
+    tmp_path, cache_dir, labels, monkeypatch
+):
+    paths = [tmp_path / f"mask{i}.nii.gz" for i in range(3)]
+    for path in paths:
+        nib.save(nib.Nifti1Image(labels, np.eye(4)), path)
+    first = decompressed_mask(paths[0])
+    monkeypatch.setenv("MASKREGISTRATION_CACHE_SIZE", str(2 * first.stat().st_size))
+
+    second = decompressed_mask(paths[1])
+    os.utime(first, ns=(1, 1))
+    os.utime(second, ns=(2, 2))
+    # Using a copy makes it the most recently used one
+    assert decompressed_mask(paths[0]) == first
+    third = decompressed_mask(paths[2])
+
+    assert sorted(cache_dir.iterdir()) == sorted([first, third])
+
+
+def test_label_statistics_match_per_label_scans(labels):
+    labels = labels.copy()
+    labels[labels == 2] = 0
+
+    stats = label_statistics(labels, spacing=(0.5, 2.0, 3.0))
+
+    assert list(stats) == [1, 3]
+    for label, s in stats.items():
+        where = np.argwhere(labels == label)
+        assert s["voxels"] == len(where)
+        assert s["volume_mm3"] == pytest.approx(len(where) * 3.0)
+        assert s["bbox"] == (tuple(where.min(axis=0)), tuple(where.max(axis=0) + 1))
+    # Rescaled NIfTI data comes back as floats close to the labels
+    assert label_statistics(labels * 0.996) == label_statistics(labels)
+    assert label_statistics(np.zeros((2, 3, 4))) == {}
+    # Negative values (e.g. -1 for "ignore") are no labels
+    ignored = np.where(labels == 1, -1, labels).astype(np.int16)
+    assert label_statistics(ignored) == {3: label_statistics(labels)[3]}
+    assert label_statistics(-np.ones((2, 3, 4), dtype=np.int16)) == {}
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.uint8, np.float32])
+def test_downsample_with_or_matches_full_volume_scan(labels, dtype):
+    factor = 3
+    expected = np.zeros((labels.shape[0] // factor, *labels.shape[1:]), dtype=np.uint8)
+    for label in (1, 2, 3):
+        for z in range(expected.shape[0]):
+            expected[z][
+                (labels[z * factor : (z + 1) * factor] == label).any(axis=0)
+            ] = label
+
+    # Resampled float labels are rounded
+    scale = 0.996 if dtype == np.float32 else 1
+    assert np.array_equal(
+        downsample_with_or((labels * scale).astype(dtype), factor), expected
+    )
+
+
+def test_check_transform_mask_reports_lost_labels(labels):
+    registered = labels[::2].copy()
+    registered[registered == 3] = 0
+
+    report = check_transform_mask(labels, registered, (1.0, 1.0, 1.0), (1.0, 1.0, 2.0))
+
+    assert report["missing"] == [3] and report["added"] == []
+    assert report["labels"][3]["registered_mm3"] == 0.0
+    assert report["labels"][1]["ratio"] == pytest.approx(
+        2 * np.sum(labels[::2] == 1) / np.sum(labels == 1)
+    )
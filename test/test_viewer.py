@@ -0,0 +1,339 @@
+import io
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+from fastapi import Response
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from MaskRegistration.resampling import Geometry
+from MaskRegistration.synthetic import write_series
+from MaskRegistration.web import app as web_app
+from MaskRegistration.web.app import app, render_cache, store
+from MaskRegistration.web.viewer import (
+    RenderCache,
+    Viewport,
+    normalize_dicom,
+    slice_with_mask_to_png,
+)
+
+
+def decode(png: bytes) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(png)))
+
+
+def test_full_frame_viewport_matches_plain_rendering():
+    rng = np.random.default_rng(0)
+    volume = rng.integers(0, 1000, (3, 20, 30)).astype(np.int16)
+    mask = rng.integers(0, 4, (3, 20, 30)).astype(np.uint8)
+
+    plain = slice_with_mask_to_png(volume, mask, 1)
+    viewport = slice_with_mask_to_png(volume, mask, 1, viewport=Viewport.parse(30, 20))
+
+    assert np.array_equal(decode(plain), decode(viewport))
+
+
+def test_viewport_crops_with_slice_window_and_scales_down():
+    volume = np.arange(2 * 20 * 30, dtype=np.float32).reshape(2, 20, 30)
+    viewport = Viewport.parse(30, 20, roi_x=10, roi_y=5, roi_w=8, roi_h=6)
+
+    image = decode(slice_with_mask_to_png(volume, None, 0, viewport=viewport))
+
+    # Windowed like the whole slice, then cut out
+    expected = normalize_dicom(volume[0], tuple(np.percentile(volume[0], (1, 99))))[
+        5:11, 10:18
+    ]
+    assert image.shape == (6, 8, 3)
+    assert np.array_equal(image[..., 0], expected)
+
+    scaled = Viewport.parse(
+        30, 20, roi_x=10, roi_y=5, roi_w=8, roi_h=6, out_w=4, out_h=100
+    )
+    assert scaled.key() == (10, 5, 8, 6, 4, 6)
+    assert decode(slice_with_mask_to_png(volume, None, 0, viewport=scaled)).shape == (
+        6,
+        4,
+        3,
+    )
+
+
+def test_viewport_grid_samples_frame_pixel_centres():
+    frame = Geometry(
+        (1.0, 2.0, 3.0), (0.5, 0.5, 2.0), tuple(np.eye(3).ravel()), (30, 20, 4)
+    )
+    grid = Viewport.parse(
+        30, 20, roi_x=10, roi_y=4, roi_w=8, roi_h=6, out_w=4, out_h=3
+    ).grid(frame, 2)
+
+    assert grid.size == (4, 3, 1)
+    assert np.allclose(grid.spacing, (1.0, 1.0, 2.0))
+    # First output pixel covers frame columns 10-11 and rows 4-5
+    assert np.allclose(grid.origin, (1.0 + 10.5 * 0.5, 2.0 + 4.5 * 0.5, 3.0 + 2 * 2.0))
+
+
+def test_render_cache_evicts_least_recently_used():
+    cache = RenderCache(max_bytes=10)
+    cache.put(("a",), b"1234")
+    cache.put(("b",), b"1234")
+    cache.get(("a",))
+    cache.put(("c",), b"1234")
+
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) == b"1234"
+    assert cache.nbytes == 8
+
+
+@pytest.fixture
+def loaded_store(tmp_path):
+    write_series(tmp_path / "source", size=(48, 40), slices=10, labels=2)
+    write_series(
+        tmp_path / "target",
+        size=(40, 40),
+        slices=12,
+        orientation="axial",
+        spacing=(0.8, 0.8, 1.5),
+    )
+    client = TestClient(app)
+    client.post(
+        "/api/dicom/source", json={"path": (tmp_path / "source").as_posix()}
+    ).raise_for_status()
+    client.post(
+        "/api/dicom/target", json={"path": (tmp_path / "target").as_posix()}
+    ).raise_for_status()
+    client.post(
+        "/api/mask/source",
+        json={"path": (tmp_path / "source" / "mask.nii.gz").as_posix()},
+    )
+    yield client
+    store.reset()
+
+
+@pytest.mark.parametrize(
+    "endpoint", ["/api/slice/source/5", "/api/slice/aligned/5", "/api/transform/5"]
+)
+def test_slice_endpoints_render_viewport_and_cache_it(loaded_store, endpoint):
+    roi = "roi_x=8&roi_y=4&roi_w=24&roi_h=20&out_w=12&out_h=10"
+
+    full = decode(loaded_store.get(endpoint).content)
+    hits = render_cache.stats["hits"]
+    first = loaded_store.get(f"{endpoint}?{roi}&t=1")
+    second = loaded_store.get(f"{endpoint}?{roi}&t=2")
+
+    assert full.shape[:2] == (40, 48)
+    assert decode(first.content).shape[:2] == (10, 12)
+    assert first.content == second.content
+    assert render_cache.stats["hits"] == hits + 1
+
+
+def test_store_changes_invalidate_rendered_slices(loaded_store):
+    before = loaded_store.get("/api/slice/source/5?mask=true").content
+    render_cache.put(("stale",), b"png")
+
+    loaded_store.post("/api/echo/source/0").raise_for_status()
+
+    assert render_cache.get(("stale",)) is None
+    assert loaded_store.get("/api/slice/source/5?mask=true").content == before
+
+
+def read_frame(websocket) -> tuple[dict, bytes]:
+    frame = websocket.receive_bytes()
+    length = int.from_bytes(frame[:4], "big")
+    return json.loads(frame[4 : 4 + length]), frame[4 + length :]
+
+
+def test_stream_pushes_same_png_as_http(loaded_store):
+    expected = loaded_store.get(
+        "/api/slice/aligned/5?mask=true&roi_w=20&out_w=10"
+    ).content
+
+    with loaded_store.websocket_connect("/api/stream") as websocket:
+        websocket.send_json(
+            {
+                "channel": "aligned",
+                "seq": 1,
+                "endpoint": "aligned",
+                "params": {"index": "5", "mask": "true", "roi_w": "20", "out_w": "10"},
+            }
+        )
+        header, png = read_frame(websocket)
+        websocket.send_json(
+            {
+                "channel": "source",
+                "seq": 2,
+                "endpoint": "slice",
+                "params": {"side": "source", "index": 99},
+            }
+        )
+        error, _ = read_frame(websocket)
+
+    assert header == {"channel": "aligned", "seq": 1}
+    assert png == expected
+    assert error["seq"] == 2 and "Invalid slice index" in error["error"]
+
+
+def test_stream_drops_superseded_views(loaded_store, monkeypatch):
+    release = threading.Event()
+    rendered = []
+
+    def slow_slice(side, index):
+        release.wait(5)
+        rendered.append(index)
+        return Response(content=b"png")
+
+    monkeypatch.setitem(web_app.STREAM_ENDPOINTS, "slice", slow_slice)
+    with loaded_store.websocket_connect("/api/stream") as websocket:
+        for seq in range(1, 5):
+            websocket.send_json(
+                {
+                    "channel": "source",
+                    "seq": seq,
+                    "endpoint": "slice",
+                    "params": {"side": "source", "index": seq},
+                }
+            )
+        time.sleep(0.2)
+        release.set()
+        frames = [read_frame(websocket)[0]["seq"] for _ in range(2)]
+
+    # The first view was already rendering, of the queued ones only the newest is rendered
+    assert frames == [1, 4]
+    assert rendered == [1, 4]
+
+
+def test_stream_reports_failed_renders_and_stays_open(loaded_store, monkeypatch):
+    def failing_slice(side, index):
+        raise {"1": RuntimeError, "2": ValueError}[index]("render failed")
+
+    monkeypatch.setitem(web_app.STREAM_ENDPOINTS, "aligned", failing_slice)
+    with loaded_store.websocket_connect("/api/stream") as websocket:
+        errors = []
+        for seq in (1, 2):
+            websocket.send_json(
+                {
+                    "channel": "aligned",
+                    "seq": seq,
+                    "endpoint": "aligned",
+                    "params": {"side": "source", "index": str(seq)},
+                }
+            )
+            errors.append(read_frame(websocket)[0])
+        websocket.send_json(
+            {
+                "channel": "source",
+                "seq": 3,
+                "endpoint": "slice",
+                "params": {"side": "source", "index": 5},
+            }
+        )
+        header, png = read_frame(websocket)
+
+    assert errors == [
+        {"channel": "aligned", "seq": 1, "error": "RuntimeError: render failed"},
+        {"channel": "aligned", "seq": 2, "error": "ValueError: render failed"},
+    ]
+    assert (
+        header == {"channel": "source", "seq": 3}
+        and png == loaded_store.get("/api/slice/source/5").content
+    )
+
+
+def test_transform_preview_renders_reduced_slice_from_proxies(loaded_store):
+    query = "mask=true&output=target&apply_rotation=true&rotation_z=4&roi_w=30&roi_h=30&out_w=15&out_h=15"
+    store.target_mask_registered = (
+        np.arange(40)[None, :, None] // 8 % 3 * np.ones((12, 40, 40))
+    ).astype(np.uint8)
+    store.changed()
+
+    full = decode(loaded_store.get(f"/api/transform/6?{query}").content)
+    preview = decode(loaded_store.get(f"/api/transform/6?{query}&preview=true").content)
+
+    assert full.shape == (15, 15, 3)
+    assert preview.shape == (8, 8, 3)
+    # Same region and contrast, at half the resolution
+    difference = np.abs(
+        preview[:7, :7].astype(float) - full[:14:2, :14:2].astype(float)
+    )
+    assert np.median(difference) < 20
+
+
+def register_coarse_then_full(client, monkeypatch) -> tuple:
+    """Register with a held back full transform; the coarse and full tasks and results."""
+    from MaskRegistration import backend
+
+    release = threading.Event()
+    full_transform = backend.transform
+
+    def slow_transform(*args, **kwargs):
+        release.wait(10)
+        return full_transform(*args, **kwargs)
+
+    monkeypatch.setattr(backend, "transform", slow_transform)
+
+    def wait_for(task_id, status):
+        for _ in range(200):
+            task = client.get(f"/api/status/{task_id}").json()
+            if task["status"] == status and (
+                status != "running" or task["quality"] == "coarse"
+            ):
+                return task
+            time.sleep(0.05)
+        raise AssertionError(task)
+
+    task_id = client.post("/api/register", json={"reverse": "auto"}).json()["task_id"]
+    coarse_task = wait_for(task_id, "running")
+    coarse = np.asarray(store.target_mask_registered)
+    release.set()
+    full_task = wait_for(task_id, "done")
+    return coarse_task, coarse, full_task, np.round(store.target_mask_registered)
+
+
+def test_register_publishes_coarse_result_before_full_result(loaded_store, monkeypatch):
+    coarse_task, coarse, full_task, full = register_coarse_then_full(
+        loaded_store, monkeypatch
+    )
+
+    assert full_task["quality"] == "full"
+    assert full_task["labels"]["missing"] == []
+    assert coarse.shape == full.shape == store.get_dicom("target").shape
+    assert coarse_task["used_direction"] == full_task["used_direction"]
+    # Every second voxel in-plane is sampled (up to backend ties), the others repeat a neighbour
+    assert np.mean(coarse[:, ::2, ::2] == full[:, ::2, ::2]) > 0.99
+    assert np.mean(coarse == full) > 0.95
+
+
+def test_coarse_result_follows_the_file_order_of_the_mask(tmp_path, monkeypatch):
+    # Three labels are not symmetric along the slice normal, mirrored slices swap two of them
+    write_series(
+        tmp_path / "source",
+        size=(48, 40),
+        slices=12,
+        labels=3,
+        slice_order="descending",
+    )
+    write_series(
+        tmp_path / "target",
+        size=(40, 40),
+        slices=16,
+        orientation="axial",
+        spacing=(0.8, 0.8, 1.5),
+    )
+    client = TestClient(app)
+    for side in ("source", "target"):
+        client.post(
+            f"/api/dicom/{side}", json={"path": (tmp_path / side).as_posix()}
+        ).raise_for_status()
+    client.post(
+        "/api/mask/source",
+        json={"path": (tmp_path / "source" / "mask.nii.gz").as_posix()},
+    )
+    try:
+        _, coarse, _, full = register_coarse_then_full(client, monkeypatch)
+    finally:
+        store.reset()
+
+    labelled = full[:, ::2, ::2] > 0
+    assert labelled.sum() > 0
+    assert np.mean(coarse[:, ::2, ::2][labelled] == full[:, ::2, ::2][labelled]) > 0.9
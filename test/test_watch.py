@@ -0,0 +1,132 @@
+import json
+import os
+
+import nibabel as nib
+import numpy as np
+
+from MaskRegistration import watch
+from MaskRegistration.jobs import run_job
+from MaskRegistration.synthetic import write_series
+from MaskRegistration.watch import (
+    Journal,
+    Rule,
+    StabilityTracker,
+    WatchDaemon,
+    find_jobs,
+)
+
+
+def make_study(root, name="study1"):
+    write_series(root / name / "source", labels=2)
+    write_series(
+        root / name / "target", orientation="axial", slices=12, spacing=(0.6, 0.6, 1.5)
+    )
+    return root / name
+
+
+def run_or_crash(job):
+    """run_job, or kill the worker process like the OOM killer would for the crash study."""
+    if "/crash/" in job["source"]:
+        os._exit(137)
+    return run_job(job)
+
+
+def test_series_is_stable_after_settle_time():
+    tracker = StabilityTracker(settle=10)
+
+    assert not tracker.is_stable("series", (3, 100, 1), now=0)
+    assert not tracker.is_stable("series", (4, 130, 2), now=5)
+    assert not tracker.is_stable("series", (4, 130, 2), now=14)
+    assert tracker.is_stable("series", (4, 130, 2), now=15)
+
+
+def test_find_jobs_waits_for_arriving_series(tmp_path):
+    study = make_study(tmp_path)
+    (tmp_path / "study2" / "target").mkdir(parents=True)
+    tracker = StabilityTracker(settle=60)
+
+    jobs, waiting = find_jobs(tmp_path, [Rule()], tracker, now=1000)
+    assert (jobs, waiting) == ([], 1)
+
+    jobs, waiting = find_jobs(tmp_path, [Rule()], tracker, now=1060)
+    assert waiting == 0
+    assert [job["outputs"] for job in jobs] == [
+        [(study / "registered" / "target" / "mask.nii.gz").as_posix()]
+    ]
+
+
+def test_daemon_registers_once_and_resumes_from_journal(tmp_path):
+    study = make_study(tmp_path / "incoming")
+    journal = tmp_path / "journal.jsonl"
+
+    def daemon():
+        return WatchDaemon(
+            [tmp_path / "incoming"],
+            [Rule(reverse="false")],
+            journal,
+            settle=0,
+            interval=0.05,
+        )
+
+    daemon().run(once=True)
+
+    output = study / "registered" / "target" / "mask.nii.gz"
+    assert set(np.unique(np.round(nib.load(output).get_fdata()))) == {0, 1, 2}
+    entries = [json.loads(line) for line in journal.read_text().splitlines()]
+    assert [entry["status"] for entry in entries] == ["queued", "started", "done"]
+    assert "resample" in entries[-1]["timings"]
+
+    # Finished work is skipped after a restart
+    daemon().run(once=True)
+    assert len(journal.read_text().splitlines()) == 3
+
+    # A job interrupted while running is done again
+    Journal(journal).record(
+        {"id": entries[-1]["job"], "inputs": entries[-1]["inputs"]}, "started"
+    )
+    daemon().run(once=True)
+    statuses = [json.loads(line)["status"] for line in journal.read_text().splitlines()]
+    assert statuses[3:] == ["started", "queued", "started", "done"]
+
+
+def test_daemon_refuses_jobs_over_the_memory_limit(tmp_path):
+    study = make_study(tmp_path / "incoming")
+    journal = tmp_path / "journal.jsonl"
+
+    WatchDaemon(
+        [tmp_path / "incoming"],
+        [Rule()],
+        journal,
+        settle=0,
+        interval=0.05,
+        memory_limit=1024,
+    ).run(once=True)
+
+    entries = [json.loads(line) for line in journal.read_text().splitlines()]
+    assert [entry["status"] for entry in entries] == ["queued", "failed"]
+    assert "exceeds the limit" in entries[-1]["error"]
+    assert not (study / "registered").exists()
+
+
+def test_daemon_survives_a_dead_worker(tmp_path, monkeypatch):
+    make_study(tmp_path / "incoming", "crash")
+    study = make_study(tmp_path / "incoming", "study2")
+    journal = tmp_path / "journal.jsonl"
+    monkeypatch.setattr(watch, "run_job", run_or_crash)
+
+    WatchDaemon(
+        [tmp_path / "incoming"],
+        [Rule(reverse="false")],
+        journal,
+        settle=0,
+        interval=0.05,
+    ).run(once=True)
+
+    entries = [json.loads(line) for line in journal.read_text().splitlines()]
+    final = {entry["source"].split("/")[-2]: entry for entry in entries}
+    assert (
+        final["crash"]["status"] == "failed"
+        and "BrokenProcessPool" in final["crash"]["error"]
+    )
+    assert final["study2"]["status"] == "done"
+    assert (study / "registered" / "target" / "mask.nii.gz").exists()